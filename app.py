@@ -47,8 +47,40 @@ app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)  # Session expiry
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///endcards.db")
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024  # 10MB total upload size (for both files + form data)
+app.config["BULK_MAX_CONTENT_LENGTH"] = 100 * 1024 * 1024  # 100MB total for /api/bulk_upload
 app.config["REQUEST_TIMEOUT"] = 120  # 2 minutes timeout for large uploads
 app.config["UPLOAD_FOLDER"] = "tmp_uploads"
+app.config["UPLOAD_SPOOL_THRESHOLD"] = 256 * 1024  # File parts bigger than this are spooled to disk while parsing
+app.config["SCRATCH_QUOTA_BYTES"] = int(os.environ.get("SCRATCH_QUOTA_BYTES", 2 * 1024 * 1024 * 1024))  # 2GB of spooled uploads
+app.config["SCRATCH_MAX_AGE"] = 2 * 60 * 60  # Seconds before a spooled upload is swept regardless of usage
+app.config["SCRATCH_GRACE_PERIOD"] = 5 * 60  # Seconds a spooled upload is safe from quota sweeps
+app.config["SCRATCH_SWEEP_INTERVAL"] = 60  # Seconds between background sweeps
+app.config["BLOB_STORE_BACKEND"] = os.environ.get("BLOB_STORE_BACKEND", "local")
+app.config["BLOB_STORE_PATH"] = os.environ.get("BLOB_STORE_PATH", "media_blobs")
+app.config["RENDER_CACHE_DIR"] = os.environ.get("RENDER_CACHE_DIR", "render_cache")
+app.config["RENDER_CACHE_MEMORY_BYTES"] = int(os.environ.get("RENDER_CACHE_MEMORY_BYTES", 64 * 1024 * 1024))
+app.config["RENDER_CACHE_DISK_BYTES"] = int(os.environ.get("RENDER_CACHE_DISK_BYTES", 1024 * 1024 * 1024))
+app.config["IMAGE_BYTE_BUDGET"] = int(os.environ.get("IMAGE_BYTE_BUDGET", 1024 * 1024))  # Target size of each optimized image
+app.config["IMAGE_MAX_RESOLUTION"] = os.environ.get("IMAGE_MAX_RESOLUTION", "1080p")  # A SubscriptionTier.max_resolution label
+app.config["CPU_POOL_WORKERS"] = int(os.environ.get("CPU_POOL_WORKERS", os.cpu_count() or 1))  # Processes for encoding and compression
+app.config["CPU_POOL_MAX_PENDING"] = int(os.environ.get("CPU_POOL_MAX_PENDING", 4 * app.config["CPU_POOL_WORKERS"]))  # Tasks queued or running at once
+app.config["CPU_POOL_SUBMIT_TIMEOUT"] = 0.5  # Seconds a request waits for a pool slot before falling back
+app.config["CPU_POOL_TASK_TIMEOUT"] = 60  # Seconds a caller waits for a pool task to finish before falling back
+app.config["GZIP_LEVEL"] = 9  # Precompressed downloads are compressed once, so favour size
+app.config["BROTLI_QUALITY"] = int(os.environ.get("BROTLI_QUALITY", 9))
+app.config["JOB_WORKERS"] = int(os.environ.get("JOB_WORKERS", 2))  # Concurrent conversions per process
+app.config["JOB_POLL_INTERVAL"] = 1.0  # Seconds between queue polls when idle
+app.config["JOB_LEASE"] = 60  # Seconds a running job stays claimed without a heartbeat before it is presumed dead
+app.config["JOB_HEARTBEAT_INTERVAL"] = 15  # Seconds between lease extensions while a job runs
+app.config["JOB_MAX_ATTEMPTS"] = 3  # Claims of a job before one whose worker keeps dying is failed
+app.config["JOB_QUEUE_EXPIRY"] = 60 * 60  # Seconds a job may wait for a worker before it is failed
+app.config["BACKGROUND_WORKERS"] = os.environ.get("BACKGROUND_WORKERS", "true").lower() in ("1", "true", "yes")  # Start background workers at boot
+app.config["SQL_PROFILER_ENABLED"] = os.environ.get("SQL_PROFILER_ENABLED", "").lower() in ("1", "true", "yes")
+app.config["SQL_SLOW_QUERY_MS"] = float(os.environ.get("SQL_SLOW_QUERY_MS", 250))  # Statements slower than this are logged
+app.config["LEDGER_COMPACT_AFTER_DAYS"] = 90  # Credit ledger entries older than this are folded together
+app.config["WEBHOOK_BATCH_SIZE"] = 50  # Inbox events applied per processor pass
+app.config["WEBHOOK_POLL_INTERVAL"] = 5.0  # Seconds between inbox polls when idle
+app.config["WEBHOOK_MAX_ATTEMPTS"] = 5  # Failed applications before an event is given up on
 
 # Google OAuth config
 app.config["GOOGLE_CLIENT_ID"] = os.environ.get("GOOGLE_OAUTH_CLIENT_ID")
@@ -69,7 +101,8 @@ login_manager.session_protection = "strong"
 @login_manager.user_loader
 def load_user(user_id):
     from models import User
-    return User.query.get(int(user_id))
+    # Credits are read on nearly every request, so load them in the same query
+    return db.session.get(User, int(user_id), options=[db.joinedload(User.credits)])
 
 # Create upload folder if it doesn't exist
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
@@ -77,5 +110,9 @@ os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 # Create database tables
 with app.app_context():
     # Import models here to make sure they're registered with SQLAlchemy
-    from models import User, Endcard, UserCredit
-    db.create_all()
\ No newline at end of file
+    from models import User, Endcard, UserCredit, CreditLedger, Job, WebhookEvent
+    db.create_all()
+
+    # Add any columns introduced since the tables were first created
+    from schema import upgrade_schema
+    upgrade_schema(db)
\ No newline at end of file
@@ -1,7 +1,7 @@
 
 import logging
 from functools import wraps
-from flask import session, flash, redirect, url_for
+from flask import session, flash, redirect, url_for, g
 from flask_login import current_user
 from app import db
 from models import UserCredit
@@ -9,7 +9,15 @@ from models import UserCredit
 logger = logging.getLogger(__name__)
 
 def get_current_user():
-    """Get or create a user based on session ID or logged in status"""
+    """Get or create a user based on session ID or logged in status
+
+    The result is kept on flask.g, so the decorators, helpers and the view
+    handling a request all share one user and credit record.
+    """
+    user = g.get('current_user_context')
+    if user is not None:
+        return user
+
     try:
         # If user is authenticated via Flask-Login in production
         if current_user.is_authenticated:
@@ -23,7 +31,9 @@ def get_current_user():
             if hasattr(current_user, 'credits') and current_user.credits:
                 session['credits'] = current_user.credits.credits
 
-            return current_user
+            # Unwrap the LocalProxy so g holds the user object itself
+            g.current_user_context = current_user._get_current_object()
+            return g.current_user_context
     except Exception as e:
         logger.error(f"Error in get_current_user: {str(e)}")
         db.session.rollback()
@@ -36,9 +46,7 @@ def manage_session(f):
         try:
             user = get_current_user()
             if user and user.is_authenticated:
-                # Ensure credits are always synced
-                if hasattr(user, 'credits') and user.credits:
-                    session['credits'] = user.credits.credits
+                # get_current_user has already synced credits into the session
                 if 'user_id' not in session:
                     session['user_id'] = user.id
             else:
@@ -0,0 +1,193 @@
+import os
+import base64
+import hashlib
+import logging
+import tempfile
+from io import BytesIO
+from app import app, db
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks used when copying uploads into the store
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+class BlobStore:
+    """Interface for content-addressed media storage.
+
+    Blobs are keyed by the SHA-256 hex digest of their raw bytes, so storing
+    the same upload twice only keeps one copy.
+    """
+
+    def put(self, stream):
+        """Store the contents of a binary stream and return (key, size)"""
+        raise NotImplementedError
+
+    def open(self, key):
+        """Open a stored blob for reading"""
+        raise NotImplementedError
+
+    def exists(self, key):
+        """Check whether a blob is present in the store"""
+        raise NotImplementedError
+
+    def size(self, key):
+        """Return the size of a stored blob in bytes"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        """Remove a blob from the store"""
+        raise NotImplementedError
+
+    def put_bytes(self, data):
+        """Store raw bytes and return (key, size)"""
+        return self.put(BytesIO(data))
+
+
+class LocalBlobStore(BlobStore):
+    """Blob store backed by the local filesystem.
+
+    Blobs live at <root>/<aa>/<bb>/<sha256> so no single directory grows too large.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        if len(key) != 64 or not all(c in '0123456789abcdef' for c in key):
+            raise ValueError(f"Invalid blob key: {key}")
+        return os.path.join(self.root, key[:2], key[2:4], key)
+
+    def put(self, stream):
+        digest = hashlib.sha256()
+        size = 0
+
+        # Copy into a temp file first so a crashed upload never leaves a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.incoming-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                while True:
+                    chunk = stream.read(COPY_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    tmp_file.write(chunk)
+                    size += len(chunk)
+
+            key = digest.hexdigest()
+            path = self._path(key)
+            if os.path.exists(path):
+                # Identical content is already stored
+                os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+            return key, size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def open(self, key):
+        return open(self._path(key), 'rb')
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+    def size(self, key):
+        return os.path.getsize(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def path(self, key):
+        """Filesystem path of a blob, for handing straight to send_file"""
+        return self._path(key)
+
+
+# Available storage backends, selected with the BLOB_STORE_BACKEND config value
+BLOB_STORE_BACKENDS = {
+    'local': LocalBlobStore,
+}
+
+
+def get_blob_store():
+    """Get the configured blob store, creating it on first use"""
+    store = app.extensions.get('blob_store')
+    if store is None:
+        backend = app.config.get('BLOB_STORE_BACKEND', 'local')
+        if backend not in BLOB_STORE_BACKENDS:
+            raise ValueError(f"Unknown blob store backend: {backend}")
+        store = BLOB_STORE_BACKENDS[backend](app.config['BLOB_STORE_PATH'])
+        app.extensions['blob_store'] = store
+    return store
+
+
+def decode_data_url(data_url):
+    """Split a base64 data URL into its MIME type and raw bytes"""
+    header, _, encoded = data_url.partition(',')
+    if not header.startswith('data:') or not header.endswith(';base64'):
+        raise ValueError('Not a base64 data URL')
+    mime_type = header[len('data:'):-len(';base64')] or 'application/octet-stream'
+    return mime_type, base64.b64decode(encoded)
+
+
+def migrate_legacy_data_urls(batch_size=20):
+    """Move media still stored as data URLs on Endcard rows into the blob store.
+
+    Rows are processed in small batches and committed as they go, so the
+    migration can be interrupted and re-run safely.
+    """
+    from models import Endcard
+
+    store = get_blob_store()
+    migrated = 0
+    last_id = 0
+
+    while True:
+        endcards = (Endcard.query
+                    .filter(Endcard.id > last_id)
+                    .filter(db.or_(
+                        db.and_(Endcard.portrait_data_url.isnot(None), Endcard.portrait_blob_key.is_(None)),
+                        db.and_(Endcard.landscape_data_url.isnot(None), Endcard.landscape_blob_key.is_(None))
+                    ))
+                    .order_by(Endcard.id)
+                    .limit(batch_size)
+                    .all())
+        if not endcards:
+            break
+
+        for endcard in endcards:
+            for orientation in ('portrait', 'landscape'):
+                data_url = getattr(endcard, f'{orientation}_data_url')
+                if not data_url or getattr(endcard, f'{orientation}_blob_key'):
+                    continue
+                try:
+                    mime_type, raw = decode_data_url(data_url)
+                except ValueError as e:
+                    logger.error(f"Skipping {orientation} media of endcard {endcard.id}: {str(e)}")
+                    continue
+                key, _ = store.put_bytes(raw)
+                setattr(endcard, f'{orientation}_blob_key', key)
+                setattr(endcard, f'{orientation}_mime_type', mime_type)
+                setattr(endcard, f'{orientation}_data_url', None)
+            last_id = endcard.id
+            migrated += 1
+
+        db.session.commit()
+        # Drop the loaded payloads before fetching the next batch
+        db.session.expunge_all()
+        logger.info(f"Migrated media for {migrated} endcards to the blob store")
+
+    return migrated
+
+
+@app.cli.command('migrate-blobs')
+def migrate_blobs_command():
+    """Move legacy data URL media into the blob store"""
+    count = migrate_legacy_data_urls()
+    print(f"Migrated {count} endcards")
@@ -0,0 +1,182 @@
+import os
+import re
+import shutil
+import logging
+import zipfile
+from contextlib import nullcontext
+from datetime import datetime
+from werkzeug.utils import secure_filename
+from app import db
+from models import Endcard
+from conversion import allowed_file, sniff_media, store_media, MAX_FILE_SIZE
+from job_queue import job_handler
+from scratch_space import get_scratch_space, request_scratch_dir
+from utils import format_size
+
+logger = logging.getLogger(__name__)
+
+# Most portrait/landscape pairs accepted in one bulk request
+BULK_MAX_PAIRS = 100
+
+# Archive entries are paired by name: "<name>_portrait.png" and "<name>_landscape.png",
+# or "portrait/<name>.png" and "landscape/<name>.png"
+ARCHIVE_SUFFIX_RE = re.compile(r'^(?P<name>.+)[_-](?P<orientation>portrait|landscape)\.(?P<ext>\w+)$', re.IGNORECASE)
+ARCHIVE_FOLDERS = ('portrait', 'landscape')
+
+
+class BulkItem:
+    """One portrait/landscape pair in a bulk upload, with its validation outcome"""
+
+    def __init__(self, name):
+        self.name = name
+        self.files = {}  # orientation -> (filename, size, opener, sha256)
+        self.errors = []
+
+    def add_file(self, orientation, filename, size, opener, sha256=None):
+        if orientation in self.files:
+            self.errors.append(f'Duplicate {orientation} file: {filename}')
+            return
+        self.files[orientation] = (secure_filename(filename), size, opener, sha256)
+
+    def validate(self):
+        for orientation in ('portrait', 'landscape'):
+            if orientation not in self.files:
+                self.errors.append(f'Missing {orientation} file')
+                continue
+            filename, size, opener, _ = self.files[orientation]
+            if not allowed_file(filename):
+                self.errors.append(f'{orientation.capitalize()} file: Unsupported file type. Allowed types: jpg, jpeg, png, mp4')
+            elif size > MAX_FILE_SIZE:
+                self.errors.append(f'{orientation.capitalize()} file is too large. Maximum size: {format_size(MAX_FILE_SIZE)}')
+            else:
+                try:
+                    with opener() as stream:
+                        sniff_media(orientation, filename, stream)
+                except ValueError as e:
+                    self.errors.append(str(e))
+        return not self.errors
+
+    def error(self):
+        return {'name': self.name, 'success': False, 'error': '\n'.join(self.errors)}
+
+
+def collect_from_files(portrait_files, landscape_files):
+    """Pair uploaded files by position in the portrait_file and landscape_file lists"""
+    if len(portrait_files) != len(landscape_files):
+        raise ValueError('Every portrait file needs a matching landscape file.')
+
+    items = []
+    for index, (portrait, landscape) in enumerate(zip(portrait_files, landscape_files)):
+        item = BulkItem(f'pair-{index + 1}')
+        for orientation, upload in (('portrait', portrait), ('landscape', landscape)):
+            # The upload is read more than once, so opening it must not close it
+            item.add_file(orientation, upload.filename, upload.stream.size, lambda u=upload: nullcontext(u.stream),
+                          upload.stream.sha256)
+        items.append(item)
+    return items
+
+
+def open_archive(upload):
+    """Open an uploaded zip archive, raising ValueError if it is not one"""
+    try:
+        return zipfile.ZipFile(upload.stream)
+    except zipfile.BadZipFile as e:
+        raise ValueError('The uploaded archive is not a valid zip file.') from e
+
+
+def collect_from_archive(archive):
+    """Pair the media files inside a zip archive by name"""
+    items = {}
+    for info in archive.infolist():
+        if info.is_dir() or os.path.basename(info.filename).startswith('.'):
+            continue
+
+        folder, basename = os.path.split(info.filename)
+        match = ARCHIVE_SUFFIX_RE.match(basename)
+        if match:
+            name, orientation = match.group('name'), match.group('orientation').lower()
+        elif os.path.basename(folder).lower() in ARCHIVE_FOLDERS:
+            name, orientation = basename.rsplit('.', 1)[0], os.path.basename(folder).lower()
+        else:
+            continue
+
+        item = items.setdefault(name, BulkItem(name))
+        # Sizes come from the archive directory, so oversized entries are never extracted
+        item.add_file(orientation, basename, info.file_size, lambda i=info: archive.open(i))
+    return list(items.values())
+
+
+def _spool_file(index, orientation, filename, opener):
+    """Copy one file of a pair into the request's scratch directory and return its path"""
+    # Prefixed, as different pairs may well share file names
+    path = os.path.join(request_scratch_dir(), f"{index}_{orientation}_{filename}")
+    with opener() as stream, open(path, 'wb') as spooled:
+        shutil.copyfileobj(stream, spooled)
+    get_scratch_space().add_usage(os.path.getsize(path))
+    return path
+
+
+def spool_items(items):
+    """Validate every item and spool the files of the valid ones for conversion.
+
+    Only headers are read to validate, so this stays cheap. Returns the job
+    payload entries of the valid items and the results of the invalid ones.
+    """
+    entries = []
+    rejected = []
+    for index, item in enumerate(items):
+        if not item.validate():
+            rejected.append(item.error())
+            continue
+        entry = {'name': item.name}
+        for orientation, (filename, size, opener, sha256) in item.files.items():
+            entry[orientation] = {
+                'filename': filename,
+                'size': size,
+                'sha256': sha256,
+                'path': _spool_file(index, orientation, filename, opener)
+            }
+        entries.append(entry)
+    return entries, rejected
+
+
+@job_handler('bulk_convert')
+def bulk_convert(payload):
+    """Store the media of every spooled pair and insert all endcards in one transaction"""
+    try:
+        now = datetime.utcnow()
+        rows = []
+        results = []
+        for entry in payload['items']:
+            columns = {'user_id': payload['user_id'], 'created_at': now, 'updated_at': now}
+            try:
+                for orientation in ('portrait', 'landscape'):
+                    upload = entry[orientation]
+                    with open(upload['path'], 'rb') as spooled:
+                        columns.update(store_media(orientation, upload['filename'], spooled, upload.get('sha256')))
+            except ValueError as e:
+                results.append({'name': entry['name'], 'success': False, 'error': str(e)})
+                continue
+            rows.append(columns)
+            results.append({'name': entry['name'], 'success': True})
+
+        endcard_ids = []
+        if rows:
+            # One executemany-style INSERT, with ids returned in parameter order
+            endcard_ids = db.session.scalars(
+                db.insert(Endcard).returning(Endcard.id, sort_by_parameter_order=True),
+                rows
+            ).all()
+            db.session.commit()
+
+        created = iter(endcard_ids)
+        for result in results:
+            if result['success']:
+                result['endcard_id'] = next(created)
+        logger.info(f"Bulk created {len(endcard_ids)} endcards for user {payload['user_id']}")
+        return {
+            'created': len(endcard_ids),
+            'results': results
+        }
+    finally:
+        get_scratch_space().release(payload.get('scratch_dir'))
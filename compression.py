@@ -0,0 +1,94 @@
+import gzip
+import zlib
+import logging
+from flask import request
+from app import app
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; gzip is always available
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+# Content encodings we can produce, in order of preference
+SUPPORTED_ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+
+# File suffix of the precompressed variant for each encoding
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Size of the chunks read while compressing files
+COMPRESS_CHUNK_SIZE = 64 * 1024
+
+# Smallest response worth compressing on the fly
+MIN_COMPRESS_SIZE = 1024
+
+# Response types compressed on the fly by compress_response
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/css', 'application/json', 'application/javascript'}
+
+
+def negotiate_encoding():
+    """Pick the best content encoding the client accepts, or None for identity"""
+    return request.accept_encodings.best_match(SUPPORTED_ENCODINGS)
+
+
+def _compressor(encoding, level):
+    if encoding == 'br':
+        return brotli.Compressor(quality=level)
+    # wbits 31 writes a gzip header and trailer around the deflate stream
+    return zlib.compressobj(level, zlib.DEFLATED, 31)
+
+
+def compression_level(encoding):
+    """Configured level for precompressing files with an encoding"""
+    return app.config['BROTLI_QUALITY'] if encoding == 'br' else app.config['GZIP_LEVEL']
+
+
+def compress_file(source, destination, encoding, level):
+    """Compress one open binary file into another, chunk by chunk"""
+    compressor = _compressor(encoding, level)
+    if encoding == 'br':
+        for chunk in iter(lambda: source.read(COMPRESS_CHUNK_SIZE), b''):
+            destination.write(compressor.process(chunk))
+        destination.write(compressor.finish())
+    else:
+        for chunk in iter(lambda: source.read(COMPRESS_CHUNK_SIZE), b''):
+            destination.write(compressor.compress(chunk))
+        destination.write(compressor.flush())
+
+
+def compress_path(source_path, encoding, level, destination_path):
+    """Compress one file into another by path; runs in the CPU pool"""
+    with open(source_path, 'rb') as source, open(destination_path, 'wb') as destination:
+        compress_file(source, destination, encoding, level)
+
+
+def compress_bytes(data, encoding):
+    """Compress an in-memory body with a fast setting suited to per-request use"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=4)
+    return gzip.compress(data, compresslevel=5)
+
+
+@app.after_request
+def compress_response(response):
+    """Compress small rendered pages and JSON bodies on the fly.
+
+    Streamed and file responses are left alone; endcard downloads are served
+    from precompressed variants in the render cache instead.
+    """
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or 'Content-Encoding' in response.headers):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encoding = negotiate_encoding()
+    data = response.get_data()
+    if not encoding or len(data) < MIN_COMPRESS_SIZE:
+        return response
+
+    response.set_data(compress_bytes(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,132 @@
+import logging
+from app import db
+from models import Endcard
+from blob_store import get_blob_store
+from render_cache import get_render_cache
+from job_queue import job_handler
+from scratch_space import get_scratch_space
+from media_probe import probe, MediaProbeError
+from image_optimizer import optimize_image
+
+logger = logging.getLogger(__name__)
+
+# Valid file types
+ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+ALLOWED_VIDEO_EXTENSIONS = {'mp4'}
+ALLOWED_EXTENSIONS = ALLOWED_IMAGE_EXTENSIONS.union(ALLOWED_VIDEO_EXTENSIONS)
+
+# Maximum file size (in bytes) - 4.5MB per file to allow some wiggle room
+MAX_FILE_SIZE = 4.5 * 1024 * 1024
+
+
+def allowed_file(filename):
+    """Check if file has an allowed extension"""
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def get_file_type(filename):
+    """Determine if file is image or video based on extension"""
+    ext = filename.rsplit('.', 1)[1].lower()
+    if ext in ALLOWED_IMAGE_EXTENSIONS:
+        return 'image'
+    elif ext in ALLOWED_VIDEO_EXTENSIONS:
+        return 'video'
+    return None
+
+
+def sniff_media(orientation, filename, stream):
+    """Probe a media file's headers and check they agree with its extension.
+
+    Returns the MediaInfo, or raises ValueError with a message fit for the user.
+    """
+    file_type = get_file_type(filename)
+    if not file_type:
+        raise ValueError(f"Invalid {orientation} file type: {filename}")
+    try:
+        info = probe(stream)
+    except MediaProbeError as e:
+        raise ValueError(f"{orientation.capitalize()} file could not be read: {str(e)}") from e
+    if info.file_type != file_type:
+        raise ValueError(f"{orientation.capitalize()} file is named as {file_type} but contains {info.mime_type}")
+    if file_type == 'video' and not info.codec:
+        raise ValueError(f"{orientation.capitalize()} file has no video track")
+    return info
+
+
+def store_media(orientation, filename, stream, sha256=None):
+    """Store one media file in the blob store and return the Endcard column values for it.
+
+    When the caller already knows the content hash and that blob is stored,
+    the copy is skipped. Images are also stored re-encoded to the byte
+    budget, and the endcard serves that variant while keeping the original.
+    """
+    info = sniff_media(orientation, filename, stream)
+
+    store = get_blob_store()
+    if sha256 and store.exists(sha256):
+        original_key, original_size = sha256, store.size(sha256)
+    else:
+        original_key, original_size = store.put(stream)
+
+    blob_key, size, width, height = original_key, original_size, info.width, info.height
+    if info.file_type == 'image':
+        with store.open(original_key) as original:
+            optimized = optimize_image(original, info.mime_type)
+        if optimized:
+            blob_key, size = store.put_bytes(optimized.data)
+            width, height = optimized.width, optimized.height
+
+    return {
+        f'{orientation}_created': True,
+        f'{orientation}_filename': filename,
+        f'{orientation}_file_type': info.file_type,
+        f'{orientation}_file_size': size,
+        f'{orientation}_blob_key': blob_key,
+        f'{orientation}_original_file_size': original_size,
+        f'{orientation}_original_blob_key': original_key,
+        f'{orientation}_mime_type': info.mime_type,
+        f'{orientation}_width': width,
+        f'{orientation}_height': height,
+        f'{orientation}_duration': info.duration,
+        f'{orientation}_codec': info.codec,
+        f'{orientation}_data_url': None,
+    }
+
+
+def _store_media(endcard, orientation, upload):
+    """Move one spooled upload into the blob store and record it on the endcard"""
+    with open(upload['path'], 'rb') as spooled:
+        columns = store_media(orientation, upload['filename'], spooled, upload.get('sha256'))
+    for column, value in columns.items():
+        setattr(endcard, column, value)
+
+
+@job_handler('convert_upload')
+def convert_upload(payload):
+    """Turn a spooled portrait/landscape upload into a new or edited endcard"""
+    try:
+        endcard_id = payload.get('endcard_id')
+        if endcard_id:
+            endcard = Endcard.get_owned(endcard_id, payload['user_id'])
+            if not endcard:
+                raise ValueError('Endcard not found or you do not have permission to edit it.')
+        else:
+            endcard = Endcard(user_id=payload['user_id'])
+            db.session.add(endcard)
+
+        logger.info(f"Converting upload - Portrait: {payload['portrait']['filename']}, "
+                    f"Landscape: {payload['landscape']['filename']}")
+        _store_media(endcard, 'portrait', payload['portrait'])
+        _store_media(endcard, 'landscape', payload['landscape'])
+        db.session.commit()
+
+        # Previously rendered downloads of an edited endcard are now stale
+        if endcard_id:
+            get_render_cache().invalidate(endcard.id)
+
+        return {
+            'endcard_id': endcard.id,
+            'is_video': endcard.is_video
+        }
+    finally:
+        get_scratch_space().release(payload.get('scratch_dir'))
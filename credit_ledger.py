@@ -0,0 +1,83 @@
+import logging
+from datetime import datetime, timedelta
+import click
+from app import app, db
+from models import UserCredit, CreditLedger
+
+logger = logging.getLogger(__name__)
+
+
+def compact_ledger(before=None):
+    """Fold each user's entries older than `before` into one carried-forward entry.
+
+    Balances are unchanged, since the folded entry has the same sum. Entries
+    with an idempotency key are kept, so duplicate grants are still caught.
+    Returns the number of entries removed.
+    """
+    cutoff = before or datetime.utcnow() - timedelta(days=app.config['LEDGER_COMPACT_AFTER_DAYS'])
+    old_entries = (CreditLedger.created_at < cutoff) & CreditLedger.idempotency_key.is_(None)
+
+    groups = db.session.execute(
+        db.select(CreditLedger.user_id, db.func.sum(CreditLedger.amount),
+                  db.func.count(CreditLedger.id), db.func.max(CreditLedger.id))
+        .where(old_entries)
+        .group_by(CreditLedger.user_id)
+        .having(db.func.count(CreditLedger.id) > 1)
+    ).all()
+
+    removed = 0
+    for user_id, total, count, last_id in groups:
+        # Bounded by last_id so only the entries that were summed are removed
+        db.session.execute(
+            db.delete(CreditLedger)
+            .where(old_entries, CreditLedger.user_id == user_id, CreditLedger.id <= last_id)
+        )
+        db.session.add(CreditLedger(user_id=user_id, amount=total, reason='compaction',
+                                    reference=f'{count} entries', created_at=cutoff))
+        db.session.commit()
+        removed += count - 1
+
+    logger.info(f"Compacted credit ledger for {len(groups)} users, {removed} entries removed")
+    return removed
+
+
+def reconcile_balances(fix=False):
+    """Compare every materialized balance with the sum of the user's ledger.
+
+    Mismatches are logged and returned as (user_id, balance, ledger_total).
+    With fix, a reconciliation entry brings the ledger in line with the
+    balance, which is what the user has been shown; this is also how
+    balances from before the ledger existed get their opening entry.
+    """
+    ledger_totals = (
+        db.select(CreditLedger.user_id, db.func.sum(CreditLedger.amount).label('total'))
+        .group_by(CreditLedger.user_id)
+        .subquery()
+    )
+    ledger_total = db.func.coalesce(ledger_totals.c.total, 0)
+    mismatches = db.session.execute(
+        db.select(UserCredit.user_id, UserCredit.credits, ledger_total)
+        .outerjoin(ledger_totals, ledger_totals.c.user_id == UserCredit.user_id)
+        .where(db.func.coalesce(UserCredit.credits, 0) != ledger_total)
+    ).all()
+
+    for user_id, balance, total in mismatches:
+        logger.error(f"Credit balance mismatch for user {user_id}: balance {balance}, ledger {total}")
+        if fix:
+            db.session.add(CreditLedger(user_id=user_id, amount=(balance or 0) - total, reason='reconciliation'))
+    db.session.commit()
+    return mismatches
+
+
+@app.cli.command('compact-credit-ledger')
+def compact_credit_ledger_command():
+    """Fold old credit ledger entries into carried-forward balances"""
+    print(f"Removed {compact_ledger()} ledger entries")
+
+
+@app.cli.command('reconcile-credits')
+@click.option('--fix', is_flag=True, help='Add reconciliation entries for any mismatches.')
+def reconcile_credits_command(fix):
+    """Check every credit balance against the credit ledger"""
+    mismatches = reconcile_balances(fix=fix)
+    print(f"{len(mismatches)} mismatched balances{' fixed' if fix and mismatches else ''}")
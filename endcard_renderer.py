@@ -0,0 +1,112 @@
+import re
+from collections import namedtuple
+from flask import render_template
+from blob_store import get_blob_store
+from utils import iter_base64_chunks, base64_length
+
+# Template for each downloadable endcard format
+ENDCARD_TEMPLATES = {
+    'rotatable': 'endcard_templates/template_rotatable.html',
+    'portrait': 'endcard_templates/template_portrait.html',
+    'landscape': 'endcard_templates/template_landscape.html',
+}
+
+# Stand-ins rendered in place of the media data URLs, swapped back while streaming
+MEDIA_PLACEHOLDER = '__ENDCARD_MEDIA_{}__'
+MEDIA_PLACEHOLDER_RE = re.compile(r'__ENDCARD_MEDIA_(PORTRAIT|LANDSCAPE)__')
+
+# A media data URL within a rendered endcard: literal bytes (the "data:...;base64,"
+# header, or the whole URL for legacy rows) followed by the base64 of the blob
+MediaSegment = namedtuple('MediaSegment', ['data', 'blob_key', 'length'])
+
+# Size of the chunks yielded for legacy data URLs already held in memory
+LEGACY_CHUNK_SIZE = 64 * 1024
+
+
+def _template_context(endcard, template_type):
+    portrait = MEDIA_PLACEHOLDER.format('PORTRAIT')
+    landscape = MEDIA_PLACEHOLDER.format('LANDSCAPE')
+
+    if template_type == 'rotatable':
+        return {
+            'portrait_data_url': portrait,
+            'landscape_data_url': landscape,
+            'is_video': endcard.is_video
+        }
+    if template_type == 'portrait':
+        return {
+            'data_url': portrait,
+            'is_video': endcard.portrait_file_type == 'video'
+        }
+    return {
+        'data_url': landscape,
+        'is_video': endcard.landscape_file_type == 'video'
+    }
+
+
+class EndcardRender:
+    """A rendered endcard HTML document that is streamed rather than built in memory.
+
+    The template is rendered once with small placeholders for the media, and
+    the media data URLs are base64-encoded from the blob store chunk by chunk
+    while the response is written, so memory use does not grow with the size
+    of the endcard.
+    """
+
+    def __init__(self, endcard, template_type):
+        if template_type not in ENDCARD_TEMPLATES:
+            raise ValueError(f"Unknown template type: {template_type}")
+
+        html = render_template(ENDCARD_TEMPLATES[template_type],
+                               **_template_context(endcard, template_type))
+
+        # re.split with a group alternates literal HTML and orientation names
+        self.segments = []
+        for i, part in enumerate(MEDIA_PLACEHOLDER_RE.split(html)):
+            if i % 2:
+                self.segments.append(self._media_segment(endcard, part.lower()))
+            elif part:
+                self.segments.append(part.encode('utf-8'))
+
+    @staticmethod
+    def _media_segment(endcard, orientation):
+        blob_key = getattr(endcard, f'{orientation}_blob_key')
+        if blob_key:
+            mime_type = getattr(endcard, f'{orientation}_mime_type') or 'application/octet-stream'
+            prefix = f"data:{mime_type};base64,".encode('utf-8')
+            return MediaSegment(prefix, blob_key, len(prefix) + base64_length(get_blob_store().size(blob_key)))
+
+        legacy = (getattr(endcard, f'{orientation}_data_url') or '').encode('utf-8')
+        return MediaSegment(legacy, None, len(legacy))
+
+    @property
+    def content_length(self):
+        return sum(len(s) if isinstance(s, bytes) else s.length for s in self.segments)
+
+    def iter_chunks(self):
+        """Yield the document as a sequence of bytes chunks"""
+        return iter_segment_chunks(self.segments)
+
+
+def iter_segment_chunks(segments):
+    """Yield a rendered document's segments as bytes chunks, encoding media as it goes"""
+    for segment in segments:
+        if isinstance(segment, bytes):
+            yield segment
+            continue
+
+        if segment.blob_key is None:
+            for start in range(0, len(segment.data), LEGACY_CHUNK_SIZE):
+                yield segment.data[start:start + LEGACY_CHUNK_SIZE]
+            continue
+
+        yield segment.data
+        with get_blob_store().open(segment.blob_key) as blob:
+            yield from iter_base64_chunks(blob)
+
+
+def write_segments(segments, path):
+    """Write a rendered document's segments to a file; runs in the CPU pool"""
+    with open(path, 'wb') as destination:
+        for chunk in iter_segment_chunks(segments):
+            destination.write(chunk)
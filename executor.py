@@ -0,0 +1,134 @@
+import signal
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from app import app
+
+logger = logging.getLogger(__name__)
+
+
+class ExecutorBusy(Exception):
+    """Raised when the CPU pool cannot run a task in time.
+
+    That is when its queue stays full for longer than the caller will wait,
+    when a task overruns the task timeout, or when the pool's processes died
+    and it is being rebuilt. Callers fall back to cheaper work.
+    """
+
+
+def _init_worker():
+    """Prepare a pool process: leave Ctrl-C to the parent"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class CpuExecutor:
+    """Process pool for CPU-heavy work, shared by everything in a server process.
+
+    At most max_pending tasks are queued or running at once. submit() waits
+    for a free slot for up to `timeout` seconds and raises ExecutorBusy after
+    that, so callers can fall back to cheaper work instead of piling up.
+    run() also gives up on a task after task_timeout seconds. A pool whose
+    processes died is discarded and a fresh one started for the next task.
+    """
+
+    def __init__(self, workers, max_pending, task_timeout=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.task_timeout = task_timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pool = None
+        self._lock = threading.Lock()
+        self.counters = {
+            'submitted': 0,
+            'completed': 0,
+            'failed': 0,
+            'rejected': 0,
+            'timed_out': 0,
+            'rebuilds': 0,
+        }
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker)
+                logger.info(f"Started CPU pool with {self.workers} processes")
+            return self._pool
+
+    def _discard_pool(self, pool):
+        """Drop a broken pool so the next task starts a new one"""
+        with self._lock:
+            if self._pool is not pool:
+                # Another thread got here first
+                return
+            self._pool = None
+            self.counters['rebuilds'] += 1
+        logger.error("CPU pool processes died, starting a new pool")
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, args, timeout):
+        if not self._slots.acquire(timeout=timeout):
+            self._count('rejected')
+            raise ExecutorBusy('Server is busy, please try again shortly.')
+        pool = self._get_pool()
+        try:
+            future = pool.submit(fn, *args)
+        except BrokenProcessPool as e:
+            self._slots.release()
+            self._discard_pool(pool)
+            raise ExecutorBusy('Server is busy, please try again shortly.') from e
+        except Exception:
+            self._slots.release()
+            raise
+        self._count('submitted')
+        future.add_done_callback(self._task_done)
+        return pool, future
+
+    def submit(self, fn, *args, timeout=None):
+        """Queue fn(*args) in the pool and return its Future.
+
+        fn and its arguments must be picklable. timeout is how long to wait
+        for a slot; None waits as long as it takes.
+        """
+        _, future = self._submit(fn, args, timeout)
+        return future
+
+    def _task_done(self, future):
+        self._slots.release()
+        self._count('failed' if future.cancelled() or future.exception() else 'completed')
+
+    def run(self, fn, *args, timeout=None):
+        """Run fn(*args) in the pool and wait up to task_timeout for its result"""
+        pool, future = self._submit(fn, args, timeout)
+        try:
+            return future.result(timeout=self.task_timeout)
+        except TimeoutError as e:
+            # The slot stays taken until the task really finishes, which keeps the backpressure honest
+            future.cancel()
+            self._count('timed_out')
+            raise ExecutorBusy('Server is busy, please try again shortly.') from e
+        except BrokenProcessPool as e:
+            self._discard_pool(pool)
+            raise ExecutorBusy('Server is busy, please try again shortly.') from e
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats['workers'] = self.workers
+        stats['max_pending'] = self.max_pending
+        stats['pending'] = stats['submitted'] - stats['completed'] - stats['failed']
+        return stats
+
+
+def get_executor():
+    """Get the CPU pool, creating it on first use"""
+    executor = app.extensions.get('cpu_executor')
+    if executor is None:
+        executor = CpuExecutor(app.config['CPU_POOL_WORKERS'], app.config['CPU_POOL_MAX_PENDING'],
+                               app.config['CPU_POOL_TASK_TIMEOUT'])
+        app.extensions['cpu_executor'] = executor
+    return executor
@@ -1,12 +1,17 @@
 import json
 import os
+import re
+import time
 import logging
+import threading
 import requests
+from requests.adapters import HTTPAdapter
 from flask import Blueprint, redirect, request, url_for, session, flash
 from flask_login import login_user, logout_user, login_required, current_user
 from oauthlib.oauth2 import WebApplicationClient
 from app import app, db
 from models import User, UserCredit
+from metrics import instrument_session
 
 # Google OAuth Configuration
 GOOGLE_CLIENT_ID = os.environ.get("GOOGLE_OAUTH_CLIENT_ID")
@@ -22,12 +27,76 @@ client = WebApplicationClient(GOOGLE_CLIENT_ID)
 # Logging setup
 logger = logging.getLogger(__name__)
 
+# (connect, read) timeouts for calls to Google
+GOOGLE_HTTP_TIMEOUT = (3.05, 10)
+
+# Discovery document lifetime when Google sends no usable Cache-Control max-age
+DISCOVERY_DEFAULT_TTL = 3600
+
+# Shared session so token and userinfo calls reuse pooled TLS connections
+http = instrument_session(requests.Session(), "google")
+http.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=10))
+
+
+class DiscoveryCache:
+    """Cache of Google's OpenID discovery document.
+
+    The document is fetched once and kept for the max-age Google sends. Once
+    it expires, the stale copy keeps being served while a background thread
+    refreshes it, so login requests only block on the very first fetch.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self._document = None
+        self._expires_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _fetch(self):
+        response = http.get(self.url, timeout=GOOGLE_HTTP_TIMEOUT)
+        response.raise_for_status()
+        document = response.json()
+
+        ttl = DISCOVERY_DEFAULT_TTL
+        match = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        if match:
+            ttl = int(match.group(1))
+
+        with self._lock:
+            self._document = document
+            self._expires_at = time.monotonic() + ttl
+        return document
+
+    def _refresh_in_background(self):
+        try:
+            self._fetch()
+        except Exception as e:
+            logger.warning(f"Discovery document refresh failed, serving stale copy: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def get(self):
+        """Get the discovery document, fetching it only if nothing is cached"""
+        with self._lock:
+            document = self._document
+            if document is not None and time.monotonic() >= self._expires_at and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        if document is not None:
+            return document
+        return self._fetch()
+
+
+discovery_cache = DiscoveryCache(GOOGLE_DISCOVERY_URL)
+
 @google_auth.route("/google_login")
 def login():
     """
     Google login route - redirects to Google's OAuth page
     """
-    google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+    google_provider_cfg = discovery_cache.get()
     authorization_endpoint = google_provider_cfg["authorization_endpoint"]
 
     redirect_uri = "https://endcardconverter.com/google_login/callback"
@@ -55,7 +124,7 @@ def callback():
         code = request.args.get("code")
 
         # Find out what URL to hit to get tokens
-        google_provider_cfg = requests.get(GOOGLE_DISCOVERY_URL).json()
+        google_provider_cfg = discovery_cache.get()
         token_endpoint = google_provider_cfg["token_endpoint"]
 
         # Use fixed redirect URI for production
@@ -69,11 +138,12 @@ def callback():
             code=code,
         )
 
-        token_response = requests.post(
+        token_response = http.post(
             token_url,
             headers=headers,
             data=body,
             auth=(GOOGLE_CLIENT_ID, GOOGLE_CLIENT_SECRET),
+            timeout=GOOGLE_HTTP_TIMEOUT,
         )
 
         # Parse the tokens
@@ -82,7 +152,7 @@ def callback():
         # Get user info from Google
         userinfo_endpoint = google_provider_cfg["userinfo_endpoint"]
         uri, headers, body = client.add_token(userinfo_endpoint)
-        userinfo_response = requests.get(uri, headers=headers, data=body)
+        userinfo_response = http.get(uri, headers=headers, data=body, timeout=GOOGLE_HTTP_TIMEOUT)
 
         # Verify the user's email is verified by Google
         if userinfo_response.json().get("email_verified"):
@@ -124,8 +194,7 @@ def callback():
                     db.session.flush()
 
                     # Initialize user credits - 3 free credits for new users
-                    user_credit = UserCredit(user_id=user.id, credits=3)
-                    db.session.add(user_credit)
+                    UserCredit.apply_credits(user.id, 3, 'signup', idempotency_key=f'signup:{user.id}')
                     logger.info(f"Created new user: {users_email}")
 
                 db.session.commit()
@@ -0,0 +1,95 @@
+import time
+import logging
+from io import BytesIO
+from collections import namedtuple
+from app import app
+from executor import get_executor
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is a declared dependency, but keep uploads working without it
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+if Image is None:
+    logger.warning("Pillow is not installed, so uploaded images will be stored without optimization")
+
+# Longest edge allowed for each SubscriptionTier.max_resolution label
+RESOLUTION_LIMITS = {'720p': 1280, '1080p': 1920, '4K': 3840}
+
+# JPEG qualities tried, best first, when fitting an image into the byte budget
+JPEG_QUALITIES = (90, 85, 80, 75, 70, 60, 50, 40)
+
+# Result of re-encoding one image
+OptimizedImage = namedtuple('OptimizedImage', ['data', 'width', 'height'])
+
+
+def _encode(image, mime_type, quality=None):
+    # Saving without exif/icc/info arguments drops the upload's metadata
+    buffer = BytesIO()
+    if mime_type == 'image/jpeg':
+        image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def optimize_image_bytes(data, mime_type, byte_budget, max_edge=None):
+    """Re-encode an image to fit a byte budget; runs in the CPU pool.
+
+    Downsizes to max_edge, strips metadata, then for JPEG steps down the
+    quality and for PNG falls back to a 256 colour palette until the image
+    fits. Returns an OptimizedImage, or None if nothing smaller came out.
+    """
+    image = Image.open(BytesIO(data))
+    image.load()
+
+    if max_edge and max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    if mime_type == 'image/jpeg':
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        for quality in JPEG_QUALITIES:
+            encoded = _encode(image, mime_type, quality)
+            if len(encoded) <= byte_budget:
+                break
+    else:
+        encoded = _encode(image, mime_type)
+        if len(encoded) > byte_budget and image.mode != 'P':
+            quantized = image.quantize(256, method=Image.FASTOCTREE if image.mode == 'RGBA' else Image.MEDIANCUT)
+            encoded = min(encoded, _encode(quantized, mime_type), key=len)
+
+    if len(encoded) >= len(data):
+        return None
+    return OptimizedImage(encoded, image.width, image.height)
+
+
+def optimize_image(stream, mime_type, max_resolution=None):
+    """Optimize an uploaded image, returning an OptimizedImage or None.
+
+    max_resolution is a SubscriptionTier.max_resolution label and defaults to
+    IMAGE_MAX_RESOLUTION. Returns None when Pillow is not installed or the
+    upload is already as small as we can make it.
+    """
+    if Image is None:
+        return None
+
+    data = stream.read()
+    max_edge = RESOLUTION_LIMITS.get(max_resolution or app.config['IMAGE_MAX_RESOLUTION'])
+    started = time.perf_counter()
+    try:
+        # Conversions run in background jobs, so waiting for a pool slot is fine
+        optimized = get_executor().run(
+            optimize_image_bytes, data, mime_type, app.config['IMAGE_BYTE_BUDGET'], max_edge
+        )
+    except Exception as e:
+        # The original is still stored, so a failed optimization is not fatal
+        logger.error(f"Error optimizing image: {str(e)}")
+        return None
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if optimized:
+        logger.info(f"Optimized {mime_type} from {len(data)} to {len(optimized.data)} bytes in {elapsed_ms:.0f}ms")
+    return optimized
@@ -0,0 +1,227 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from datetime import datetime, timedelta
+from app import app, db
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+# Name recorded on jobs whose inputs only exist on this machine
+HOSTNAME = socket.gethostname()
+
+# Handlers for each job kind, registered with @job_handler
+JOB_HANDLERS = {}
+
+_wakeup = threading.Event()
+_workers = []
+_workers_lock = threading.Lock()
+_next_requeue = 0
+
+
+def job_handler(kind):
+    """Register a function as the handler for a job kind.
+
+    Handlers receive the job's payload and return a JSON-serializable result.
+    They run in a worker thread inside an application context.
+    """
+    def decorator(func):
+        JOB_HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+def enqueue(kind, user_id, payload, local_files=False):
+    """Queue a job and return its id.
+
+    Jobs can be claimed by any process sharing the database. Pass
+    local_files when the payload points at files on this machine's disk,
+    such as spooled uploads, so that only workers on this host claim it.
+    """
+    if kind not in JOB_HANDLERS:
+        raise ValueError(f"No handler registered for job kind: {kind}")
+
+    # Keep the id at hand, so returning it does not reload the committed row
+    job_id = uuid.uuid4().hex
+    db.session.add(Job(id=job_id, user_id=user_id, kind=kind, payload=payload,
+                       host=HOSTNAME if local_files else None))
+    db.session.commit()
+
+    start_workers()
+    _wakeup.set()
+    return job_id
+
+
+def start_workers():
+    """Start this process's worker threads if they are not running yet.
+
+    Called when the app boots, so jobs queued before a restart are picked up
+    without waiting for the next enqueue.
+    """
+    with _workers_lock:
+        if _workers:
+            return
+        requeue_stale_jobs()
+        for i in range(app.config['JOB_WORKERS']):
+            worker = threading.Thread(target=_worker_loop, name=f'job-worker-{i}', daemon=True)
+            worker.start()
+            _workers.append(worker)
+        logger.info(f"Started {len(_workers)} job workers")
+
+
+def _worker_id():
+    """Name of the calling worker thread, recorded on the jobs it claims"""
+    return f"{HOSTNAME}:{os.getpid()}:{threading.current_thread().name}"
+
+
+def _lease_expiry():
+    return datetime.utcnow() + timedelta(seconds=app.config['JOB_LEASE'])
+
+
+def requeue_stale_jobs():
+    """Put jobs whose worker died back in the queue.
+
+    A running job is only taken for dead once its lease has expired, which
+    the worker's heartbeat prevents for as long as it is alive, however slow
+    the job. Jobs that have already been claimed JOB_MAX_ATTEMPTS times are
+    failed rather than handed to yet another worker. Jobs that have waited
+    longer than JOB_QUEUE_EXPIRY are failed too, such as those pinned to a
+    host that has gone away with their inputs.
+    """
+    global _next_requeue
+    _next_requeue = time.monotonic() + app.config['JOB_LEASE'] / 2
+    with app.app_context():
+        now = datetime.utcnow()
+        # Jobs claimed before leases existed have none
+        stale = db.and_(Job.status == 'running',
+                        db.or_(Job.lease_expires_at < now, Job.lease_expires_at.is_(None)))
+        abandoned = db.session.execute(
+            db.update(Job)
+            .where(stale, Job.attempts >= app.config['JOB_MAX_ATTEMPTS'])
+            .values(status='failed', error='The job kept stopping unexpectedly, please try again.',
+                    worker=None, lease_expires_at=None, finished_at=now)
+        ).rowcount
+        count = db.session.execute(
+            db.update(Job)
+            .where(stale)
+            .values(status='queued', started_at=None, worker=None, lease_expires_at=None)
+        ).rowcount
+        expired = db.session.execute(
+            db.update(Job)
+            .where(Job.status == 'queued', Job.created_at < now - timedelta(seconds=app.config['JOB_QUEUE_EXPIRY']))
+            .values(status='failed', error='Timed out waiting for a worker, please try again.',
+                    finished_at=now)
+        ).rowcount
+        db.session.commit()
+        if count:
+            logger.warning(f"Requeued {count} stale jobs")
+        if abandoned:
+            logger.error(f"Failed {abandoned} jobs after {app.config['JOB_MAX_ATTEMPTS']} attempts")
+        if expired:
+            logger.warning(f"Failed {expired} jobs that waited too long for a worker")
+
+
+def _claim_next_job():
+    """Claim the oldest queued job, returning its id or None if the queue is empty.
+
+    The claim is a conditional UPDATE, so each job is run by exactly one
+    worker even with several processes polling the same table. It records
+    the claiming worker and starts its lease.
+    """
+    while True:
+        job_id = db.session.execute(
+            db.select(Job.id)
+            .where(Job.status == 'queued', db.or_(Job.host.is_(None), Job.host == HOSTNAME))
+            .order_by(Job.created_at)
+            .limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.commit()
+            return None
+
+        claimed = db.session.execute(
+            db.update(Job)
+            .where(Job.id == job_id, Job.status == 'queued')
+            .values(status='running', started_at=datetime.utcnow(), attempts=Job.attempts + 1,
+                    worker=_worker_id(), lease_expires_at=_lease_expiry())
+        ).rowcount
+        db.session.commit()
+        if claimed:
+            return job_id
+
+
+def _heartbeat(job_id, worker, stop):
+    """Extend a running job's lease every JOB_HEARTBEAT_INTERVAL until stop is set"""
+    while not stop.wait(app.config['JOB_HEARTBEAT_INTERVAL']):
+        try:
+            with app.app_context():
+                extended = db.session.execute(
+                    db.update(Job)
+                    .where(Job.id == job_id, Job.worker == worker, Job.status == 'running')
+                    .values(lease_expires_at=_lease_expiry())
+                ).rowcount
+                db.session.commit()
+        except Exception as e:
+            logger.error(f"Error extending the lease of job {job_id}: {str(e)}")
+            continue
+        if not extended:
+            logger.warning(f"Job {job_id} is no longer ours, stopping its heartbeat")
+            return
+
+
+def _finish_job(job_id, worker, **values):
+    """Record a job's outcome, unless it was reclaimed from this worker meanwhile"""
+    finished = db.session.execute(
+        db.update(Job)
+        .where(Job.id == job_id, Job.worker == worker, Job.status == 'running')
+        .values(finished_at=datetime.utcnow(), lease_expires_at=None, **values)
+    ).rowcount
+    db.session.commit()
+    if not finished:
+        logger.warning(f"Job {job_id} was reclaimed before it finished, dropping its outcome")
+
+
+def _run_job(job_id):
+    job = db.session.get(Job, job_id)
+    # Read up front, as the handler's commits expire the instance
+    kind, payload, worker = job.kind, job.payload, job.worker
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job_id, worker, stop),
+                                 name=f'job-heartbeat-{job_id}', daemon=True)
+    heartbeat.start()
+    try:
+        outcome = {'status': 'done', 'result': JOB_HANDLERS[kind](payload)}
+    except Exception as e:
+        logger.error(f"Job {job_id} ({kind}) failed: {str(e)}", exc_info=True)
+        db.session.rollback()
+        outcome = {'status': 'failed', 'error': str(e)}
+    finally:
+        stop.set()
+        heartbeat.join()
+    _finish_job(job_id, worker, **outcome)
+
+
+def _worker_loop():
+    while True:
+        try:
+            with app.app_context():
+                job_id = _claim_next_job()
+                if job_id is not None:
+                    _run_job(job_id)
+                    continue
+        except Exception as e:
+            logger.error(f"Job worker error: {str(e)}")
+
+        if time.monotonic() >= _next_requeue:
+            # Jobs of workers that died while this process was up only come back this way
+            try:
+                requeue_stale_jobs()
+            except Exception as e:
+                logger.error(f"Error requeueing stale jobs: {str(e)}")
+
+        # Poll as well as waiting to be woken, to pick up jobs queued by other processes
+        _wakeup.wait(app.config['JOB_POLL_INTERVAL'])
+        _wakeup.clear()
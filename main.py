@@ -3,10 +3,21 @@ from app import app
 from google_auth import google_auth  # Import the Google auth blueprint
 import routes  # Import routes to register them with the app
 from stripe_handler import stripe_blueprint  # Import the Stripe blueprint
+import credit_ledger  # Register the credit ledger maintenance commands
+import sql_profiler  # Attach the SQL profiler to the engine and register its endpoint
+from job_queue import start_workers
+from scratch_space import start_sweeper
+from webhook_inbox import start_processor
 
 # Register blueprints
 app.register_blueprint(google_auth)
 app.register_blueprint(stripe_blueprint)
 
+# Pick up work left queued by a previous run instead of waiting for new work to arrive
+if app.config["BACKGROUND_WORKERS"]:
+    start_workers()
+    start_sweeper()
+    start_processor()
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000)
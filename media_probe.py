@@ -0,0 +1,160 @@
+import struct
+from collections import namedtuple
+
+# What a header-only probe learns about a media file; unknown fields are None
+MediaInfo = namedtuple('MediaInfo', ['mime_type', 'file_type', 'width', 'height', 'duration', 'codec'])
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# JPEG start-of-frame markers carry the frame size; C4, C8 and CC are other tables
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# MP4 container boxes whose children the probe descends into
+MP4_CONTAINER_BOXES = {b'moov', b'trak', b'mdia', b'minf', b'stbl'}
+
+# Largest box body the probe reads in full; everything else is seeked over
+MP4_MAX_READ_BOX = 4096
+
+# Most boxes inspected before a file is treated as malformed
+MP4_MAX_BOXES = 1000
+
+
+class MediaProbeError(ValueError):
+    """Raised when a file is not a media type we recognise, or is malformed"""
+
+
+def probe(stream):
+    """Identify a media file from its headers without decoding it.
+
+    Only box and segment headers are read, seeking over everything else, so
+    memory use is constant whatever the file size. The stream is left at
+    position 0.
+    """
+    stream.seek(0)
+    head = stream.read(12)
+    try:
+        if head.startswith(PNG_SIGNATURE):
+            return _probe_png(stream)
+        if head.startswith(b'\xff\xd8\xff'):
+            return _probe_jpeg(stream)
+        if head[4:8] == b'ftyp':
+            return _probe_mp4(stream)
+    except struct.error as e:
+        raise MediaProbeError('File is truncated or malformed') from e
+    finally:
+        stream.seek(0)
+    raise MediaProbeError('File is not a PNG, JPEG or MP4')
+
+
+def _probe_png(stream):
+    # IHDR is always the first chunk: length, type, then width and height
+    stream.seek(8)
+    _, chunk_type, width, height = struct.unpack('>I4sII', stream.read(16))
+    if chunk_type != b'IHDR':
+        raise MediaProbeError('PNG is missing its IHDR chunk')
+    return MediaInfo('image/png', 'image', width, height, None, None)
+
+
+def _probe_jpeg(stream):
+    stream.seek(2)
+    while True:
+        marker = stream.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            raise MediaProbeError('JPEG has no frame header')
+        if marker[1] == 0xFF:
+            # Fill byte before the real marker
+            stream.seek(-1, 1)
+            continue
+        if marker[1] in (0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7):
+            # Standalone markers have no length
+            continue
+        length, = struct.unpack('>H', stream.read(2))
+        if marker[1] in JPEG_SOF_MARKERS:
+            _, height, width = struct.unpack('>BHH', stream.read(5))
+            return MediaInfo('image/jpeg', 'image', width, height, None, None)
+        if marker[1] == 0xDA:
+            # Image data starts without a frame header having been seen
+            raise MediaProbeError('JPEG has no frame header')
+        stream.seek(length - 2, 1)
+
+
+def _iter_boxes(stream, end, budget):
+    """Yield (type, body offset, body size) for the boxes between here and end"""
+    position = stream.tell()
+    while position + 8 <= end:
+        budget[0] -= 1
+        if budget[0] < 0:
+            raise MediaProbeError('MP4 has too many boxes')
+        stream.seek(position)
+        size, box_type = struct.unpack('>I4s', stream.read(8))
+        header = 8
+        if size == 1:
+            size, = struct.unpack('>Q', stream.read(8))
+            header = 16
+        elif size == 0:
+            # Box runs to the end of the file
+            size = end - position
+        if size < header or position + size > end:
+            raise MediaProbeError('MP4 box runs past the end of the file')
+        yield box_type, position + header, size - header
+        position += size
+
+
+def _probe_mp4(stream):
+    stream.seek(0, 2)
+    end = stream.tell()
+    stream.seek(0)
+
+    info = {'duration': None, 'width': None, 'height': None, 'codec': None}
+    found_moov = False
+    track = {}
+    budget = [MP4_MAX_BOXES]
+
+    def walk(start, stop):
+        nonlocal track
+        stream.seek(start)
+        for box_type, offset, size in _iter_boxes(stream, stop, budget):
+            if box_type == b'trak':
+                track = {}
+                walk(offset, offset + size)
+                # Keep the first video track
+                if track.get('handler') == b'vide' and info['codec'] is None:
+                    info.update(width=track.get('width'), height=track.get('height'), codec=track.get('codec'))
+            elif box_type in MP4_CONTAINER_BOXES:
+                walk(offset, offset + size)
+            elif box_type in (b'mvhd', b'tkhd', b'hdlr', b'stsd'):
+                stream.seek(offset)
+                _parse_leaf(box_type, stream.read(min(size, MP4_MAX_READ_BOX)), info, track)
+
+    stream.seek(0)
+    for box_type, offset, size in _iter_boxes(stream, end, budget):
+        if box_type == b'moov':
+            found_moov = True
+            walk(offset, offset + size)
+            break
+
+    if not found_moov:
+        raise MediaProbeError('MP4 has no movie header')
+    return MediaInfo('video/mp4', 'video', info['width'], info['height'], info['duration'], info['codec'])
+
+
+def _parse_leaf(box_type, body, info, track):
+    version = body[0]
+    if box_type == b'mvhd':
+        # version 1 uses 64-bit times and duration
+        if version == 1:
+            timescale, duration = struct.unpack_from('>IQ', body, 20)
+        else:
+            timescale, duration = struct.unpack_from('>II', body, 12)
+        if timescale:
+            info['duration'] = round(duration / timescale, 3)
+    elif box_type == b'tkhd':
+        # Width and height are 16.16 fixed point, after the matrix
+        offset = 88 if version == 1 else 76
+        width, height = struct.unpack_from('>II', body, offset)
+        track['width'], track['height'] = width >> 16, height >> 16
+    elif box_type == b'hdlr':
+        track['handler'] = body[8:12]
+    elif box_type == b'stsd':
+        # The first sample entry's type is the codec fourcc
+        track['codec'] = body[12:16].decode('ascii', 'replace')
@@ -0,0 +1,202 @@
+import os
+import hmac
+import time
+import bisect
+import threading
+from flask import g, request, Response, abort
+from sqlalchemy import event
+from app import app, db
+
+# Request latency buckets in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Response size buckets in bytes, 256B to 16MB
+SIZE_BUCKETS = tuple(256 * 4 ** i for i in range(9))
+
+# SQL statement and outbound HTTP call buckets in seconds
+CALL_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+# Bearer token required to read /metrics and the other operational endpoints;
+# while it is unset those endpoints are disabled
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+_registry = []
+
+
+class Counter:
+    """Monotonic counter with a fixed set of label names"""
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} counter']
+        with self._lock:
+            for label_values, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, label_values)} {value}')
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a fixed set of label names.
+
+    Observations only bump one bucket and the sum, so recording stays cheap;
+    buckets are made cumulative when the metrics are rendered.
+    """
+
+    def __init__(self, name, help_text, buckets, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.labels = labels
+        self._values = {}  # label values -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, label_values, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(label_values)
+            if series is None:
+                series = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            snapshot = sorted((k, (list(v[0]), v[1])) for k, v in self._values.items())
+        for label_values, (counts, total) in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ('le',), label_values + (str(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labels, label_values)
+            lines.append(f'{self.name}_sum{labels} {total}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+request_seconds = Histogram('http_request_duration_seconds', 'Time spent handling requests, including streamed bodies',
+                            LATENCY_BUCKETS, ('endpoint', 'method', 'status'))
+response_bytes = Histogram('http_response_size_bytes', 'Size of response bodies with a known length',
+                           SIZE_BUCKETS, ('endpoint',))
+sql_statements = Counter('db_statements_total', 'SQL statements executed', ('endpoint',))
+sql_seconds = Histogram('db_statement_duration_seconds', 'Time spent executing SQL statements',
+                        CALL_BUCKETS, ('endpoint',))
+outbound_seconds = Histogram('outbound_http_duration_seconds', 'Time until response headers from external services',
+                             CALL_BUCKETS, ('service', 'status'))
+
+
+def _endpoint():
+    """Label for the current request: its endpoint, or 'background' outside requests"""
+    try:
+        return request.url_rule.endpoint if request.url_rule else 'unmatched'
+    except RuntimeError:
+        return 'background'
+
+
+@app.before_request
+def start_request_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def record_response(response):
+    g.metrics_status = response.status_code
+    if response.content_length is not None:
+        response_bytes.observe((_endpoint(),), response.content_length)
+    return response
+
+
+# after_request hooks run in reverse order of registration, so putting this
+# one first makes it run last and see the body as it is finally sent, such as
+# after compress_response, whatever order the modules were imported in
+app.after_request_funcs.setdefault(None, []).insert(0, record_response)
+
+
+@app.teardown_request
+def record_request(exc):
+    # Teardown runs after a stream_with_context body has been sent
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    status = 500 if exc is not None else g.pop('metrics_status', 500)
+    request_seconds.observe((_endpoint(), request.method, status), time.perf_counter() - started)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['metrics_query_started'].pop()
+    endpoint = _endpoint()
+    sql_statements.inc((endpoint,))
+    sql_seconds.observe((endpoint,), time.perf_counter() - started)
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    if context.connection is not None:
+        started = context.connection.info.get('metrics_query_started')
+        if started:
+            started.pop()
+
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(db.engine, 'handle_error', _handle_error)
+
+
+def instrument_session(session, service):
+    """Record the time to response headers of every call made through a requests Session"""
+    def record_call(response, *args, **kwargs):
+        outbound_seconds.observe((service, response.status_code), response.elapsed.total_seconds())
+    session.hooks['response'].append(record_call)
+    return session
+
+
+def render_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+def require_metrics_token():
+    """Abort unless the request carries METRICS_TOKEN as a bearer token.
+
+    Without a configured token the endpoint is hidden with a 404, so the
+    default deployment exposes nothing.
+    """
+    if not METRICS_TOKEN:
+        abort(404)
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not hmac.compare_digest(token.encode('utf-8'), METRICS_TOKEN.encode('utf-8')):
+        abort(401)
+
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus scrape endpoint for this process"""
+    require_metrics_token()
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
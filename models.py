@@ -1,13 +1,19 @@
 
 import os
+import base64
 import logging
 from datetime import datetime
 from app import db
 from flask_login import UserMixin
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.exc import IntegrityError
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
 
+# Number of endcards per page of conversion history
+HISTORY_PAGE_SIZE = 25
+
 class User(UserMixin, db.Model):
     """User model for tracking users and their credits"""
     id = db.Column(db.Integer, primary_key=True)
@@ -42,24 +48,119 @@ class Endcard(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Portrait file data
     portrait_created = db.Column(db.Boolean, default=False)
     portrait_filename = db.Column(db.String(255))
     portrait_file_type = db.Column(db.String(20))  # 'image' or 'video'
     portrait_file_size = db.Column(db.Integer)  # Size in bytes
-    portrait_data_url = db.Column(db.Text)  # Base64 encoded data URL
+    # Legacy base64 data URL, superseded by portrait_blob_key. Deferred so
+    # metadata queries never pull the payload.
+    portrait_data_url = db.deferred(db.Column(db.Text), group='media')
+    portrait_blob_key = db.Column(db.String(64))  # SHA-256 of the media in the blob store
+    portrait_original_blob_key = db.Column(db.String(64))  # The upload as received, before optimization
+    portrait_original_file_size = db.Column(db.Integer)
+    portrait_mime_type = db.Column(db.String(100))
+    portrait_width = db.Column(db.Integer)  # Pixels, from the file headers
+    portrait_height = db.Column(db.Integer)
+    portrait_duration = db.Column(db.Float)  # Seconds, videos only
+    portrait_codec = db.Column(db.String(16))  # Sample entry fourcc, videos only
 
     # Landscape file data
     landscape_created = db.Column(db.Boolean, default=False)
     landscape_filename = db.Column(db.String(255))
     landscape_file_type = db.Column(db.String(20))  # 'image' or 'video'
     landscape_file_size = db.Column(db.Integer)  # Size in bytes
-    landscape_data_url = db.Column(db.Text)  # Base64 encoded data URL
+    landscape_data_url = db.deferred(db.Column(db.Text), group='media')  # Legacy, see portrait_data_url
+    landscape_blob_key = db.Column(db.String(64))  # SHA-256 of the media in the blob store
+    landscape_original_blob_key = db.Column(db.String(64))  # The upload as received, before optimization
+    landscape_original_file_size = db.Column(db.Integer)
+    landscape_mime_type = db.Column(db.String(100))
+    landscape_width = db.Column(db.Integer)  # Pixels, from the file headers
+    landscape_height = db.Column(db.Integer)
+    landscape_duration = db.Column(db.Float)  # Seconds, videos only
+    landscape_codec = db.Column(db.String(16))  # Sample entry fourcc, videos only
+
+    # Serves keyset pagination of a user's history (see history_page)
+    __table_args__ = (
+        db.Index('ix_endcard_user_id_created_at_id', user_id, created_at.desc(), id),
+    )
 
     def __repr__(self):
         return f'<Endcard {self.id}>'
 
+    @classmethod
+    def owned_by(cls, user_id):
+        """Query a user's endcards, loading metadata only.
+
+        Media payload columns are deferred and only fetched on access.
+        """
+        return cls.query.filter_by(user_id=user_id)
+
+    @classmethod
+    def get_owned(cls, endcard_id, user_id, with_media=False):
+        """Get one of a user's endcards, optionally loading media payloads up front"""
+        query = cls.owned_by(user_id).filter_by(id=endcard_id)
+        if with_media:
+            query = query.options(db.undefer_group('media'))
+        return query.first()
+
+    @classmethod
+    def history_page(cls, user_id, cursor=None, limit=HISTORY_PAGE_SIZE):
+        """Get one page of a user's endcards, newest first.
+
+        Uses keyset pagination on (created_at DESC, id) so every page is an
+        index range scan no matter how deep into the history it is. Legacy
+        rows without a created_at come after all dated rows, ordered by id.
+        Returns (endcards, next_cursor); next_cursor is None on the last page.
+        """
+        created_at, endcard_id = cls.decode_cursor(cursor) if cursor else (None, None)
+
+        endcards = []
+        if not cursor or created_at is not None:
+            query = cls.owned_by(user_id).filter(cls.created_at.isnot(None))
+            if cursor:
+                query = query.filter(db.or_(
+                    cls.created_at < created_at,
+                    db.and_(cls.created_at == created_at, cls.id > endcard_id)
+                ))
+            # Fetch one extra row to find out whether there is another page
+            endcards = query.order_by(cls.created_at.desc(), cls.id).limit(limit + 1).all()
+
+        if len(endcards) <= limit:
+            # Out of dated rows, so carry on with the undated ones by id alone
+            query = cls.owned_by(user_id).filter(cls.created_at.is_(None))
+            if cursor and created_at is None:
+                query = query.filter(cls.id > endcard_id)
+            endcards += query.order_by(cls.id).limit(limit + 1 - len(endcards)).all()
+
+        next_cursor = None
+        if len(endcards) > limit:
+            endcards = endcards[:limit]
+            next_cursor = cls.encode_cursor(endcards[-1])
+        return endcards, next_cursor
+
+    @staticmethod
+    def encode_cursor(endcard):
+        """Encode an endcard's position in the history as an opaque cursor"""
+        created_at = endcard.created_at.isoformat() if endcard.created_at else ''
+        raw = f"{created_at}|{endcard.id}"
+        return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def decode_cursor(cursor):
+        """Decode a history cursor into (created_at, id), raising ValueError if malformed.
+
+        created_at is None for cursors pointing at an undated legacy row.
+        """
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            created_at, endcard_id = base64.urlsafe_b64decode(padded).decode('utf-8').split('|')
+            return datetime.fromisoformat(created_at) if created_at else None, int(endcard_id)
+        except (TypeError, UnicodeDecodeError, ValueError) as e:
+            raise ValueError(f"Invalid history cursor: {cursor}") from e
+
     @property
     def is_video(self):
         """Determine if this endcard contains video content"""
@@ -90,30 +191,79 @@ class UserCredit(db.Model):
             db.session.rollback()
             raise
 
-    def deduct_credit(self):
-        """Deduct one credit with proper error handling"""
+    def deduct_credit(self, amount=1, reason='download', reference=None):
+        """Deduct credits atomically, returning False if the balance is too low
+
+        The balance check and the decrement happen in a single conditional
+        UPDATE, so concurrent downloads across workers cannot double-spend.
+        The matching ledger entry is written in the same transaction.
+        """
         from flask import session
         try:
-            if self.credits > 0:
-                self.credits -= 1
-                self.last_updated = datetime.utcnow()
+            remaining = db.session.execute(
+                db.update(UserCredit)
+                .where(UserCredit.user_id == self.user_id, UserCredit.credits >= amount)
+                .values(credits=UserCredit.credits - amount, last_updated=datetime.utcnow())
+                .returning(UserCredit.credits)
+                .execution_options(synchronize_session=False)
+            ).scalar_one_or_none()
+            if remaining is None:
                 db.session.commit()
-                session['credits'] = self.credits
-                return True
-            return False
+                return False
+            db.session.add(CreditLedger(user_id=self.user_id, amount=-amount, reason=reason,
+                                        reference=str(reference) if reference is not None else None))
+            db.session.commit()
+            set_committed_value(self, 'credits', remaining)
+            session['credits'] = remaining
+            return True
         except Exception as e:
             logging.error(f"Error deducting credit: {str(e)}")
             db.session.rollback()
             raise
 
-    def add_credits(self, amount):
-        """Add credits with proper error handling"""
+    @classmethod
+    def apply_credits(cls, user_id, amount, reason, reference=None, idempotency_key=None):
+        """Add credits to a user's balance within the current transaction.
+
+        Writes a ledger entry and updates the materialized balance, creating
+        the credit record if the user has none. When an idempotency_key is
+        given and an entry already carries it, nothing changes and None is
+        returned. Nothing is committed, so callers can make the grant atomic
+        with their own bookkeeping. Returns the new balance.
+        """
+        try:
+            # A savepoint, so a duplicate key only undoes this entry
+            with db.session.begin_nested():
+                db.session.add(CreditLedger(user_id=user_id, amount=amount, reason=reason,
+                                            reference=str(reference) if reference is not None else None,
+                                            idempotency_key=idempotency_key))
+        except IntegrityError:
+            logging.info(f"Skipping duplicate credit grant: {idempotency_key}")
+            return None
+
+        balance = db.session.execute(
+            db.update(UserCredit)
+            .where(UserCredit.user_id == user_id)
+            .values(credits=UserCredit.credits + amount, last_updated=datetime.utcnow())
+            .returning(UserCredit.credits)
+            .execution_options(synchronize_session=False)
+        ).scalar_one_or_none()
+        if balance is None:
+            db.session.add(cls(user_id=user_id, credits=amount))
+            db.session.flush()
+            balance = amount
+        return balance
+
+    def add_credits(self, amount, reason, reference=None, idempotency_key=None):
+        """Add credits atomically, returning False if this grant was already applied"""
         from flask import session
         try:
-            self.credits += amount
-            self.last_updated = datetime.utcnow()
+            balance = UserCredit.apply_credits(self.user_id, amount, reason, reference, idempotency_key)
             db.session.commit()
-            session['credits'] = self.credits
+            if balance is None:
+                return False
+            set_committed_value(self, 'credits', balance)
+            session['credits'] = balance
             return True
         except Exception as e:
             logging.error(f"Error adding credits: {str(e)}")
@@ -125,6 +275,29 @@ class UserCredit(db.Model):
         from flask import session
         session['credits'] = self.credits
 
+class CreditLedger(db.Model):
+    """Signed record of every credit movement.
+
+    UserCredit.credits is the materialized sum of a user's entries, kept in
+    step in the same transaction as each entry. Old entries are folded into
+    one carried-forward entry per user by credit_ledger.compact_ledger.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    amount = db.Column(db.Integer, nullable=False)  # Positive for grants, negative for spends
+    reason = db.Column(db.String(50), nullable=False)  # e.g. signup, checkout, payment_intent, download, export
+    reference = db.Column(db.String(255))  # Stripe session or payment intent id, endcard id, ...
+    idempotency_key = db.Column(db.String(255), unique=True)  # Set on grants that must apply only once
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Serves per-user history, compaction and reconciliation
+    __table_args__ = (
+        db.Index('ix_credit_ledger_user_id_id', user_id, id),
+    )
+
+    def __repr__(self):
+        return f'<CreditLedger {self.id} - User {self.user_id} - {self.amount:+d} {self.reason}>'
+
 class SubscriptionTier(db.Model):
     """Subscription tier model"""
     id = db.Column(db.Integer, primary_key=True)
@@ -175,3 +348,48 @@ class SubscriptionTier(db.Model):
             'stripe_price_id': None,  # Will need to be updated with actual Stripe price ID
             'stripe_product_id': None #Will need to be updated with actual Stripe product ID
         }
+
+class Job(db.Model):
+    """Background job queued by a request and run by the local worker pool"""
+    id = db.Column(db.String(32), primary_key=True)  # uuid4 hex
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(50), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, done or failed
+    host = db.Column(db.String(255))  # Only workers on this host may run it, when its inputs are local files
+    payload = db.Column(db.JSON)
+    result = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    attempts = db.Column(db.Integer, default=0)
+    worker = db.Column(db.String(255))  # host:pid:thread of the worker running it
+    lease_expires_at = db.Column(db.DateTime)  # Extended by the running worker's heartbeat
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+
+    # Workers claim the oldest queued job first
+    __table_args__ = (
+        db.Index('ix_job_status_created_at', status, created_at),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.kind} {self.status}>'
+
+
+class WebhookEvent(db.Model):
+    """Verified Stripe webhook event, stored on receipt and applied by the inbox processor"""
+    id = db.Column(db.String(255), primary_key=True)  # Stripe event id, so retries are deduplicated
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.JSON, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processed or failed
+    attempts = db.Column(db.Integer, default=0)
+    error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    processed_at = db.Column(db.DateTime)
+
+    # The processor drains pending events oldest first
+    __table_args__ = (
+        db.Index('ix_webhook_event_status_received_at', status, received_at),
+    )
+
+    def __repr__(self):
+        return f'<WebhookEvent {self.id} {self.type} {self.status}>'
@@ -0,0 +1,365 @@
+import os
+import time
+import shutil
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from app import app
+from endcard_renderer import EndcardRender, ENDCARD_TEMPLATES, write_segments
+from compression import compress_path, compression_level, ENCODING_SUFFIXES
+from executor import get_executor, ExecutorBusy
+
+logger = logging.getLogger(__name__)
+
+# Size of the chunks read back from the disk tier
+READ_CHUNK_SIZE = 64 * 1024
+
+# Fraction of the disk limit an eviction pass trims the disk tier down to,
+# so that passes do not run on every write once the tier is full
+DISK_LOW_WATER = 0.9
+
+# Prefix of files still being written; left alone by eviction until stale
+INCOMING_PREFIX = '.incoming-'
+
+# Seconds after which an unfinished write is presumed abandoned
+INCOMING_MAX_AGE = 60 * 60
+
+
+class RenderCache:
+    """Cache of rendered endcard HTML documents.
+
+    Entries are keyed by (endcard id, template type, digest of the media
+    blobs and template source), so edited media or templates never hit stale
+    entries. Small documents are kept in a size-bounded in-process LRU and
+    every document is written to a disk tier shared by all workers. The disk
+    tier is bounded too: documents and their precompressed variants share
+    disk_limit, and once it is exceeded the least recently used files are
+    removed until the tier is back under the low-water mark.
+    """
+
+    def __init__(self, directory, memory_limit, disk_limit):
+        self.directory = directory
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        # Entries bigger than this skip the memory tier entirely
+        self.max_memory_entry = memory_limit // 4
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        # Measured by the last eviction pass, plus what this process wrote since;
+        # other workers' writes are picked up by the next pass
+        self._disk_bytes = None
+        self._evict_lock = threading.Lock()
+        self._template_version = None
+        self.counters = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'disk_evictions': 0,
+            'invalidations': 0,
+            'variant_hits': 0,
+            'compressions': 0,
+        }
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    @property
+    def template_version(self):
+        """Digest of the endcard template sources, computed once per process"""
+        if self._template_version is None:
+            digest = hashlib.sha256()
+            for name in sorted(ENDCARD_TEMPLATES.values()):
+                source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, name)
+                digest.update(source.encode('utf-8'))
+            self._template_version = digest.hexdigest()
+        return self._template_version
+
+    def make_key(self, endcard, template_type):
+        """Cache key for an endcard render, or None if it cannot be cached.
+
+        Legacy rows that still hold data URLs have no content hash and are
+        always rendered fresh.
+        """
+        if not endcard.portrait_blob_key and not endcard.landscape_blob_key:
+            return None
+
+        digest = hashlib.sha256(self.template_version.encode('utf-8'))
+        for orientation in ('portrait', 'landscape'):
+            for field in ('blob_key', 'mime_type', 'file_type'):
+                digest.update(b'\0' + str(getattr(endcard, f'{orientation}_{field}')).encode('utf-8'))
+        return (endcard.id, template_type, digest.hexdigest())
+
+    def _path(self, key):
+        endcard_id, template_type, digest = key
+        return os.path.join(self.directory, str(endcard_id), f"{template_type}-{digest}.html")
+
+    def get(self, key):
+        """Look up a cached document, returning (chunks, content_length) or None"""
+        with self._lock:
+            body = self._memory.get(key)
+            if body is not None:
+                self._memory.move_to_end(key)
+                self.counters['memory_hits'] += 1
+                return [body], len(body)
+
+        try:
+            # Open now so a concurrent invalidation cannot pull the file away mid-read
+            cached_file = open(self._path(key), 'rb')
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+
+        self._count('disk_hits')
+        self._touch(self._path(key))
+        size = os.fstat(cached_file.fileno()).st_size
+        if size <= self.max_memory_entry:
+            with cached_file:
+                body = cached_file.read()
+            self._remember(key, body)
+            return [body], size
+        return self._iter_file(cached_file), size
+
+    @staticmethod
+    def _iter_file(cached_file):
+        with cached_file:
+            while True:
+                chunk = cached_file.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    def _remember(self, key, body):
+        if len(body) > self.max_memory_entry:
+            return
+        with self._lock:
+            if key in self._memory:
+                return
+            self._memory[key] = body
+            self._memory_bytes += len(body)
+            while self._memory_bytes > self.memory_limit:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+                self.counters['evictions'] += 1
+
+    @staticmethod
+    def _touch(path):
+        """Mark a disk entry as recently used, for eviction"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _disk_entries(self):
+        """(mtime, size, path) for every file in the disk tier, least recently used first.
+
+        Abandoned partial writes are removed on the way.
+        """
+        now = time.time()
+        entries = []
+        for dirpath, _, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                if filename.startswith(INCOMING_PREFIX):
+                    if now - stat.st_mtime > INCOMING_MAX_AGE:
+                        self._unlink(path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        return entries
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _disk_written(self, size):
+        """Account for a file published to the disk tier, evicting if it is now over its limit"""
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += size
+            over_limit = self._disk_bytes is None or self._disk_bytes > self.disk_limit
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used disk entries while the tier is over its limit.
+
+        Returns the bytes left in the disk tier. Readers that already have a
+        file open keep reading it after it is removed.
+        """
+        if not self._evict_lock.acquire(blocking=False):
+            # Another thread is already evicting
+            return self._disk_bytes
+        try:
+            entries = self._disk_entries()
+            in_use = sum(size for _, size, _ in entries)
+            if in_use > self.disk_limit:
+                target = self.disk_limit * DISK_LOW_WATER
+                for _, size, path in entries:
+                    if in_use <= target:
+                        break
+                    self._unlink(path)
+                    in_use -= size
+                    self._count('disk_evictions')
+            with self._lock:
+                self._disk_bytes = in_use
+            return in_use
+        finally:
+            self._evict_lock.release()
+
+    def fill(self, key, chunks, content_length):
+        """Pass rendered chunks through while writing them to the cache.
+
+        The entry is only published once the whole document has been written,
+        so an aborted download never leaves a truncated entry behind.
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=INCOMING_PREFIX)
+        keep_in_memory = content_length <= self.max_memory_entry
+        body = bytearray() if keep_in_memory else None
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for chunk in chunks:
+                    tmp_file.write(chunk)
+                    if keep_in_memory:
+                        body.extend(chunk)
+                    yield chunk
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+        self._disk_written(content_length)
+        if keep_in_memory:
+            self._remember(key, bytes(body))
+
+    def _publish_from_pool(self, path, fn, *args):
+        """Run fn(*args, tmp_path) in the CPU pool and move its output to path.
+
+        Raises ExecutorBusy if no pool slot frees up within
+        CPU_POOL_SUBMIT_TIMEOUT, the task overruns or the pool broke.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=INCOMING_PREFIX)
+        os.close(fd)
+        try:
+            get_executor().run(fn, *args, tmp_path, timeout=app.config['CPU_POOL_SUBMIT_TIMEOUT'])
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self._disk_written(size)
+
+    def build(self, key, rendered):
+        """Write a rendered document to the disk tier in the CPU pool"""
+        self._publish_from_pool(self._path(key), write_segments, rendered.segments)
+
+    def get_variant(self, key, encoding):
+        """Open the precompressed variant of a cached document, returning
+        (chunks, content_length) or None if the document itself is not cached.
+
+        Variants sit next to the document on disk and are compressed in the
+        CPU pool the first time they are asked for, so each artifact is
+        compressed once. They count towards the disk limit and are evicted
+        by use like documents; an evicted variant is compressed again the
+        next time it is asked for. Raises ExecutorBusy if the pool has no room.
+        """
+        path = self._path(key)
+        variant_path = path + ENCODING_SUFFIXES[encoding]
+        try:
+            variant = open(variant_path, 'rb')
+            self._count('variant_hits')
+            self._touch(variant_path)
+        except FileNotFoundError:
+            if not os.path.exists(path):
+                return None
+            try:
+                self._publish_from_pool(variant_path, compress_path, path, encoding, compression_level(encoding))
+            except FileNotFoundError:
+                # The document was invalidated while we were compressing it
+                return None
+            self._count('compressions')
+            variant = open(variant_path, 'rb')
+
+        return self._iter_file(variant), os.fstat(variant.fileno()).st_size
+
+    def invalidate(self, endcard_id):
+        """Drop every cached render of an endcard"""
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == endcard_id]:
+                self._memory_bytes -= len(self._memory.pop(key))
+            self.counters['invalidations'] += 1
+        shutil.rmtree(os.path.join(self.directory, str(endcard_id)), ignore_errors=True)
+
+    def stats(self):
+        """Hit/miss counters and usage of both tiers"""
+        with self._lock:
+            stats = dict(self.counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = self._memory_bytes
+            stats['disk_bytes'] = self._disk_bytes
+            stats['disk_limit'] = self.disk_limit
+        return stats
+
+
+def get_render_cache():
+    """Get the render cache, creating it on first use"""
+    cache = app.extensions.get('render_cache')
+    if cache is None:
+        cache = RenderCache(app.config['RENDER_CACHE_DIR'], app.config['RENDER_CACHE_MEMORY_BYTES'],
+                            app.config['RENDER_CACHE_DISK_BYTES'])
+        app.extensions['render_cache'] = cache
+    return cache
+
+
+def render_endcard(endcard, template_type, encoding=None):
+    """Render an endcard through the cache.
+
+    Returns (chunks, content_length, content_encoding). When an encoding is
+    requested and the endcard can be cached, the document is built and
+    compressed in the CPU pool and its precompressed variant is served;
+    otherwise, or when the pool is saturated, the identity document is
+    streamed and content_encoding is None.
+    """
+    cache = get_render_cache()
+    key = cache.make_key(endcard, template_type)
+    if key is None:
+        rendered = EndcardRender(endcard, template_type)
+        return rendered.iter_chunks(), rendered.content_length, None
+
+    if encoding:
+        try:
+            variant = cache.get_variant(key, encoding)
+            if variant is None:
+                # Write the document to the cache in full so it can be compressed
+                cache.build(key, EndcardRender(endcard, template_type))
+                variant = cache.get_variant(key, encoding)
+        except ExecutorBusy:
+            logger.warning(f"CPU pool busy, serving endcard {endcard.id} uncompressed")
+            variant = None
+        if variant is not None:
+            chunks, content_length = variant
+            return chunks, content_length, encoding
+
+    cached = cache.get(key)
+    if cached is not None:
+        chunks, content_length = cached
+        return chunks, content_length, None
+
+    rendered = EndcardRender(endcard, template_type)
+    chunks = cache.fill(key, rendered.iter_chunks(), rendered.content_length)
+    return chunks, rendered.content_length, None
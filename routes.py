@@ -1,8 +1,7 @@
 import os
 import logging
-import base64
 import uuid
-import mimetypes
+import hashlib
 from functools import wraps
 from io import BytesIO
 from datetime import datetime
@@ -13,16 +12,32 @@ from flask import (
     url_for, 
     jsonify, 
     session, 
-    send_file, 
     abort,
-    flash
+    flash,
+    Response,
+    stream_with_context
 )
 from flask_login import current_user, login_required
 from werkzeug.utils import secure_filename
+from werkzeug.wsgi import wrap_file
+from werkzeug.exceptions import RequestEntityTooLarge
 import stripe
 from app import app, db
-from models import User, Endcard, UserCredit
+from models import User, Endcard, UserCredit, Job, HISTORY_PAGE_SIZE
 from auth_utils import get_current_user
+from blob_store import get_blob_store, decode_data_url
+from endcard_renderer import ENDCARD_TEMPLATES
+from render_cache import get_render_cache, render_endcard
+from compression import negotiate_encoding
+from executor import get_executor
+from metrics import require_metrics_token
+from job_queue import enqueue
+from conversion import allowed_file, sniff_media, MAX_FILE_SIZE
+from utils import save_file_temporarily, format_size
+import upload_stream  # Installs the spooling request class
+from scratch_space import get_scratch_space, keep_request_scratch_dir, ScratchQuotaExceeded
+from zip_export import iter_endcard_zip, EXPORT_MAX_FILES
+from bulk_upload import collect_from_files, collect_from_archive, open_archive, spool_items, BULK_MAX_PAIRS
 
 # Configure logging
 logging.basicConfig(level=logging.DEBUG)
@@ -30,32 +45,11 @@ logging.basicConfig(level=logging.DEBUG)
 # Ensure upload folder exists
 os.makedirs(app.config["UPLOAD_FOLDER"], exist_ok=True)
 
-# Valid file types
-ALLOWED_IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
-ALLOWED_VIDEO_EXTENSIONS = {'mp4'}
-ALLOWED_EXTENSIONS = ALLOWED_IMAGE_EXTENSIONS.union(ALLOWED_VIDEO_EXTENSIONS)
+# Orientations an endcard stores media for
+MEDIA_ORIENTATIONS = ('portrait', 'landscape')
 
-# Maximum file size (in bytes) - 4.5MB per file to allow some wiggle room
-MAX_FILE_SIZE = 4.5 * 1024 * 1024
-
-
-def allowed_file(filename):
-    """Check if file has an allowed extension"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def get_file_type(filename):
-    """Determine if file is image or video based on extension"""
-    ext = filename.rsplit('.', 1)[1].lower()
-    if ext in ALLOWED_IMAGE_EXTENSIONS:
-        return 'image'
-    elif ext in ALLOWED_VIDEO_EXTENSIONS:
-        return 'video'
-    return None
-
-def file_to_data_url(file_stream, content_type):
-    """Convert file to data URL format"""
-    encoded_content = base64.b64encode(file_stream.read()).decode('utf-8')
-    return f"data:{content_type};base64,{encoded_content}"
+# Browser cache lifetime for content-versioned media URLs (one year)
+MEDIA_MAX_AGE = 365 * 24 * 60 * 60
 
 from auth_utils import manage_session
 
@@ -69,7 +63,7 @@ def index():
         endcard = None
 
         if user and endcard_id:
-            endcard = Endcard.query.filter_by(id=endcard_id, user_id=user.id).first()
+            endcard = Endcard.get_owned(endcard_id, user.id)
 
         # Ensure session has credits key
         if 'credits' not in session:
@@ -102,14 +96,79 @@ def history():
             flash('Please sign in to view your conversion history', 'warning')
             return redirect(url_for('google_auth.login'))
 
-        endcards = Endcard.query.filter_by(user_id=user.id).order_by(Endcard.created_at.desc()).all()
-        return render_template('history.html', endcards=endcards)
+        try:
+            endcards, next_cursor = Endcard.history_page(user.id, cursor=request.args.get('cursor'))
+        except ValueError:
+            return redirect(url_for('history'))
+        return render_template('history.html', endcards=endcards, next_cursor=next_cursor)
     except Exception as e:
         logging.error(f"Error in history route: {str(e)}")
         db.session.rollback()
         flash('An error occurred while loading your history', 'error')
         return redirect(url_for('index'))
 
+@app.route('/history/export', methods=['POST'])
+@login_required
+@manage_session
+def export_history():
+    """Download several rendered endcards as one zip archive"""
+    try:
+        user, credit_record = check_credits()
+
+        # Repeated values would be charged and exported twice, so keep the first of each
+        endcard_ids = list(dict.fromkeys(request.form.getlist('endcard_ids', type=int)))
+        template_types = list(dict.fromkeys(t for t in request.form.getlist('template_types') if t in ENDCARD_TEMPLATES))
+        if not endcard_ids or not template_types:
+            flash('Select at least one endcard and one format to export', 'warning')
+            return redirect(url_for('history'))
+
+        # Keep only the ids this user owns; the endcards are rendered while streaming
+        endcard_ids = db.session.scalars(
+            db.select(Endcard.id).where(Endcard.user_id == user.id, Endcard.id.in_(endcard_ids))
+        ).all()
+        file_count = len(endcard_ids) * len(template_types)
+        if not endcard_ids:
+            flash('Access denied: Endcard not found or unauthorized', 'error')
+            return redirect(url_for('history'))
+        if file_count > EXPORT_MAX_FILES:
+            flash(f'Too many files selected. Maximum per export: {EXPORT_MAX_FILES}', 'warning')
+            return redirect(url_for('history'))
+
+        # One credit per exported file, deducted in a single atomic statement
+        export_id = uuid.uuid4().hex
+        if not credit_record.deduct_credit(amount=file_count, reason='export', reference=export_id):
+            flash(f'Insufficient credits: this export needs {file_count}', 'error')
+            return redirect(url_for('upgrade'))
+
+    except Exception as e:
+        logging.error(f"Error preparing export: {str(e)}")
+        db.session.rollback()
+        flash('An error occurred while processing your request', 'error')
+        return redirect(url_for('history'))
+
+    filename = f"endcards_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
+    response = Response(stream_with_context(stream_export(user.id, endcard_ids, template_types, export_id, file_count)),
+                        mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+def stream_export(user_id, endcard_ids, template_types, export_id, charged):
+    """Stream an export's zip archive, refunding its credits if it fails partway.
+
+    An archive cut off by an error has no central directory, so the whole
+    charge is refunded. Client disconnects are not refunded, since the
+    entries already sent can be recovered from the truncated archive.
+    """
+    try:
+        yield from iter_endcard_zip(user_id, endcard_ids, template_types)
+    except Exception as e:
+        logging.error(f"Error streaming export {export_id}: {str(e)}", exc_info=True)
+        db.session.rollback()
+        UserCredit.apply_credits(user_id, charged, 'export_refund', reference=export_id,
+                                 idempotency_key=f'export_refund:{export_id}')
+        db.session.commit()
+        raise
+
 @app.route('/credits')
 @app.route('/upgrade')
 @login_required
@@ -117,7 +176,8 @@ def history():
 def upgrade():
     """Credits management page for viewing and purchasing credits"""
     stripe_status = get_stripe_status()
-    if not stripe_status['enabled']:
+    # Until the background account check has finished, assume Stripe is fine
+    if stripe_status['checked'] and not stripe_status['enabled']:
         flash('Stripe payment is not properly configured.', 'error')
         logging.error('Stripe payment system is not properly configured')
     return render_template('upgrade.html', 
@@ -141,7 +201,8 @@ def check_credits():
         if not user or not user.is_authenticated:
             raise ValueError('Authentication required')
 
-        credit_record = UserCredit.get_user_credits(user.id)
+        # get_current_user guarantees the credit record exists and has loaded it
+        credit_record = user.credits
         if credit_record.credits <= 0:
             raise ValueError('Insufficient credits')
 
@@ -150,6 +211,13 @@ def check_credits():
         logging.error(f"Error checking credits: {str(e)}")
         raise
 
+def scratch_full_response(e):
+    """503 asking the client to retry once the sweeper has freed upload storage"""
+    logging.warning(f"Rejecting upload: {str(e)}")
+    response = jsonify({'success': False, 'error': str(e)})
+    response.headers['Retry-After'] = str(app.config['SCRATCH_SWEEP_INTERVAL'])
+    return response, 503
+
 @app.route('/process_upload', methods=['POST'])
 @login_required
 @manage_session
@@ -164,12 +232,22 @@ def process_upload():
             })
 
         user, credit_record = check_credits()
-        # Check if editing existing endcard
-        endcard_id = request.form.get('endcard_id')
 
-        # Get files from request
-        portrait_file = request.files.get('portrait_file')
-        landscape_file = request.files.get('landscape_file')
+        # File parts are spooled, measured and hashed while the body is parsed,
+        # and an oversized part stops the parse as soon as it crosses the limit
+        request.max_file_size = MAX_FILE_SIZE
+        try:
+            # Check if editing existing endcard
+            endcard_id = request.form.get('endcard_id')
+
+            # Get files from request
+            portrait_file = request.files.get('portrait_file')
+            landscape_file = request.files.get('landscape_file')
+        except RequestEntityTooLarge as e:
+            return jsonify({
+                'success': False,
+                'error': e.description
+            }), 413
 
         # Ensure at least one file is present
         if not portrait_file and not landscape_file:
@@ -188,20 +266,23 @@ def process_upload():
         if not allowed_file(landscape_file.filename):
             errors.append('Landscape file: Unsupported file type. Allowed types: jpg, jpeg, png, mp4')
 
-        # Validate file sizes
-        portrait_file.seek(0, os.SEEK_END)
-        portrait_size = portrait_file.tell()
-        portrait_file.seek(0)
-
-        landscape_file.seek(0, os.SEEK_END)
-        landscape_size = landscape_file.tell()
-        landscape_file.seek(0)
+        # Validate file sizes, as measured while the parts were spooled
+        portrait_size = portrait_file.stream.size
+        landscape_size = landscape_file.stream.size
 
         if portrait_size > MAX_FILE_SIZE:
-            errors.append(f'Portrait file is too large. Maximum size: 4.5MB')
+            errors.append(f'Portrait file is too large. Maximum size: {format_size(MAX_FILE_SIZE)}')
 
         if landscape_size > MAX_FILE_SIZE:
-            errors.append(f'Landscape file is too large. Maximum size: 4.5MB')
+            errors.append(f'Landscape file is too large. Maximum size: {format_size(MAX_FILE_SIZE)}')
+
+        # Check the file contents match their names, from the headers alone
+        if not errors:
+            for orientation, upload in (('portrait', portrait_file), ('landscape', landscape_file)):
+                try:
+                    sniff_media(orientation, upload.filename, upload.stream)
+                except ValueError as e:
+                    errors.append(str(e))
 
         if errors:
             return jsonify({
@@ -209,75 +290,43 @@ def process_upload():
                 'error': '\n'.join(errors)
             })
 
-        # Log incoming request details
-        logging.info(f"Processing upload - Portrait: {portrait_file.filename}, Landscape: {landscape_file.filename}")
-
-        # Secure filenames
-        portrait_filename = secure_filename(portrait_file.filename)
-        landscape_filename = secure_filename(landscape_file.filename)
-
-        # Determine file types
-        portrait_type = get_file_type(portrait_filename)
-        landscape_type = get_file_type(landscape_filename)
-
-        if not portrait_type or not landscape_type:
-            raise ValueError(f"Invalid file types - Portrait: {portrait_type}, Landscape: {landscape_type}")
-
-        # Get MIME types
-        portrait_mime = mimetypes.guess_type(portrait_filename)[0] or 'application/octet-stream'
-        landscape_mime = mimetypes.guess_type(landscape_filename)[0] or 'application/octet-stream'
+        # Check ownership up front so the client hears about it immediately
+        if endcard_id and not Endcard.get_owned(endcard_id, user.id):
+            return jsonify({
+                'success': False,
+                'error': 'Endcard not found or you do not have permission to edit it.'
+            })
 
-        logging.info(f"File types - Portrait: {portrait_mime}, Landscape: {landscape_mime}")
+        # Log incoming request details
+        logging.info(f"Queueing upload - Portrait: {portrait_file.filename}, Landscape: {landscape_file.filename}")
 
-        # Convert files to data URLs
         try:
-            portrait_data_url = file_to_data_url(portrait_file, portrait_mime)
-            landscape_data_url = file_to_data_url(landscape_file, landscape_mime)
-        except Exception as e:
-            logging.error(f"Data URL conversion failed: {str(e)}")
-            raise
-
-        # Create or update endcard record
-        if endcard_id:
-            # Update existing endcard
-            endcard = Endcard.query.filter_by(id=endcard_id, user_id=user.id).first()
-            if not endcard:
-                return jsonify({
-                    'success': False,
-                    'error': 'Endcard not found or you do not have permission to edit it.'
-                })
-        else:
-            # Create new endcard and deduct credit
-            #Credit deduction removed as per requirement
-
-            endcard = Endcard(user_id=user.id)
-            db.session.add(endcard)
-
-        # Update endcard data
-        endcard.portrait_created = True
-        endcard.portrait_filename = portrait_filename
-        endcard.portrait_file_type = portrait_type
-        endcard.portrait_file_size = portrait_size
-        endcard.portrait_data_url = portrait_data_url
-
-        endcard.landscape_created = True
-        endcard.landscape_filename = landscape_filename
-        endcard.landscape_file_type = landscape_type
-        endcard.landscape_file_size = landscape_size
-        endcard.landscape_data_url = landscape_data_url
-
-        db.session.commit()
+            get_scratch_space().check_quota(portrait_size + landscape_size)
+        except ScratchQuotaExceeded as e:
+            return scratch_full_response(e)
+
+        # Spool the files to disk and leave the conversion to a background worker
+        payload = {'user_id': user.id, 'endcard_id': endcard_id}
+        for orientation, upload, size in (('portrait', portrait_file, portrait_size),
+                                          ('landscape', landscape_file, landscape_size)):
+            filename = secure_filename(upload.filename)
+            payload[orientation] = {
+                'filename': filename,
+                'size': size,
+                'sha256': upload.stream.sha256,
+                'path': save_file_temporarily(upload, f"{orientation}_{filename}")
+            }
+        # The worker releases the spooled files once it has converted them
+        payload['scratch_dir'] = keep_request_scratch_dir()
 
-        # Update session with new credit count
-        session['credits'] = user.credits.credits
+        # The spooled files are on this machine, so only its workers can convert them
+        job_id = enqueue('convert_upload', user.id, payload, local_files=True)
 
         return jsonify({
             'success': True,
-            'endcard_id': endcard.id,
-            'portrait_data_url': portrait_data_url,
-            'landscape_data_url': landscape_data_url,
-            'is_video': endcard.is_video
-        })
+            'job_id': job_id,
+            'status_url': url_for('get_job_status', job_id=job_id)
+        }), 202
 
     except Exception as e:
         error_msg = str(e)
@@ -289,28 +338,85 @@ def process_upload():
             'error': f"Error processing files: {error_msg}".strip()
         }), 500
 
+@app.route('/api/bulk_upload', methods=['POST'])
+@login_required
+@manage_session
+@error_handler
+def bulk_upload():
+    """Create endcards from many portrait/landscape pairs in one request.
+
+    Pairs come either as repeated portrait_file/landscape_file fields, matched
+    by position, or as a zip archive in the archive field. Pairs are checked
+    from their headers and spooled, then converted by one background job;
+    invalid pairs are reported straight away.
+    """
+    # Bulk requests carry many files, so they get their own body size limit
+    request.max_content_length = app.config['BULK_MAX_CONTENT_LENGTH']
+
+    user, credit_record = check_credits()
+
+    # Turn the request away before reading the files if they cannot be spooled
+    try:
+        get_scratch_space().check_quota(request.content_length or 0)
+    except ScratchQuotaExceeded as e:
+        return scratch_full_response(e)
+
+    try:
+        archive = request.files.get('archive')
+        if archive:
+            items = collect_from_archive(open_archive(archive))
+        else:
+            items = collect_from_files(request.files.getlist('portrait_file'),
+                                       request.files.getlist('landscape_file'))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    if not items:
+        return jsonify({'success': False, 'error': 'No portrait/landscape pairs found.'}), 400
+    if len(items) > BULK_MAX_PAIRS:
+        return jsonify({
+            'success': False,
+            'error': f'Too many pairs. Maximum per request: {BULK_MAX_PAIRS}'
+        }), 400
+
+    entries, rejected = spool_items(items)
+    if not entries:
+        return jsonify({'success': False, 'queued': 0, 'results': rejected})
+
+    # The worker releases the spooled files once it has converted them
+    payload = {'user_id': user.id, 'items': entries, 'scratch_dir': keep_request_scratch_dir()}
+    job_id = enqueue('bulk_convert', user.id, payload, local_files=True)
+
+    return jsonify({
+        'success': not rejected,
+        'job_id': job_id,
+        'status_url': url_for('get_job_status', job_id=job_id),
+        'queued': len(entries),
+        'results': rejected
+    }), 202
+
 @app.route('/download_template/<template_type>/<int:endcard_id>')
 @login_required
 @manage_session
 def download_template(template_type, endcard_id):
     """Download HTML template"""
+    if template_type not in ENDCARD_TEMPLATES:
+        abort(404)
+
     try:
         user, credit_record = check_credits()
 
         # Verify ownership of the endcard and handle credit deduction in a transaction
         try:
-            endcard = Endcard.query.filter_by(id=endcard_id, user_id=user.id).first()
+            endcard = Endcard.get_owned(endcard_id, user.id)
             if not endcard:
                 flash('Access denied: Endcard not found or unauthorized', 'error')
                 return redirect(url_for('index'))
 
-            # Deduct credit and sync session in the same transaction
-            if not credit_record.deduct_credit():
+            # Deduct credit atomically; this also syncs the session balance
+            if not credit_record.deduct_credit(reason='download', reference=endcard_id):
                 flash('Insufficient credits', 'error')
-                return redirect(url_for('credits'))
-
-            db.session.commit()
-            session['credits'] = user.credits.credits
+                return redirect(url_for('upgrade'))
 
         except Exception as e:
             db.session.rollback()
@@ -323,47 +429,34 @@ def download_template(template_type, endcard_id):
         flash('An error occurred while processing your request', 'error')
         return redirect(url_for('index'))
 
-    # Get the endcard
-    endcard = Endcard.query.filter_by(id=endcard_id, user_id=user.id).first()
+    # Get the endcard, including any legacy media payloads needed for rendering
+    endcard = Endcard.get_owned(endcard_id, user.id, with_media=True)
     if not endcard:
         abort(404)
 
-    if template_type == 'rotatable':
-        template = render_template(
-            'endcard_templates/template_rotatable.html',
-            portrait_data_url=endcard.portrait_data_url,
-            landscape_data_url=endcard.landscape_data_url,
-            is_video=endcard.is_video
-        )
-    elif template_type == 'portrait':
-        template = render_template(
-            'endcard_templates/template_portrait.html',
-            data_url=endcard.portrait_data_url,
-            is_video=endcard.portrait_file_type == 'video'
-        )
-    elif template_type == 'landscape':
-        template = render_template(
-            'endcard_templates/template_landscape.html',
-            data_url=endcard.landscape_data_url,
-            is_video=endcard.landscape_file_type == 'video'
+    try:
+        chunks, content_length, content_encoding = render_endcard(
+            endcard, template_type, encoding=negotiate_encoding()
         )
-    else:
-        abort(404)
-
-    # Create in-memory file
-    mem_file = BytesIO()
-    mem_file.write(template.encode('utf-8'))
-    mem_file.seek(0)
+    except Exception as e:
+        # The credit is already spent, so give it back rather than charge for nothing
+        logging.error(f"Error rendering endcard {endcard_id}: {str(e)}", exc_info=True)
+        db.session.rollback()
+        credit_record.add_credits(1, 'download_refund', endcard_id)
+        flash('An error occurred while preparing your download. Your credit has been refunded.', 'error')
+        return redirect(url_for('index'))
 
     # Generate filename
     filename = f"endcard_{template_type}_{endcard_id}.html"
 
-    return send_file(
-        mem_file,
-        mimetype='text/html',
-        as_attachment=True,
-        download_name=filename
-    )
+    # Stream the document so the media is never held in memory in full
+    response = Response(stream_with_context(chunks), mimetype='text/html')
+    response.headers['Content-Length'] = content_length
+    response.vary.add('Accept-Encoding')
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
 
 @app.route('/api/endcard/<int:endcard_id>')
 @login_required
@@ -373,7 +466,7 @@ def get_endcard_data(endcard_id):
     if not user or not user.is_authenticated:
         return jsonify({'error': 'Unauthorized'}), 401
 
-    endcard = Endcard.query.filter_by(id=endcard_id, user_id=user.id).first()
+    endcard = Endcard.get_owned(endcard_id, user.id)
     if not endcard:
         return jsonify({
             'success': False,
@@ -382,16 +475,155 @@ def get_endcard_data(endcard_id):
 
     return jsonify({
         'success': True,
-        'endcard': {
-            'id': endcard.id,
-            'portrait_filename': endcard.portrait_filename,
-            'landscape_filename': endcard.landscape_filename,
-            'is_video': endcard.is_video,
-            'created_at': endcard.created_at.isoformat()
-        }
+        'endcard': endcard_summary(endcard)
     })
 
-from stripe_handler import stripe, get_stripe_status
+@app.route('/api/jobs/<job_id>')
+@login_required
+def get_job_status(job_id):
+    """API endpoint to poll a background job"""
+    user = get_current_user()
+    if not user or not user.is_authenticated:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    job = Job.query.filter_by(id=job_id, user_id=user.id).first()
+    if not job:
+        return jsonify({
+            'success': False,
+            'error': 'Job not found'
+        }), 404
+
+    response = {
+        'success': job.status != 'failed',
+        'job_id': job.id,
+        'status': job.status
+    }
+    if job.status == 'failed':
+        response['error'] = f"Error processing files: {job.error}"
+    elif job.status == 'done':
+        response.update(job.result)
+        # Previews load from the media endpoint rather than inline data URLs.
+        # Bulk jobs have no single endcard, they list theirs in results
+        if 'endcard_id' in job.result:
+            endcard = Endcard.get_owned(job.result['endcard_id'], user.id)
+            if endcard:
+                for orientation in MEDIA_ORIENTATIONS:
+                    response[f'{orientation}_preview_url'] = media_url(endcard, orientation)
+    return jsonify(response)
+
+@app.template_global()
+def media_url(endcard, orientation):
+    """URL of an endcard's media, versioned by content so it can be cached for good"""
+    version = getattr(endcard, f'{orientation}_blob_key')
+    if version:
+        return url_for('endcard_media', endcard_id=endcard.id, orientation=orientation, v=version[:16])
+    return url_for('endcard_media', endcard_id=endcard.id, orientation=orientation)
+
+@app.route('/media/<int:endcard_id>/<orientation>')
+@login_required
+def endcard_media(endcard_id, orientation):
+    """Serve an endcard's raw media, with range requests and conditional GET"""
+    if orientation not in MEDIA_ORIENTATIONS:
+        abort(404)
+
+    user = get_current_user()
+    if not user or not user.is_authenticated:
+        abort(401)
+
+    endcard = Endcard.get_owned(endcard_id, user.id)
+    if not endcard or not getattr(endcard, f'{orientation}_created'):
+        abort(404)
+
+    blob_key = getattr(endcard, f'{orientation}_blob_key')
+    if blob_key:
+        blob_store = get_blob_store()
+        mime_type = getattr(endcard, f'{orientation}_mime_type') or 'application/octet-stream'
+        size = blob_store.size(blob_key)
+        stream = blob_store.open(blob_key)
+        etag = blob_key
+    else:
+        # Legacy rows still hold the media as a data URL
+        data_url = getattr(endcard, f'{orientation}_data_url')
+        if not data_url:
+            abort(404)
+        mime_type, raw = decode_data_url(data_url)
+        size = len(raw)
+        stream = BytesIO(raw)
+        etag = hashlib.sha256(raw).hexdigest()
+
+    response = Response(wrap_file(request.environ, stream), mimetype=mime_type, direct_passthrough=True)
+    response.content_length = size
+    response.set_etag(etag)
+    response.last_modified = endcard.updated_at or endcard.created_at
+    response.cache_control.private = True
+    if blob_key and request.args.get('v') == blob_key[:16]:
+        # Versioned URLs never change content, so browsers need not revalidate
+        response.cache_control.max_age = MEDIA_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        response.cache_control.no_cache = True
+    return response.make_conditional(request, accept_ranges=True, complete_length=size)
+
+@app.route('/api/endcards')
+@login_required
+def list_endcards():
+    """API endpoint to page through the user's endcards, newest first"""
+    user = get_current_user()
+    if not user or not user.is_authenticated:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    limit = min(request.args.get('limit', HISTORY_PAGE_SIZE, type=int), 100)
+    try:
+        endcards, next_cursor = Endcard.history_page(
+            user.id, cursor=request.args.get('cursor'), limit=max(limit, 1)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({
+        'success': True,
+        'endcards': [endcard_summary(endcard) for endcard in endcards],
+        'next_cursor': next_cursor
+    })
+
+def endcard_summary(endcard):
+    """Metadata about an endcard for the JSON API"""
+    return {
+        'id': endcard.id,
+        'portrait_filename': endcard.portrait_filename,
+        'landscape_filename': endcard.landscape_filename,
+        'is_video': endcard.is_video,
+        'created_at': endcard.created_at.isoformat() if endcard.created_at else None
+    }
+
+@app.route('/api/scratch/stats')
+def scratch_stats():
+    """API endpoint exposing temporary upload disk usage, for operators holding METRICS_TOKEN"""
+    require_metrics_token()
+    return jsonify({
+        'success': True,
+        'stats': get_scratch_space().stats()
+    })
+
+@app.route('/api/cpu_pool/stats')
+def cpu_pool_stats():
+    """API endpoint exposing CPU pool load and backpressure counters, for operators holding METRICS_TOKEN"""
+    require_metrics_token()
+    return jsonify({
+        'success': True,
+        'stats': get_executor().stats()
+    })
+
+@app.route('/api/render_cache/stats')
+def render_cache_stats():
+    """API endpoint exposing render cache hit/miss counters, for operators holding METRICS_TOKEN"""
+    require_metrics_token()
+    return jsonify({
+        'success': True,
+        'stats': get_render_cache().stats()
+    })
+
+from stripe_handler import stripe, init_stripe, get_stripe_status
 
 # Initialize package Stripe IDs
 basic_package = {
@@ -445,6 +677,7 @@ def create_checkout_session():
         logging.info(f"Creating Stripe session for package: {package_id}")
         logging.info(f"Package details: {json.dumps(package)}")
         
+        init_stripe()
         checkout_session = stripe.checkout.Session.create(
             payment_method_types=['card'],
             line_items=[{
@@ -479,21 +712,21 @@ def payment_success():
         return redirect(url_for('upgrade'))
 
     try:
+        init_stripe()
         checkout_session = stripe.checkout.Session.retrieve(session_id)
         if checkout_session.payment_status == 'paid':
             user = get_current_user()
             credits = int(checkout_session.metadata.get('credits', 0))
-            user.credits.add_credits(credits)
-            db.session.commit()
-            session['credits'] = user.credits.credits
+            # Keyed by the session, so reloading this page never grants twice
+            user.credits.add_credits(credits, 'checkout', session_id, idempotency_key=f'checkout:{session_id}')
             return redirect(url_for('index'))
         else:
             return redirect(checkout_session.url)
     except stripe.error.StripeError as e:
         logging.error(f"Stripe API error: {str(e)}")
         flash('Payment processing error. Please try again or contact support.', 'error')
-        return redirect(url_for('credits'))
+        return redirect(url_for('upgrade'))
     except Exception as e:
         logging.error(f"Unexpected error in payment processing: {str(e)}")
         flash('An unexpected error occurred. Please contact support.', 'error')
-        return redirect(url_for('credits'))
\ No newline at end of file
+        return redirect(url_for('upgrade'))
\ No newline at end of file
@@ -0,0 +1,51 @@
+import logging
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.exc import DBAPIError
+
+logger = logging.getLogger(__name__)
+
+
+def _add_column(engine, table, column):
+    """Add a column in its own transaction, tolerating another process adding it first"""
+    column_type = column.type.compile(dialect=engine.dialect)
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+            ))
+        logger.info(f"Added column {table.name}.{column.name}")
+    except DBAPIError:
+        # Every worker runs this at boot, so the loser of a race sees a duplicate column
+        if column.name not in {c['name'] for c in inspect(engine).get_columns(table.name)}:
+            raise
+
+
+def upgrade_schema(db):
+    """Bring existing tables up to date with the models.
+
+    db.create_all() only creates missing tables, so columns and indexes added
+    to an existing model have to be added here. New columns must be nullable.
+    Every process runs this when it starts, so each change is applied on its
+    own and one that another process got to first is skipped.
+    """
+    engine = db.engine
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+
+        existing_columns = {c['name'] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing_columns:
+                _add_column(engine, table, column)
+
+        existing_indexes = {i['name'] for i in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing_indexes:
+                logger.info(f"Creating index {index.name}")
+                # IF NOT EXISTS, as another worker may be creating it at the same time
+                with engine.begin() as conn:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
@@ -0,0 +1,256 @@
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from flask import g
+from app import app, db
+from models import Job
+
+logger = logging.getLogger(__name__)
+
+# Prefix of the per-request directories created under the upload folder
+REQUEST_DIR_PREFIX = 'req-'
+
+
+class ScratchQuotaExceeded(Exception):
+    """Raised when the upload folder has no room for another upload"""
+
+
+class ScratchSpace:
+    """Managed scratch space for spooled uploads.
+
+    Every request that spools files gets its own directory, removed when the
+    request ends unless the files were handed off to a background job. A
+    sweeper removes anything older than max_age, then the oldest entries past
+    the grace period while the folder is over quota, but never the paths
+    returned by protected_paths, which belong to work still in progress. New
+    uploads are refused while usage is over quota.
+    """
+
+    def __init__(self, root, quota_bytes, max_age, grace_period, protected_paths=None):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.max_age = max_age
+        self.grace_period = grace_period
+        self.protected_paths = protected_paths
+        self._lock = threading.Lock()
+        self.counters = {
+            'dirs_created': 0,
+            'dirs_released': 0,
+            'swept_entries': 0,
+            'swept_bytes': 0,
+            'rejections': 0,
+            'sweeps': 0,
+        }
+        os.makedirs(self.root, exist_ok=True)
+        # Measured here and by each sweep, plus what this process added and released
+        # since; files written by other processes are picked up by the next sweep
+        self._bytes_in_use = sum(size for _, size, _ in self._entries())
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    @staticmethod
+    def _entry_size(path):
+        """Bytes used by a file, or by every file below a directory"""
+        if not os.path.isdir(path):
+            return os.path.getsize(path)
+        total = 0
+        for dirpath, _, filenames in os.walk(path):
+            for filename in filenames:
+                try:
+                    total += os.path.getsize(os.path.join(dirpath, filename))
+                except FileNotFoundError:
+                    pass
+        return total
+
+    def _entries(self):
+        """(mtime, size, path) for every top-level entry, oldest first"""
+        entries = []
+        with os.scandir(self.root) as scan:
+            for entry in scan:
+                try:
+                    entries.append((entry.stat().st_mtime, self._entry_size(entry.path), entry.path))
+                except FileNotFoundError:
+                    # Released while we were looking at it
+                    continue
+        entries.sort()
+        return entries
+
+    def bytes_in_use(self):
+        """Bytes used by the folder, kept as a running total between sweeps"""
+        return self._bytes_in_use
+
+    def _adjust_usage(self, amount):
+        with self._lock:
+            self._bytes_in_use = max(self._bytes_in_use + amount, 0)
+
+    def add_usage(self, size):
+        """Account for a file written into one of the scratch directories"""
+        self._adjust_usage(size)
+
+    def check_quota(self, incoming=0):
+        """Raise ScratchQuotaExceeded if `incoming` more bytes would not fit"""
+        if self.bytes_in_use() + incoming > self.quota_bytes:
+            self._count('rejections')
+            raise ScratchQuotaExceeded('Upload storage is full, please try again shortly.')
+
+    def create_dir(self):
+        path = tempfile.mkdtemp(dir=self.root, prefix=REQUEST_DIR_PREFIX)
+        self._count('dirs_created')
+        return path
+
+    def release(self, path):
+        """Remove a scratch directory and everything in it"""
+        if not path:
+            return
+        size = self._entry_size(path) if os.path.exists(path) else 0
+        shutil.rmtree(path, ignore_errors=True)
+        self._adjust_usage(-size)
+        self._count('dirs_released')
+
+    def _remove(self, path, size):
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+        self._count('swept_entries')
+        self._count('swept_bytes', size)
+
+    def sweep(self):
+        """Remove expired entries, then the oldest ones while over quota.
+
+        Entries younger than the grace period are never removed, so a request
+        that is still writing its files is left alone, and neither are
+        protected entries, such as the inputs of jobs that have yet to run.
+        Returns the bytes in use, which also resets the running total.
+        """
+        protected = {os.path.abspath(path) for path in self.protected_paths()} if self.protected_paths else set()
+        now = time.time()
+        entries = self._entries()
+        kept = []
+        removed = 0
+        for mtime, size, path in entries:
+            if os.path.abspath(path) in protected:
+                kept.append((mtime, size, path))
+            elif now - mtime > self.max_age:
+                self._remove(path, size)
+                removed += 1
+            else:
+                kept.append((mtime, size, path))
+
+        in_use = sum(size for _, size, _ in kept)
+        for mtime, size, path in kept:
+            if in_use <= self.quota_bytes:
+                break
+            if now - mtime < self.grace_period:
+                break
+            if os.path.abspath(path) in protected:
+                continue
+            self._remove(path, size)
+            in_use -= size
+            removed += 1
+
+        with self._lock:
+            self._bytes_in_use = in_use
+        self._count('sweeps')
+        if removed:
+            logger.info(f"Swept {removed} temporary uploads, {in_use} bytes in use")
+        return in_use
+
+    def stats(self):
+        """Usage and lifecycle counters"""
+        entries = self._entries()
+        with self._lock:
+            stats = dict(self.counters)
+        stats['entries'] = len(entries)
+        stats['bytes_in_use'] = sum(size for _, size, _ in entries)
+        stats['quota_bytes'] = self.quota_bytes
+        return stats
+
+
+_sweeper = None
+_sweeper_lock = threading.Lock()
+
+
+def active_job_dirs():
+    """Scratch directories handed to jobs that are still queued or running"""
+    with app.app_context():
+        payloads = db.session.scalars(
+            db.select(Job.payload).where(Job.status.in_(('queued', 'running')))
+        ).all()
+    return {payload['scratch_dir'] for payload in payloads
+            if isinstance(payload, dict) and payload.get('scratch_dir')}
+
+
+def get_scratch_space():
+    """Get the scratch space, creating it on first use"""
+    scratch = app.extensions.get('scratch_space')
+    if scratch is None:
+        scratch = ScratchSpace(
+            app.config['UPLOAD_FOLDER'],
+            app.config['SCRATCH_QUOTA_BYTES'],
+            app.config['SCRATCH_MAX_AGE'],
+            app.config['SCRATCH_GRACE_PERIOD'],
+            protected_paths=active_job_dirs
+        )
+        app.extensions['scratch_space'] = scratch
+    return scratch
+
+
+def start_sweeper():
+    """Start this process's sweeper thread if it is not running yet"""
+    global _sweeper
+    with _sweeper_lock:
+        if _sweeper is not None:
+            return
+        _sweeper = threading.Thread(target=_sweeper_loop, name='scratch-sweeper', daemon=True)
+        _sweeper.start()
+
+
+def _sweeper_loop():
+    scratch = get_scratch_space()
+    while True:
+        try:
+            scratch.sweep()
+        except Exception as e:
+            logger.error(f"Error sweeping scratch space: {str(e)}")
+        time.sleep(app.config['SCRATCH_SWEEP_INTERVAL'])
+
+
+def request_scratch_dir():
+    """The current request's scratch directory, created on first use"""
+    if 'scratch_dir' not in g:
+        start_sweeper()
+        g.scratch_dir = get_scratch_space().create_dir()
+    return g.scratch_dir
+
+
+def keep_request_scratch_dir():
+    """Hand the request's scratch directory off so it outlives the request.
+
+    Whoever it is handed to must release it; the sweeper removes it
+    eventually if they never do.
+    """
+    g.scratch_keep = True
+    return g.scratch_dir
+
+
+@app.teardown_request
+def release_request_scratch_dir(exc):
+    scratch_dir = g.pop('scratch_dir', None)
+    if scratch_dir and not g.pop('scratch_keep', False):
+        get_scratch_space().release(scratch_dir)
+
+
+@app.cli.command('sweep-uploads')
+def sweep_uploads_command():
+    """Remove expired temporary uploads"""
+    in_use = get_scratch_space().sweep()
+    print(f"{in_use} bytes of temporary uploads in use")
@@ -0,0 +1,173 @@
+import re
+import time
+import logging
+import threading
+from flask import request, jsonify
+from sqlalchemy import event
+from app import app, db
+from metrics import require_metrics_token
+
+logger = logging.getLogger(__name__)
+
+# Most distinct fingerprints tracked; anything beyond is counted under OTHER_FINGERPRINT
+MAX_FINGERPRINTS = 1000
+OTHER_FINGERPRINT = '<other>'
+
+# Default number of fingerprints in a report
+REPORT_LIMIT = 20
+
+# Literals and bind parameter lists that vary between runs of the same statement
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST_RE = re.compile(r'\bIN\s*\((?:\s*[?%][^,)]*,?)+\)', re.IGNORECASE)
+_SPACE_RE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """Normalize a statement so runs that differ only in values group together"""
+    statement = _STRING_RE.sub('?', statement)
+    statement = _NUMBER_RE.sub('?', statement)
+    statement = _IN_LIST_RE.sub('IN (...)', statement)
+    return _SPACE_RE.sub(' ', statement).strip()
+
+
+def redact_parameters(parameters):
+    """Describe bound parameters by type only, so no values reach the logs"""
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (list, tuple, dict)):
+            # executemany: describe the first row and how many there were
+            return [redact_parameters(parameters[0]), f'x{len(parameters)}']
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class SqlProfiler:
+    """Statement-level profiler attached to the engine's cursor events.
+
+    While enabled, every statement is timed and aggregated by fingerprint,
+    and statements slower than threshold_ms are logged with their parameters
+    redacted. It can be switched on and off at runtime; while off, the event
+    hooks only check a flag.
+    """
+
+    def __init__(self, enabled, threshold_ms):
+        self.enabled = enabled
+        self.threshold_ms = threshold_ms
+        self._stats = {}  # fingerprint -> [count, total ms, max ms, slow count]
+        self._lock = threading.Lock()
+
+    def configure(self, enabled=None, threshold_ms=None):
+        if enabled is not None:
+            self.enabled = enabled
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        logger.info(f"SQL profiler {'enabled' if self.enabled else 'disabled'}, "
+                    f"slow query threshold {self.threshold_ms}ms")
+
+    def record(self, statement, parameters, elapsed_ms):
+        key = fingerprint(statement)
+        slow = elapsed_ms >= self.threshold_ms
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                if len(self._stats) >= MAX_FINGERPRINTS:
+                    key = OTHER_FINGERPRINT
+                stats = self._stats.setdefault(key, [0, 0.0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += elapsed_ms
+            stats[2] = max(stats[2], elapsed_ms)
+            stats[3] += slow
+
+        if slow:
+            # The fingerprint rather than the statement, so inlined literals never reach the logs
+            logger.warning(f"Slow query ({elapsed_ms:.1f}ms): {key} params: {redact_parameters(parameters)}")
+
+    def report(self, limit=REPORT_LIMIT):
+        """The fingerprints with the most total time, slowest first"""
+        with self._lock:
+            items = [(key, list(stats)) for key, stats in self._stats.items()]
+        items.sort(key=lambda item: item[1][1], reverse=True)
+        return [{
+            'fingerprint': key,
+            'count': count,
+            'total_ms': round(total, 3),
+            'mean_ms': round(total / count, 3),
+            'max_ms': round(longest, 3),
+            'slow_count': slow,
+        } for key, (count, total, longest, slow) in items[:limit]]
+
+    def log_report(self, limit=REPORT_LIMIT):
+        """Write the top-N report to the log"""
+        lines = [f"{row['total_ms']:>10.1f}ms total {row['count']:>7} calls "
+                 f"{row['mean_ms']:>8.2f}ms mean {row['max_ms']:>8.2f}ms max  {row['fingerprint']}"
+                 for row in self.report(limit)]
+        logger.info("SQL profile, top statements by total time:\n" + '\n'.join(lines))
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+
+profiler = SqlProfiler(app.config['SQL_PROFILER_ENABLED'], app.config['SQL_SLOW_QUERY_MS'])
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if profiler.enabled:
+        conn.info.setdefault('profiler_query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('profiler_query_started')
+    if started:
+        # Recorded even if the profiler was switched off mid-statement, to keep the stack balanced
+        profiler.record(statement, parameters, (time.perf_counter() - started.pop()) * 1000)
+
+
+def _handle_error(context):
+    if context.connection is not None:
+        started = context.connection.info.get('profiler_query_started')
+        if started:
+            started.pop()
+
+
+with app.app_context():
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(db.engine, 'handle_error', _handle_error)
+
+
+@app.route('/api/sql_profile', methods=['GET', 'POST'])
+def sql_profile():
+    """Read the SQL profile, or switch the profiler at runtime.
+
+    POST a JSON object with any of enabled (boolean), threshold_ms (a
+    non-negative number), reset and log. Protected by METRICS_TOKEN like
+    /metrics, so it is disabled unless a token is configured.
+    """
+    require_metrics_token()
+    if request.method == 'POST':
+        options = request.get_json(silent=True)
+        if not isinstance(options, dict):
+            return jsonify({'success': False, 'error': 'Expected a JSON object'}), 400
+        enabled = options.get('enabled')
+        threshold_ms = options.get('threshold_ms')
+        if enabled is not None and not isinstance(enabled, bool):
+            return jsonify({'success': False, 'error': 'enabled must be true or false'}), 400
+        if threshold_ms is not None and (isinstance(threshold_ms, bool)
+                                         or not isinstance(threshold_ms, (int, float)) or threshold_ms < 0):
+            return jsonify({'success': False, 'error': 'threshold_ms must be a non-negative number'}), 400
+
+        profiler.configure(enabled=enabled, threshold_ms=threshold_ms)
+        if options.get('log'):
+            profiler.log_report()
+        if options.get('reset'):
+            profiler.reset()
+
+    return jsonify({
+        'success': True,
+        'enabled': profiler.enabled,
+        'threshold_ms': profiler.threshold_ms,
+        'report': profiler.report(max(request.args.get('limit', REPORT_LIMIT, type=int), 1))
+    })
@@ -21,9 +21,13 @@ document.addEventListener('DOMContentLoaded', function() {
     const downloadEndcardBtn = document.getElementById('download-endcard-btn');
     const endcardId = document.getElementById('endcard-id');
 
+    // Milliseconds between conversion status checks
+    const JOB_POLL_INTERVAL = 1000;
+
     // State
     let currentPreviewOrientation = 'portrait';
     let currentEndcardId = endcardId ? endcardId.value : null;
+    let localMediaUrls = {};
 
     // Initialize
     function init() {
@@ -75,31 +79,44 @@ document.addEventListener('DOMContentLoaded', function() {
     function previewFile(fileInput) {
         if (fileInput.files && fileInput.files[0]) {
             const file = fileInput.files[0];
-            const reader = new FileReader();
-
-            reader.onload = function(e) {
-                previewArea.classList.remove('d-none');
-
-                const isVideo = file.type.startsWith('video/');
-                if (isVideo) {
-                    videoPreview.src = e.target.result;
-                    videoPreview.classList.remove('d-none');
-                    mediaPreview.classList.add('d-none');
-                } else {
-                    mediaPreview.src = e.target.result;
-                    mediaPreview.classList.remove('d-none');
-                    videoPreview.classList.add('d-none');
-                }
-            };
+            const orientation = fileInput === portraitFileInput ? 'portrait' : 'landscape';
+
+            // Point straight at the local file instead of reading it into a data URL
+            if (localMediaUrls[orientation]) {
+                URL.revokeObjectURL(localMediaUrls[orientation]);
+            }
+            localMediaUrls[orientation] = URL.createObjectURL(file);
 
-            reader.readAsDataURL(file);
+            previewArea.classList.remove('d-none');
+
+            const isVideo = file.type.startsWith('video/');
+            if (isVideo) {
+                videoPreview.src = localMediaUrls[orientation];
+                videoPreview.classList.remove('d-none');
+                mediaPreview.classList.add('d-none');
+            } else {
+                mediaPreview.src = localMediaUrls[orientation];
+                mediaPreview.classList.remove('d-none');
+                videoPreview.classList.add('d-none');
+            }
         }
     }
 
+    // Media source for the endcard preview, preferring the files already on this device
+    function previewMediaUrl(orientation, data) {
+        if (localMediaUrls[orientation]) {
+            return localMediaUrls[orientation];
+        }
+        // Absolute, since relative URLs don't resolve inside a blob: document
+        return new URL(data[`${orientation}_preview_url`], window.location.origin).href;
+    }
+
     // Clear file selection
     function clearFileSelection() {
         portraitFileInput.value = '';
         landscapeFileInput.value = '';
+        Object.values(localMediaUrls).forEach(url => URL.revokeObjectURL(url));
+        localMediaUrls = {};
         mediaPreview.src = '';
         videoPreview.src = '';
         previewArea.classList.add('d-none');
@@ -141,6 +158,7 @@ document.addEventListener('DOMContentLoaded', function() {
             body: formData
         })
         .then(response => response.json())
+        .then(data => data.success ? pollJob(data.status_url) : data)
         .then(data => {
             loadingIndicator.classList.add('d-none');
 
@@ -167,6 +185,19 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Poll a background conversion job until it finishes
+    function pollJob(statusUrl) {
+        return fetch(statusUrl)
+            .then(response => response.json())
+            .then(data => {
+                if (data.status === 'queued' || data.status === 'running') {
+                    return new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL))
+                        .then(() => pollJob(statusUrl));
+                }
+                return data;
+            });
+    }
+
     // Show error message
     function showError(message) {
         errorContainer.classList.remove('d-none');
@@ -202,6 +233,9 @@ document.addEventListener('DOMContentLoaded', function() {
     function updateEndcardPreview(data) {
         if (!endcardPreview) return;
 
+        const portraitSrc = previewMediaUrl('portrait', data);
+        const landscapeSrc = previewMediaUrl('landscape', data);
+
         // Create a blob URL for the iframe
         const html = `
         <!DOCTYPE html>
@@ -230,11 +264,11 @@ document.addEventListener('DOMContentLoaded', function() {
         </head>
         <body>
             ${data.is_video ? `
-                <video id="portrait" class="media-content active" src="${data.portrait_data_url}" autoplay loop muted playsinline></video>
-                <video id="landscape" class="media-content" src="${data.landscape_data_url}" autoplay loop muted playsinline></video>
+                <video id="portrait" class="media-content active" src="${portraitSrc}" autoplay loop muted playsinline></video>
+                <video id="landscape" class="media-content" src="${landscapeSrc}" autoplay loop muted playsinline></video>
             ` : `
-                <img id="portrait" class="media-content active" src="${data.portrait_data_url}" alt="Endcard">
-                <img id="landscape" class="media-content" src="${data.landscape_data_url}" alt="Endcard">
+                <img id="portrait" class="media-content active" src="${portraitSrc}" alt="Endcard">
+                <img id="landscape" class="media-content" src="${landscapeSrc}" alt="Endcard">
             `}
             <script>
                 const isPortrait = () => window.innerHeight > window.innerWidth;
@@ -1,47 +1,29 @@
 import os
 import json
+import time
 import logging
+import threading
 import stripe
+import requests
 from flask import Blueprint, request, jsonify, session, redirect, url_for
 from app import app, db
 from models import User, UserCredit
+from webhook_inbox import record_event, event_handler
+from metrics import instrument_session
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
-# Stripe configuration and state
-stripe_enabled = False
+# Stripe configuration
 STRIPE_SECRET_KEY = os.environ.get('STRIPE_SECRET_KEY')
 STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
 STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
 
-def init_stripe():
-    """Initialize Stripe with graceful fallback"""
-    global stripe_enabled
-
-    if not STRIPE_SECRET_KEY:
-        logger.warning("STRIPE_SECRET_KEY not set - payment features disabled")
-        return False
-
-    stripe.api_key = STRIPE_SECRET_KEY
-    try:
-        # Test the API key
-        stripe.Account.retrieve()
-        stripe_enabled = True
-        logger.info("Stripe initialized successfully")
-        return True
-    except stripe.error.AuthenticationError as e:
-        logger.error(f"Stripe authentication failed: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(f"Stripe initialization error: {str(e)}")
-        return False
+# Seconds a successful account check is trusted before it is re-verified
+STRIPE_STATUS_TTL = 300
 
-if not STRIPE_WEBHOOK_SECRET:
-    logger.warning("STRIPE_WEBHOOK_SECRET not set - webhook verification will fail")
-
-# Initialize Stripe and check environment variables
-init_stripe()
+# Seconds before a failed account check is retried
+STRIPE_STATUS_RETRY = 60
 
 # Check if environment variables are set and log status
 stripe_vars = [
@@ -55,49 +37,77 @@ for var in stripe_vars:
     if not os.environ.get(var):
         logger.warning(f"Environment variable {var} is not set")
 
-def get_stripe_status():
-    """Get current Stripe configuration status"""
-    return {
-        'enabled': stripe_enabled,
-        'publishable_key': STRIPE_PUBLISHABLE_KEY
-    }
-    """Initialize and validate Stripe configuration"""
-    if not stripe.api_key:
-        logger.error("STRIPE_SECRET_KEY is not properly configured")
-        return False
 
-    try:
-        # Test the API key by making a simple API call
-        stripe.Account.retrieve()
-        logger.info("Stripe API key verified successfully")
-        return True
-    except stripe.error.AuthenticationError as e:
-        logger.error(f"Stripe authentication error: {str(e)}")
-        return False
-    except Exception as e:
-        logger.error(f"Stripe configuration error: {str(e)}")
+class StripeStatus:
+    """Cached result of verifying the Stripe account.
+
+    Verification is a network call, so it never runs on a request thread:
+    the first lookup starts it in the background and later lookups refresh
+    it the same way once the result is older than its TTL. Until the first
+    check finishes the status reports checked=False.
+    """
+
+    def __init__(self):
+        self._enabled = False
+        self._checked = False
+        self._expires_at = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def _verify(self):
+        enabled = False
+        try:
+            stripe.Account.retrieve()
+            enabled = True
+            logger.info("Stripe API key verified successfully")
+        except stripe.error.AuthenticationError as e:
+            logger.error(f"Stripe authentication failed: {str(e)}")
+        except Exception as e:
+            logger.error(f"Stripe initialization error: {str(e)}")
+        finally:
+            with self._lock:
+                self._enabled = enabled
+                self._checked = True
+                self._expires_at = time.monotonic() + (STRIPE_STATUS_TTL if enabled else STRIPE_STATUS_RETRY)
+                self._refreshing = False
+
+    def get(self):
+        """Current status, starting a background check if it is missing or stale"""
+        with self._lock:
+            if STRIPE_SECRET_KEY and time.monotonic() >= self._expires_at and not self._refreshing:
+                self._refreshing = True
+                threading.Thread(target=self._verify, name='stripe-verify', daemon=True).start()
+            return {
+                'enabled': self._enabled,
+                'checked': self._checked or not STRIPE_SECRET_KEY,
+                'publishable_key': STRIPE_PUBLISHABLE_KEY
+            }
+
+
+stripe_status = StripeStatus()
+
+
+def init_stripe():
+    """Configure the Stripe client on first use; no network calls are made here"""
+    if not STRIPE_SECRET_KEY:
+        logger.warning("STRIPE_SECRET_KEY not set - payment features disabled")
         return False
+    if stripe.api_key != STRIPE_SECRET_KEY:
+        stripe.api_key = STRIPE_SECRET_KEY
+        # Route Stripe calls through a session whose timings are recorded
+        stripe.default_http_client = stripe.RequestsClient(session=instrument_session(requests.Session(), 'stripe'))
+        stripe_status.get()
+    return True
 
-# Create blueprint
-stripe_blueprint = Blueprint('stripe_handler', __name__)
 
-# Credit packages configuration
-CREDIT_PACKAGES = {
-    'starter': {'credits': 10, 'price': 1000, 'name': 'Starter Package'},  # $10
-    'standard': {'credits': 35, 'price': 2500, 'name': 'Standard Package'},  # $25
-    'pro': {'credits': 70, 'price': 4500, 'name': 'Pro Package'}       # $45
-}
+def get_stripe_status():
+    """Get current Stripe configuration status"""
+    init_stripe()
+    return stripe_status.get()
 
-# Log configuration status
-STRIPE_WEBHOOK_SECRET = os.environ.get('STRIPE_WEBHOOK_SECRET')
-STRIPE_PUBLISHABLE_KEY = os.environ.get('STRIPE_PUBLISHABLE_KEY')
 
-if not stripe.api_key:
-    logger.warning("STRIPE_SECRET_KEY is not set. API functionality will be limited.")
 if not STRIPE_WEBHOOK_SECRET:
-    logger.warning("STRIPE_WEBHOOK_SECRET is not set. Webhook verification will be limited.")
-if not STRIPE_PUBLISHABLE_KEY:
-    logger.warning("STRIPE_PUBLISHABLE_KEY is not set. Client-side integration will be limited.")
+    logger.warning("STRIPE_WEBHOOK_SECRET not set - webhook verification will fail")
 
 # Create blueprint
 stripe_blueprint = Blueprint('stripe_handler', __name__)
@@ -129,6 +139,7 @@ def create_payment_intent():
         package = CREDIT_PACKAGES[package_id]
 
         # Create a new PaymentIntent
+        init_stripe()
         intent = stripe.PaymentIntent.create(
             amount=package['price'],
             currency='usd',
@@ -156,68 +167,64 @@ def create_payment_intent():
 
 @stripe_blueprint.route('/webhook', methods=['POST'])
 def webhook():
-    """Handle Stripe webhook events"""
+    """Handle Stripe webhook events.
+
+    Verified events are stored in the inbox and acknowledged straight away;
+    the inbox processor applies them in the background.
+    """
     payload = request.data
     sig_header = request.headers.get('Stripe-Signature')
 
     try:
         # Verify webhook signature
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, STRIPE_WEBHOOK_SECRET
         )
-
-        # Handle the event
-        if event['type'] == 'payment_intent.succeeded':
-            payment_intent = event['data']['object']
-            handle_payment_success(payment_intent)
-        elif event['type'] == 'payment_intent.payment_failed':
-            payment_intent = event['data']['object']
-            handle_payment_failure(payment_intent)
-
-        return jsonify({'status': 'success'})
-
     except Exception as e:
         logger.error(f"Webhook error: {str(e)}")
         return jsonify({'error': 'Webhook validation failed'}), 400
 
+    try:
+        event = json.loads(payload)
+        if not record_event(event):
+            logger.info(f"Ignoring duplicate webhook event: {event['id']}")
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        logger.error(f"Error storing webhook event: {str(e)}")
+        db.session.rollback()
+        # A non-2xx response makes Stripe retry the delivery later
+        return jsonify({'error': 'Webhook could not be stored'}), 500
+
+@event_handler('payment_intent.succeeded')
 def handle_payment_success(payment_intent):
     """Process successful payment"""
-    logger.info(f"Processing successful payment: {payment_intent.id}")
+    logger.info(f"Processing successful payment: {payment_intent['id']}")
 
-    try:
-        # Extract user and credits from metadata
-        user_id = payment_intent.metadata.get('user_id')
-        credits = int(payment_intent.metadata.get('credits', 0))
-
-        if not user_id or not credits:
-            logger.error(f"Missing metadata in payment intent: {payment_intent.id}")
-            return
-
-        # Find the user
-        user = User.query.get(user_id)
-        if not user:
-            logger.error(f"User not found for payment: {user_id}")
-            return
-
-        # Add credits to user account
-        if hasattr(user, 'credits') and user.credits:
-            user.credits.add_credits(credits)
-        else:
-            # Create new credit record if it doesn't exist
-            user_credit = UserCredit(user_id=user.id, credits=credits)
-            db.session.add(user_credit)
-
-        db.session.commit()
-        logger.info(f"Added {credits} credits to user {user_id}")
+    # Extract user and credits from metadata
+    metadata = payment_intent.get('metadata') or {}
+    user_id = metadata.get('user_id')
+    credits = int(metadata.get('credits', 0))
 
-    except Exception as e:
-        logger.error(f"Error processing payment success: {str(e)}")
-        db.session.rollback()
+    if not user_id or not credits:
+        logger.error(f"Missing metadata in payment intent: {payment_intent['id']}")
+        return
+
+    # Find the user
+    user = db.session.get(User, int(user_id))
+    if not user:
+        logger.error(f"User not found for payment: {user_id}")
+        return
+
+    # Committed by the inbox together with marking the event processed
+    UserCredit.apply_credits(user.id, credits, 'payment_intent', payment_intent['id'],
+                             idempotency_key=f"payment_intent:{payment_intent['id']}")
+    logger.info(f"Added {credits} credits to user {user_id}")
 
+@event_handler('payment_intent.payment_failed')
 def handle_payment_failure(payment_intent):
     """Process failed payment"""
-    logger.info(f"Payment failed: {payment_intent.id}")
-    logger.info(f"Failure reason: {payment_intent.last_payment_error}")
+    logger.info(f"Payment failed: {payment_intent['id']}")
+    logger.info(f"Failure reason: {payment_intent.get('last_payment_error')}")
 
     # You could implement additional logic here, such as:
     # - Notifying admins of failed payments
@@ -236,6 +243,7 @@ def create_checkout_session():
         user = get_current_user()
         pkg = CREDIT_PACKAGES[package]
 
+        init_stripe()
         checkout_session = stripe.checkout.Session.create(
             payment_method_types=['card'],
             line_items=[{
@@ -0,0 +1,127 @@
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+# The app reads its configuration from the environment and creates its log
+# and folders relative to the working directory when imported, so point it
+# at a throwaway directory first
+WORK_DIR = tempfile.mkdtemp(prefix='endcard-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(WORK_DIR, 'endcards.db')}"
+os.environ['BLOB_STORE_PATH'] = os.path.join(WORK_DIR, 'media_blobs')
+os.environ['RENDER_CACHE_DIR'] = os.path.join(WORK_DIR, 'render_cache')
+# Tests drive the job queue and inbox themselves
+os.environ['BACKGROUND_WORKERS'] = 'false'
+
+_cwd = os.getcwd()
+os.chdir(WORK_DIR)
+import main  # noqa: E402  Registers the routes, blueprints and engine listeners
+from app import app as flask_app, db  # noqa: E402
+from models import User, UserCredit, Endcard, Job  # noqa: E402
+from blob_store import get_blob_store  # noqa: E402
+import job_queue  # noqa: E402
+os.chdir(_cwd)
+flask_app.config['UPLOAD_FOLDER'] = os.path.join(WORK_DIR, 'tmp_uploads')
+
+
+@pytest.fixture
+def app():
+    flask_app.config['TESTING'] = True
+    # The test client talks plain HTTP from a fixed address
+    flask_app.config['SESSION_COOKIE_SECURE'] = False
+    flask_app.login_manager.session_protection = None
+    with flask_app.app_context():
+        yield flask_app
+        db.session.remove()
+
+
+@pytest.fixture
+def make_user(app):
+    """Factory creating a signed-in user with a credit balance, returning the user id"""
+    def make(credits=5):
+        user = User(email=f'{os.urandom(4).hex()}@example.com', google_id=os.urandom(8).hex(),
+                    is_authenticated=True)
+        db.session.add(user)
+        db.session.flush()
+        db.session.add(UserCredit(user_id=user.id, credits=credits))
+        db.session.commit()
+        return user.id
+    return make
+
+
+@pytest.fixture
+def endcard(make_user):
+    """A renderable endcard with a small PNG in both orientations, owned by a user with 10 credits"""
+    user_id = make_user(credits=10)
+    blob_key, size = get_blob_store().put_bytes(b'\x89PNG\r\n\x1a\n' + b'\0' * 64)
+    endcard = Endcard(user_id=user_id)
+    for orientation in ('portrait', 'landscape'):
+        for column, value in (('created', True), ('filename', f'{orientation}.png'), ('file_type', 'image'),
+                              ('file_size', size), ('blob_key', blob_key), ('mime_type', 'image/png')):
+            setattr(endcard, f'{orientation}_{column}', value)
+    db.session.add(endcard)
+    db.session.commit()
+    return endcard
+
+
+@pytest.fixture
+def balance(app):
+    """Function reading a user's current credit balance from the database"""
+    def read(user_id):
+        db.session.expire_all()
+        return UserCredit.query.filter_by(user_id=user_id).one().credits
+    return read
+
+
+@pytest.fixture
+def make_png():
+    """Function returning the bytes of a PNG whose headers declare the given size"""
+    def make(width, height):
+        return (b'\x89PNG\r\n\x1a\n' + struct.pack('>I4sII', 13, b'IHDR', width, height)
+                + b'\x08\x06\0\0\0' + b'\0' * 64)
+    return make
+
+
+@pytest.fixture
+def empty_queue(app, monkeypatch):
+    """Leave queued jobs for the test to run rather than background workers.
+
+    Jobs other tests left behind in the shared database are failed first,
+    so the next claim is the test's own.
+    """
+    monkeypatch.setattr(job_queue, 'start_workers', lambda: None)
+    db.session.execute(db.update(Job).where(Job.status.in_(['queued', 'running'])).values(status='failed'))
+    db.session.commit()
+
+
+@pytest.fixture
+def client_for(app):
+    """Factory for a test client logged in as the given user id"""
+    def make(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return make
+
+
+@pytest.fixture
+def count_queries(app):
+    """Context manager collecting the SQL statements executed inside it"""
+    @contextmanager
+    def count():
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+    return count
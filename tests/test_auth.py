@@ -0,0 +1,92 @@
+import io
+import os
+
+from app import db
+from models import Endcard, Job
+
+
+def credit_queries(statements):
+    """Statements that read the credit table on its own rather than joined to the user"""
+    return [s for s in statements if 'FROM user_credit' in s]
+
+
+def test_user_and_credits_load_in_one_query(make_user, client_for, count_queries):
+    client = client_for(make_user(credits=3))
+    with count_queries() as statements:
+        response = client.get('/api/endcards')
+
+    assert response.status_code == 200
+    assert not credit_queries(statements)
+    # load_user with credits joined in, then the dated and undated history rows
+    assert len(statements) == 3
+
+
+def test_page_load_query_count(make_user, client_for, count_queries):
+    user_id = make_user(credits=3)
+    db.session.add(Endcard(user_id=user_id))
+    db.session.commit()
+    client = client_for(user_id)
+
+    with count_queries() as statements:
+        response = client.get('/history')
+
+    assert response.status_code == 200
+    assert not credit_queries(statements)
+    # load_user with credits joined in, then the dated and undated history rows
+    assert len(statements) == 3
+
+
+def test_credit_check_reuses_request_user(make_user, client_for, count_queries):
+    user_id = make_user(credits=3)
+    endcard = Endcard(user_id=user_id)
+    db.session.add(endcard)
+    db.session.commit()
+    endcard_id = endcard.id
+    client = client_for(user_id)
+
+    # manage_session, check_credits and the view all share the user loaded for the request
+    with count_queries() as statements:
+        response = client.get(f'/api/endcard/{endcard_id}')
+
+    assert response.status_code == 200
+    assert not credit_queries(statements)
+    # load_user with credits joined in, then the endcard
+    assert len(statements) == 2
+
+
+def test_upload_query_count(make_user, client_for, count_queries, make_png, empty_queue):
+    client = client_for(make_user(credits=3))
+
+    with count_queries() as statements:
+        response = client.post('/process_upload', data={
+            'portrait_file': (io.BytesIO(make_png(720, 1280)), 'portrait.png'),
+            'landscape_file': (io.BytesIO(make_png(1280, 720)), 'landscape.png'),
+        })
+
+    assert response.status_code == 202
+    assert not credit_queries(statements)
+    # load_user with credits joined in, the active job payloads for the scratch
+    # quota, then inserting the job
+    assert len(statements) == 3
+
+
+def test_job_poll_query_count(make_user, client_for, count_queries):
+    user_id = make_user(credits=3)
+    endcard = Endcard(user_id=user_id, portrait_created=True)
+    db.session.add(endcard)
+    db.session.flush()
+    job = Job(id=os.urandom(16).hex(), user_id=user_id, kind='convert_upload', status='done',
+              result={'endcard_id': endcard.id})
+    db.session.add(job)
+    db.session.commit()
+    job_id = job.id
+    client = client_for(user_id)
+
+    with count_queries() as statements:
+        response = client.get(f'/api/jobs/{job_id}')
+
+    assert response.status_code == 200
+    assert response.json['status'] == 'done'
+    assert not credit_queries(statements)
+    # load_user with credits joined in, the job, then the endcard for its preview URLs
+    assert len(statements) == 3
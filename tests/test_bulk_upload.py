@@ -0,0 +1,98 @@
+import io
+import time
+
+import pytest
+
+import job_queue
+import routes
+from app import db
+from models import Endcard
+from scratch_space import get_scratch_space
+
+# Floors for the bulk upload benchmark. A laptop accepts and converts about
+# 1,500 of these small pairs a second, so only a regression trips them
+MIN_PAIRS_ACCEPTED_PER_SECOND = 50
+MIN_PAIRS_CONVERTED_PER_SECOND = 50
+
+
+def pairs(make_png, count):
+    """Form fields for `count` distinct portrait/landscape pairs"""
+    return {
+        'portrait_file': [(io.BytesIO(make_png(720, 1280 + i)), f'portrait_{i}.png') for i in range(count)],
+        'landscape_file': [(io.BytesIO(make_png(1280 + i, 720)), f'landscape_{i}.png') for i in range(count)],
+    }
+
+
+def run_queued_job():
+    job_id = job_queue._claim_next_job()
+    job_queue._run_job(job_id)
+    return job_id
+
+
+def owned_endcards(user_id):
+    return db.session.scalar(db.select(db.func.count()).select_from(Endcard).where(Endcard.user_id == user_id))
+
+
+def test_pairs_are_converted_by_a_job(make_user, client_for, make_png, empty_queue):
+    user_id = make_user()
+    client = client_for(user_id)
+    scratch_in_use = get_scratch_space().bytes_in_use()
+    data = pairs(make_png, 3)
+    # Named as a PNG, but not one
+    data['landscape_file'][1] = (io.BytesIO(b'not an image'), 'landscape_1.png')
+
+    response = client.post('/api/bulk_upload', data=data)
+
+    assert response.status_code == 202
+    assert response.json['queued'] == 2
+    assert [result['name'] for result in response.json['results']] == ['pair-2']
+    # Nothing is converted within the request
+    assert owned_endcards(user_id) == 0
+
+    assert run_queued_job() == response.json['job_id']
+
+    job = client.get(response.json['status_url']).json
+    assert job['status'] == 'done'
+    assert job['created'] == 2
+    assert [result['name'] for result in job['results']] == ['pair-1', 'pair-3']
+    assert owned_endcards(user_id) == 2
+    # The job released the spooled files
+    assert get_scratch_space().bytes_in_use() == scratch_in_use
+
+
+def test_full_scratch_space_is_refused_before_reading_files(make_user, client_for, make_png, empty_queue,
+                                                          monkeypatch):
+    def read_files(*args):
+        raise AssertionError('The files were read')
+
+    monkeypatch.setattr(get_scratch_space(), 'quota_bytes', 1024)
+    monkeypatch.setattr(routes, 'collect_from_files', read_files)
+    client = client_for(make_user())
+
+    response = client.post('/api/bulk_upload', data=pairs(make_png, 20))
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After']
+    assert job_queue._claim_next_job() is None
+
+
+@pytest.mark.slow
+def test_bulk_upload_throughput(make_user, client_for, make_png, empty_queue, record_property):
+    user_id = make_user()
+    client = client_for(user_id)
+    data = pairs(make_png, routes.BULK_MAX_PAIRS)
+
+    started = time.perf_counter()
+    response = client.post('/api/bulk_upload', data=data)
+    accepted_per_second = routes.BULK_MAX_PAIRS / (time.perf_counter() - started)
+    assert response.status_code == 202
+
+    started = time.perf_counter()
+    run_queued_job()
+    converted_per_second = routes.BULK_MAX_PAIRS / (time.perf_counter() - started)
+
+    record_property('pairs_accepted_per_second', round(accepted_per_second))
+    record_property('pairs_converted_per_second', round(converted_per_second))
+    assert owned_endcards(user_id) == routes.BULK_MAX_PAIRS
+    assert accepted_per_second > MIN_PAIRS_ACCEPTED_PER_SECOND
+    assert converted_per_second > MIN_PAIRS_CONVERTED_PER_SECOND
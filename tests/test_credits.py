@@ -0,0 +1,84 @@
+import threading
+import time
+
+import pytest
+
+from app import app, db
+from models import UserCredit, CreditLedger
+
+THREADS = 16
+ATTEMPTS_PER_THREAD = 5
+
+# Floor for contended deductions per second. Each one commits to the
+# file-backed SQLite test database, which sustains about 250/s on a laptop,
+# so only a regression to lock-holding or multi-statement deductions trips it
+MIN_DEDUCTIONS_PER_SECOND = 50
+
+
+def deduct_concurrently(user_id, amount=1, attempts=ATTEMPTS_PER_THREAD):
+    """Race THREADS threads, each trying `attempts` deductions; returns how many succeeded"""
+    start = threading.Barrier(THREADS)
+    successes = []
+    errors = []
+
+    def spend():
+        with app.test_request_context():
+            try:
+                credit_record = UserCredit.query.filter_by(user_id=user_id).one()
+                start.wait()
+                for _ in range(attempts):
+                    if credit_record.deduct_credit(amount=amount):
+                        successes.append(1)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=spend) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    return len(successes)
+
+
+def test_parallel_deductions_never_overspend(make_user, balance):
+    user_id = make_user(credits=30)
+
+    assert deduct_concurrently(user_id) == 30
+    assert balance(user_id) == 0
+
+
+def test_parallel_multi_credit_deductions_never_go_negative(make_user, balance):
+    # 10 credits cannot cover a fourth deduction of 3
+    user_id = make_user(credits=10)
+
+    assert deduct_concurrently(user_id, amount=3) == 3
+    assert balance(user_id) == 1
+
+
+def test_every_deduction_has_a_ledger_entry(make_user):
+    user_id = make_user(credits=25)
+
+    spent = deduct_concurrently(user_id)
+
+    entries = db.session.scalars(db.select(CreditLedger.amount).where(CreditLedger.user_id == user_id)).all()
+    assert len(entries) == spent == 25
+    assert sum(entries) == -25
+
+
+@pytest.mark.slow
+def test_deduction_throughput(make_user, balance, record_property):
+    attempts = 50
+    user_id = make_user(credits=THREADS * attempts)
+
+    started = time.perf_counter()
+    spent = deduct_concurrently(user_id, attempts=attempts)
+    per_second = spent / (time.perf_counter() - started)
+    record_property('deductions_per_second', round(per_second))
+
+    assert spent == THREADS * attempts
+    assert balance(user_id) == 0
+    assert per_second > MIN_DEDUCTIONS_PER_SECOND
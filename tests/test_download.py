@@ -0,0 +1,95 @@
+import os
+import time
+import tracemalloc
+
+import pytest
+
+from app import db
+from blob_store import get_blob_store
+from compression import SUPPORTED_ENCODINGS, compress_path, compression_level
+from endcard_renderer import ENDCARD_TEMPLATES
+from models import Endcard
+from render_cache import get_render_cache
+
+ASSET_SIZE = 6 * 1024 * 1024
+# Size of a document holding the asset as a base64 data URL, per copy
+ENCODED_SIZE = ASSET_SIZE * 4 // 3
+
+
+@pytest.fixture
+def large_endcard(make_user):
+    """An endcard whose portrait and landscape are both a multi-MB image"""
+    user_id = make_user(credits=10)
+    blob_key, size = get_blob_store().put_bytes(b'\x89PNG\r\n\x1a\n' + os.urandom(ASSET_SIZE - 8))
+    endcard = Endcard(user_id=user_id)
+    for orientation in ('portrait', 'landscape'):
+        for column, value in (('created', True), ('filename', f'{orientation}.png'), ('file_type', 'image'),
+                              ('file_size', size), ('blob_key', blob_key), ('mime_type', 'image/png')):
+            setattr(endcard, f'{orientation}_{column}', value)
+    db.session.add(endcard)
+    db.session.commit()
+    return endcard
+
+
+@pytest.mark.parametrize('template_type', list(ENDCARD_TEMPLATES))
+def test_download_streams_in_bounded_memory(large_endcard, client_for, monkeypatch, template_type):
+    # The in-process cache tier holds whole documents by design; keep it out of the measurement
+    monkeypatch.setattr(get_render_cache(), 'max_memory_entry', 0)
+    client = client_for(large_endcard.user_id)
+    copies = 2 if template_type == 'rotatable' else 1
+
+    # A miss renders while filling the cache, a hit streams the cached file
+    for _ in ('miss', 'hit'):
+        tracemalloc.start()
+        try:
+            response = client.get(f'/download_template/{template_type}/{large_endcard.id}')
+            received = sum(len(chunk) for chunk in response.iter_encoded())
+            response.close()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        assert response.status_code == 200
+        assert received == int(response.headers['Content-Length']) > copies * ENCODED_SIZE
+        # Buffering even one copy of the media would blow well past this
+        assert peak < ENCODED_SIZE / 4
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('encoding', SUPPORTED_ENCODINGS)
+def test_precompressed_download_benchmark(app, large_endcard, client_for, encoding, record_property):
+    client = client_for(large_endcard.user_id)
+    url = f'/download_template/portrait/{large_endcard.id}'
+    cache = get_render_cache()
+
+    def download(accept_encoding):
+        started = time.process_time()
+        response = client.get(url, headers={'Accept-Encoding': accept_encoding}, buffered=True)
+        assert response.status_code == 200
+        return len(response.data), time.process_time() - started, response.headers.get('Content-Encoding')
+
+    identity_bytes, identity_cpu, _ = download('identity')
+    compressions = cache.stats()['compressions']
+    # The first request compresses the document in the CPU pool, the rest reuse the variant
+    download(encoding)
+    downloads = [download(encoding) for _ in range(5)]
+    encoded_bytes, encoded_cpu, content_encoding = downloads[-1]
+
+    document = cache._path(cache.make_key(large_endcard, 'portrait'))
+    started = time.process_time()
+    compress_path(document, encoding, compression_level(encoding), document + '.bench')
+    compress_cpu = time.process_time() - started
+    os.remove(document + '.bench')
+
+    record_property('identity_bytes', identity_bytes)
+    record_property(f'{encoding}_bytes', encoded_bytes)
+    record_property('identity_cpu_ms', round(identity_cpu * 1000, 1))
+    record_property(f'{encoding}_cpu_ms', round(encoded_cpu * 1000, 1))
+    record_property(f'{encoding}_compress_cpu_ms', round(compress_cpu * 1000, 1))
+
+    assert content_encoding == encoding
+    assert cache.stats()['compressions'] == compressions + 1
+    # Base64 only carries 6 bits per byte, so even incompressible media shrinks
+    assert encoded_bytes < identity_bytes * 0.8
+    # Serving a stored variant costs a fraction of compressing the document again
+    assert max(cpu for _, cpu, _ in downloads) < compress_cpu / 2
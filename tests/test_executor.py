@@ -0,0 +1,91 @@
+import os
+import time
+
+import pytest
+
+import render_cache
+import routes
+from executor import CpuExecutor, ExecutorBusy
+
+
+def square(value):
+    return value * value
+
+
+def crash(*args):
+    os._exit(1)
+
+
+def nap(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+@pytest.fixture
+def executor():
+    executor = CpuExecutor(workers=1, max_pending=2, task_timeout=5)
+    yield executor
+    if executor._pool is not None:
+        executor._pool.shutdown(cancel_futures=True)
+
+
+def test_runs_tasks(executor):
+    assert executor.run(square, 7) == 49
+    assert executor.stats()['completed'] == 1
+
+
+def test_crashed_pool_is_rebuilt(executor):
+    with pytest.raises(ExecutorBusy):
+        executor.run(crash)
+
+    assert executor.run(square, 3) == 9
+    assert executor.stats()['rebuilds'] == 1
+
+
+def test_overrunning_task_times_out(executor):
+    executor.task_timeout = 0.2
+
+    with pytest.raises(ExecutorBusy):
+        executor.run(nap, 1)
+    assert executor.stats()['timed_out'] == 1
+
+
+def test_full_queue_rejects(executor):
+    executor.submit(nap, 0.5)
+    executor.submit(nap, 0.5)
+
+    with pytest.raises(ExecutorBusy):
+        executor.submit(square, 2, timeout=0.01)
+    assert executor.stats()['rejected'] == 1
+
+
+def test_download_falls_back_when_the_pool_crashes(app, endcard, client_for, balance, monkeypatch):
+    client = client_for(endcard.user_id)
+    url = f'/download_template/portrait/{endcard.id}'
+    monkeypatch.setattr(render_cache, 'write_segments', crash)
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'}, buffered=True)
+
+    assert response.status_code == 200
+    assert 'Content-Encoding' not in response.headers
+    assert b'<html' in response.data.lower()
+    assert balance(endcard.user_id) == 9
+
+    # The pool was rebuilt, so the next download is compressed again
+    monkeypatch.undo()
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'}, buffered=True)
+
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert balance(endcard.user_id) == 8
+
+
+def test_failed_render_refunds_the_credit(app, endcard, client_for, balance, monkeypatch):
+    def broken_render(*args, **kwargs):
+        raise OSError('render cache unavailable')
+
+    monkeypatch.setattr(routes, 'render_endcard', broken_render)
+
+    response = client_for(endcard.user_id).get(f'/download_template/portrait/{endcard.id}', buffered=True)
+
+    assert response.status_code == 302
+    assert balance(endcard.user_id) == 10
@@ -0,0 +1,43 @@
+import io
+import zipfile
+
+import pytest
+
+import routes
+from app import db
+from models import CreditLedger
+
+
+def test_repeated_selections_are_exported_and_charged_once(endcard, client_for, balance):
+    client = client_for(endcard.user_id)
+
+    response = client.post('/history/export', data={
+        'endcard_ids': [endcard.id, endcard.id],
+        'template_types': ['portrait', 'landscape', 'portrait'],
+    }, buffered=True)
+
+    assert response.status_code == 200
+    names = zipfile.ZipFile(io.BytesIO(response.data)).namelist()
+    assert names == [f'endcard_portrait_{endcard.id}.html', f'endcard_landscape_{endcard.id}.html']
+    assert balance(endcard.user_id) == 8
+
+
+def test_failed_export_is_refunded(endcard, client_for, balance, monkeypatch):
+    def failing_zip(user_id, endcard_ids, template_types):
+        yield b'PK'
+        raise OSError('disk went away')
+
+    monkeypatch.setattr(routes, 'iter_endcard_zip', failing_zip)
+    client = client_for(endcard.user_id)
+
+    with pytest.raises(OSError):
+        client.post('/history/export', data={
+            'endcard_ids': [endcard.id],
+            'template_types': ['portrait', 'landscape'],
+        }, buffered=True)
+
+    assert balance(endcard.user_id) == 10
+    reasons = db.session.scalars(
+        db.select(CreditLedger.reason).where(CreditLedger.user_id == endcard.user_id).order_by(CreditLedger.id)
+    ).all()
+    assert reasons == ['export', 'export_refund']
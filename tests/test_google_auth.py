@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import google_auth
+from google_auth import DiscoveryCache
+from models import User
+
+
+class StubGoogle:
+    """Local stand-in for Google's discovery, token and userinfo endpoints"""
+
+    def __init__(self):
+        self.requests = []
+        self.connections = 0
+        self.max_age = 3600
+        self.discovery_version = 0
+        # Cleared to hold discovery responses until the test releases them
+        self.discovery_gate = threading.Event()
+        self.discovery_gate.set()
+        self.token_delay = 0
+        # Unique per test, as users persist in the shared test database
+        self.google_id = os.urandom(8).hex()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, body, headers=()):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                if self.path == '/discovery':
+                    stub.discovery_gate.wait(5)
+                    stub.discovery_version += 1
+                    self._reply({
+                        'version': stub.discovery_version,
+                        'authorization_endpoint': f'{stub.url}/auth',
+                        'token_endpoint': f'{stub.url}/token',
+                        'userinfo_endpoint': f'{stub.url}/userinfo',
+                    }, [('Cache-Control', f'public, max-age={stub.max_age}')])
+                else:
+                    self._reply({'sub': stub.google_id, 'email': f'{stub.google_id}@example.com',
+                                 'email_verified': True, 'given_name': 'Stub'})
+
+            def do_POST(self):
+                stub.requests.append(self.path)
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                time.sleep(stub.token_delay)
+                self._reply({'access_token': 'stub-token', 'token_type': 'Bearer', 'expires_in': 3600})
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.discovery_gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def google(app, monkeypatch):
+    stub = StubGoogle()
+    monkeypatch.setattr(google_auth, 'discovery_cache', DiscoveryCache(f'{stub.url}/discovery'))
+    monkeypatch.setattr(google_auth, 'GOOGLE_CLIENT_ID', 'client-id')
+    monkeypatch.setattr(google_auth, 'GOOGLE_CLIENT_SECRET', 'client-secret')
+    # The stub speaks plain HTTP
+    monkeypatch.setenv('OAUTHLIB_INSECURE_TRANSPORT', '1')
+    # Start every test on a fresh pool so connection counts are its own
+    google_auth.http.close()
+    yield stub
+    stub.close()
+    google_auth.http.close()
+
+
+def flashed(client):
+    with client.session_transaction() as session:
+        return [message for _, message in session.get('_flashes', [])]
+
+
+def test_discovery_document_is_served_from_cache_within_max_age(google):
+    cache = google_auth.discovery_cache
+
+    assert cache.get()['version'] == 1
+    assert cache.get()['version'] == 1
+    assert google.requests == ['/discovery']
+
+
+def test_stale_discovery_document_is_served_while_refreshing(google):
+    cache = google_auth.discovery_cache
+    google.max_age = 0
+    assert cache.get()['version'] == 1
+
+    # Hold the refresh at the server; the login path must not wait for it
+    google.discovery_gate.clear()
+    started = time.monotonic()
+    assert cache.get()['version'] == 1
+    assert time.monotonic() - started < 0.5
+
+    google.discovery_gate.set()
+    deadline = time.monotonic() + 5
+    while cache._refreshing and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert cache.get()['version'] == 2
+
+
+def test_token_timeout_is_a_login_error(app, google, monkeypatch):
+    monkeypatch.setattr(google_auth, 'GOOGLE_HTTP_TIMEOUT', (1, 0.2))
+    google.token_delay = 1
+    client = app.test_client()
+
+    response = client.get('/google_login/callback?code=stub-code')
+
+    assert response.status_code == 302
+    assert flashed(client) == ['An error occurred during authentication.']
+    assert User.query.filter_by(google_id=google.google_id).first() is None
+
+
+def test_logins_reuse_one_connection(app, google):
+    client = app.test_client()
+    latencies = []
+
+    for _ in range(30):
+        started = time.monotonic()
+        response = client.get('/google_login/callback?code=stub-code')
+        latencies.append(time.monotonic() - started)
+        assert response.status_code == 302
+
+    assert User.query.filter_by(google_id=google.google_id).one().username == 'Stub'
+    # One discovery fetch, then a token and a userinfo call per login
+    assert len(google.requests) == 1 + 2 * 30
+    assert google.connections == 1
+
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    # Against a local server a login costs little beyond our own work, so a
+    # reconnect or refetch per login, or a stall on Nagle, would show up here
+    assert p50 < 0.1
+    assert p99 < 0.5
@@ -0,0 +1,128 @@
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import event, inspect
+
+import routes
+from app import db
+from blob_store import LocalBlobStore, get_blob_store
+from models import Endcard
+
+# Large enough that loading it by accident would dwarf the page itself
+PAYLOAD = b'\x89PNG\r\n\x1a\n' + b'\0' * (2 * 1024 * 1024)
+
+
+@pytest.fixture
+def heavy_history(make_user):
+    """A user with a few endcards carrying multi-MB legacy data URLs and blobs"""
+    user_id = make_user()
+    blob_key, size = get_blob_store().put_bytes(PAYLOAD)
+    data_url = 'data:image/png;base64,' + base64.b64encode(PAYLOAD).decode('ascii')
+    for _ in range(3):
+        endcard = Endcard(user_id=user_id)
+        for orientation in ('portrait', 'landscape'):
+            for column, value in (('created', True), ('filename', f'{orientation}.png'), ('file_type', 'image'),
+                                  ('file_size', size), ('blob_key', blob_key), ('mime_type', 'image/png'),
+                                  ('data_url', data_url)):
+                setattr(endcard, f'{orientation}_{column}', value)
+        db.session.add(endcard)
+    db.session.commit()
+    db.session.expunge_all()
+    return user_id
+
+
+def test_history_page_loads_no_media(heavy_history, client_for, count_queries, monkeypatch):
+    def no_blob_reads(self, key):
+        raise AssertionError(f'History page read blob {key}')
+
+    rendered = []
+
+    def render_template(template, **context):
+        # Check what was loaded once the template has touched every attribute it uses
+        html = real_render_template(template, **context)
+        rendered.extend(inspect(endcard).unloaded for endcard in context.get('endcards', []))
+        return html
+
+    real_render_template = routes.render_template
+    monkeypatch.setattr(routes, 'render_template', render_template)
+    monkeypatch.setattr(LocalBlobStore, 'open', no_blob_reads)
+    client = client_for(heavy_history)
+
+    with count_queries() as statements:
+        response = client.get('/history')
+
+    assert response.status_code == 200
+    assert response.data.count(b'portrait.png') == 3
+    assert not [statement for statement in statements if '_data_url' in statement]
+    # The page only links to the media, it never inlines it
+    assert len(response.data) < len(PAYLOAD) / 10
+
+    assert len(rendered) == 3
+    for unloaded in rendered:
+        assert {'portrait_data_url', 'landscape_data_url'} <= unloaded
+
+
+@pytest.fixture
+def long_history(make_user):
+    """A user with several thousand dated endcards, among other users' rows"""
+    user_id = make_user()
+    other_id = make_user()
+    start = datetime(2024, 1, 1)
+    db.session.execute(db.insert(Endcard), [
+        {'user_id': owner, 'created_at': start + timedelta(minutes=i // 2), 'portrait_created': True,
+         'portrait_filename': 'portrait.png', 'portrait_file_type': 'image', 'portrait_file_size': 1024}
+        for i in range(4000) for owner in (user_id, other_id)
+    ])
+    db.session.commit()
+    return user_id
+
+
+def history_statements(user_id, cursor):
+    """The statements and parameters history_page runs for one page"""
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        Endcard.history_page(user_id, cursor=cursor)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+    return executed
+
+
+def deep_cursor(user_id, pages=100):
+    """Cursor for a page this far into the user's history"""
+    _, cursor = Endcard.history_page(user_id)
+    for _ in range(pages - 1):
+        _, cursor = Endcard.history_page(user_id, cursor=cursor)
+    return cursor
+
+
+def test_history_pages_use_the_index_without_sorting(long_history):
+    for cursor in (None, deep_cursor(long_history)):
+        (statement, parameters), = history_statements(long_history, cursor)
+        plan = ' '.join(row[-1] for row in db.session.connection().exec_driver_sql(
+            f'EXPLAIN QUERY PLAN {statement}', parameters))
+
+        assert 'USING INDEX ix_endcard_user_id_created_at_id' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+def test_deep_page_costs_the_same_as_the_first(long_history, client_for, count_queries):
+    client = client_for(long_history)
+    # The test's session keeps the user loaded between requests, so load it before measuring either page
+    client.get('/history')
+    with count_queries() as first_page:
+        response = client.get('/history')
+    assert response.status_code == 200
+
+    cursor = deep_cursor(long_history)
+    with count_queries() as deep_page:
+        response = client.get(f'/history?cursor={cursor}')
+
+    assert response.status_code == 200
+    assert b'data-next-cursor' in response.data
+    assert len(deep_page) == len(first_page)
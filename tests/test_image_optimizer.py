@@ -0,0 +1,64 @@
+import random
+import time
+from io import BytesIO
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from image_optimizer import RESOLUTION_LIMITS, optimize_image_bytes
+
+BYTE_BUDGET = 1024 * 1024
+
+# Ceiling on the time to re-encode one 12 megapixel upload. A laptop takes
+# about half a second for a JPEG and two for a PNG, so only a much slower
+# encode path trips it
+MAX_ENCODE_SECONDS = 10
+
+
+def photo(width, height):
+    """A noisy gradient that compresses about as badly as a photo"""
+    rng = random.Random(width * height)
+    image = Image.linear_gradient('L').resize((width, height)).convert('RGB')
+    noise = Image.frombytes('RGB', (width, height), rng.randbytes(width * height * 3))
+    return Image.blend(image, noise, 0.25)
+
+
+def upload(image, mime_type):
+    buffer = BytesIO()
+    if mime_type == 'image/jpeg':
+        image.save(buffer, 'JPEG', quality=98)
+    else:
+        image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('mime_type', ['image/jpeg', 'image/png'])
+def test_large_upload_is_downsized_into_the_budget(mime_type):
+    data = upload(photo(3000, 2000), mime_type)
+
+    optimized = optimize_image_bytes(data, mime_type, BYTE_BUDGET, RESOLUTION_LIMITS['1080p'])
+
+    assert (optimized.width, optimized.height) == (1920, 1280)
+    assert len(optimized.data) < len(data)
+    assert Image.open(BytesIO(optimized.data)).size == (1920, 1280)
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('mime_type', ['image/jpeg', 'image/png'])
+def test_optimization_benchmark(mime_type, record_property):
+    data = upload(photo(4000, 3000), mime_type)
+
+    started = time.perf_counter()
+    optimized = optimize_image_bytes(data, mime_type, BYTE_BUDGET, RESOLUTION_LIMITS['1080p'])
+    elapsed = time.perf_counter() - started
+
+    record_property('upload_bytes', len(data))
+    record_property('optimized_bytes', len(optimized.data))
+    record_property('bytes_saved', len(data) - len(optimized.data))
+    record_property('encode_ms', round(elapsed * 1000))
+    assert len(optimized.data) < len(data)
+    if mime_type == 'image/jpeg':
+        # A palette is the last PNG fallback, so a noisy PNG may stay over budget
+        assert len(optimized.data) <= BYTE_BUDGET
+    assert elapsed < MAX_ENCODE_SECONDS
@@ -0,0 +1,114 @@
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+import job_queue
+from app import db
+from job_queue import job_handler, requeue_stale_jobs
+from models import Job
+
+OTHER_WORKER = 'elsewhere:1:job-worker-0'
+
+# Lets a test hold the handler mid-job until it releases it
+release_job = threading.Event()
+
+
+@job_handler('test_wait')
+def wait_for_release(payload):
+    release_job.wait(10)
+    return {'waited': True}
+
+
+@job_handler('test_taken_over')
+def lose_the_job(payload):
+    # Another worker takes the job over mid-run, as after a lost lease
+    db.session.execute(db.update(Job).where(Job.kind == 'test_taken_over', Job.status == 'running')
+                       .values(worker=OTHER_WORKER))
+    db.session.commit()
+    return {}
+
+
+@pytest.fixture
+def queue(app, empty_queue, make_user, monkeypatch):
+    """An otherwise empty queue with short leases, returning the user owning its jobs"""
+    monkeypatch.setitem(app.config, 'JOB_LEASE', 0.5)
+    monkeypatch.setitem(app.config, 'JOB_HEARTBEAT_INTERVAL', 0.1)
+    release_job.clear()
+    yield make_user()
+    release_job.set()
+
+
+def running_job(user_id, lease_left, attempts=1):
+    job = Job(id=uuid.uuid4().hex, user_id=user_id, kind='test_wait', status='running',
+              attempts=attempts, worker=OTHER_WORKER, started_at=datetime.utcnow() - timedelta(hours=1),
+              lease_expires_at=datetime.utcnow() + timedelta(seconds=lease_left))
+    db.session.add(job)
+    db.session.commit()
+    return job.id
+
+
+def job_state(job_id):
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    return job.status, job.worker
+
+
+def test_slow_job_with_a_live_lease_is_left_alone(queue):
+    job_id = running_job(queue, lease_left=30)
+
+    requeue_stale_jobs()
+
+    assert job_state(job_id) == ('running', OTHER_WORKER)
+
+
+def test_job_with_an_expired_lease_is_requeued(queue):
+    job_id = running_job(queue, lease_left=-1)
+
+    requeue_stale_jobs()
+
+    assert job_state(job_id) == ('queued', None)
+
+
+def test_job_out_of_attempts_is_failed(queue, app):
+    job_id = running_job(queue, lease_left=-1, attempts=app.config['JOB_MAX_ATTEMPTS'])
+
+    requeue_stale_jobs()
+
+    assert job_state(job_id) == ('failed', None)
+
+
+def test_heartbeat_keeps_a_slow_job_claimed(queue, app):
+    job_id = job_queue.enqueue('test_wait', queue, {})
+    assert job_queue._claim_next_job() == job_id
+
+    def run():
+        with app.app_context():
+            job_queue._run_job(job_id)
+
+    runner = threading.Thread(target=run)
+    runner.start()
+
+    # Well past the lease the job started with, another process sweeps for dead workers
+    time.sleep(1.5)
+    requeue_stale_jobs()
+    assert job_state(job_id) == ('running', job_queue._worker_id())
+
+    release_job.set()
+    runner.join(5)
+    db.session.expire_all()
+    job = db.session.get(Job, job_id)
+    assert job.status == 'done'
+    assert job.result == {'waited': True}
+    assert job.attempts == 1
+
+
+def test_reclaimed_job_keeps_its_new_owner(queue):
+    job_id = job_queue.enqueue('test_taken_over', queue, {})
+    job_queue._claim_next_job()
+
+    job_queue._run_job(job_id)
+
+    assert job_state(job_id) == ('running', OTHER_WORKER)
@@ -0,0 +1,138 @@
+import base64
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import db
+from blob_store import get_blob_store
+from models import Endcard
+
+MEDIA = bytes(range(256)) * 4
+
+
+@pytest.fixture
+def endcard(make_user):
+    """An endcard whose portrait is in the blob store and whose landscape is a legacy data URL"""
+    user_id = make_user()
+    blob_key, size = get_blob_store().put_bytes(MEDIA)
+    endcard = Endcard(
+        user_id=user_id,
+        portrait_created=True,
+        portrait_blob_key=blob_key,
+        portrait_mime_type='video/mp4',
+        portrait_file_size=size,
+        landscape_created=True,
+        landscape_data_url='data:image/png;base64,' + base64.b64encode(MEDIA).decode('ascii'),
+        updated_at=datetime(2024, 1, 2, 3, 4, 5),
+    )
+    db.session.add(endcard)
+    db.session.commit()
+    return endcard
+
+
+@pytest.fixture
+def client(endcard, client_for):
+    return client_for(endcard.user_id)
+
+
+def media_path(endcard, orientation='portrait'):
+    return f'/media/{endcard.id}/{orientation}'
+
+
+def test_full_response_advertises_ranges(endcard, client):
+    response = client.get(media_path(endcard))
+
+    assert response.status_code == 200
+    assert response.data == MEDIA
+    assert response.headers['Accept-Ranges'] == 'bytes'
+    assert response.headers['Content-Type'] == 'video/mp4'
+    assert response.headers['Content-Length'] == str(len(MEDIA))
+    assert response.headers['ETag'] == f'"{endcard.portrait_blob_key}"'
+
+
+@pytest.mark.parametrize('range_header, start, end', [
+    ('bytes=0-9', 0, 9),
+    ('bytes=100-199', 100, 199),
+    ('bytes=1000-', 1000, len(MEDIA) - 1),
+    ('bytes=-24', len(MEDIA) - 24, len(MEDIA) - 1),
+])
+def test_range_returns_partial_content(endcard, client, range_header, start, end):
+    response = client.get(media_path(endcard), headers={'Range': range_header})
+
+    assert response.status_code == 206
+    assert response.data == MEDIA[start:end + 1]
+    assert response.headers['Content-Range'] == f'bytes {start}-{end}/{len(MEDIA)}'
+    assert response.headers['Content-Length'] == str(end - start + 1)
+
+
+def test_unsatisfiable_range(endcard, client):
+    response = client.get(media_path(endcard), headers={'Range': f'bytes={len(MEDIA)}-'})
+
+    assert response.status_code == 416
+    assert response.headers['Content-Range'] == f'bytes */{len(MEDIA)}'
+
+
+def test_range_on_legacy_data_url(endcard, client):
+    response = client.get(media_path(endcard, 'landscape'), headers={'Range': 'bytes=0-9'})
+
+    assert response.status_code == 206
+    assert response.data == MEDIA[:10]
+    assert response.headers['Content-Type'] == 'image/png'
+
+
+def test_if_none_match_returns_not_modified(endcard, client):
+    etag = client.get(media_path(endcard)).headers['ETag']
+
+    response = client.get(media_path(endcard), headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_if_none_match_mismatch_returns_content(endcard, client):
+    response = client.get(media_path(endcard), headers={'If-None-Match': '"something-else"'})
+
+    assert response.status_code == 200
+    assert response.data == MEDIA
+
+
+def test_if_modified_since_returns_not_modified(endcard, client):
+    since = endcard.updated_at + timedelta(hours=1)
+
+    response = client.get(media_path(endcard), headers={
+        'If-Modified-Since': since.strftime('%a, %d %b %Y %H:%M:%S GMT')
+    })
+
+    assert response.status_code == 304
+
+
+def test_if_range_with_stale_etag_returns_everything(endcard, client):
+    response = client.get(media_path(endcard), headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+
+    assert response.status_code == 200
+    assert response.data == MEDIA
+
+
+def test_versioned_url_is_cached_for_good(endcard, client):
+    response = client.get(media_path(endcard), query_string={'v': endcard.portrait_blob_key[:16]})
+
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.cache_control.immutable
+    assert response.cache_control.private
+
+
+def test_unversioned_url_is_revalidated(endcard, client):
+    response = client.get(media_path(endcard))
+
+    assert response.cache_control.no_cache
+    assert not response.cache_control.max_age
+
+
+def test_other_users_cannot_fetch_media(endcard, make_user, client_for):
+    response = client_for(make_user()).get(media_path(endcard))
+
+    assert response.status_code == 404
+
+
+def test_unknown_orientation(endcard, client):
+    assert client.get(media_path(endcard, 'square')).status_code == 404
@@ -0,0 +1,79 @@
+import io
+import struct
+import time
+import tracemalloc
+
+import pytest
+
+from media_probe import MediaInfo, probe
+
+# Floor for the sniffing benchmark. A laptop probes tens of thousands of these
+# headers a second, so only a regression to decoding whole files trips it
+MIN_FILES_PER_SECOND = 2000
+
+
+def box(box_type, body=b''):
+    return struct.pack('>I4s', 8 + len(body), box_type) + body
+
+
+def make_jpeg(width, height):
+    # SOI, an APP0 segment to seek over, then a baseline start-of-frame
+    app0 = b'\xff\xe0' + struct.pack('>H', 16) + b'JFIF\0' + b'\0' * 9
+    sof0 = b'\xff\xc0' + struct.pack('>HBHHB', 17, 8, height, width, 3) + b'\0' * 9
+    return b'\xff\xd8' + app0 + sof0 + b'\xff\xda'
+
+
+def make_moov(width, height, duration, timescale=1000):
+    mvhd = box(b'mvhd', b'\0' * 12 + struct.pack('>II', timescale, duration * timescale) + b'\0' * 80)
+    tkhd = box(b'tkhd', b'\0' * 76 + struct.pack('>II', width << 16, height << 16))
+    hdlr = box(b'hdlr', b'\0' * 8 + b'vide' + b'\0' * 12)
+    stsd = box(b'stsd', b'\0' * 8 + struct.pack('>I', 86) + b'avc1' + b'\0' * 78)
+    stbl = box(b'stbl', stsd)
+    trak = box(b'trak', tkhd + box(b'mdia', hdlr + box(b'minf', stbl)))
+    return box(b'moov', mvhd + trak)
+
+
+def make_mp4(width, height, duration):
+    return box(b'ftyp', b'isom\0\0\0\0isomavc1') + make_moov(width, height, duration)
+
+
+def test_headers_are_sniffed(make_png):
+    assert probe(io.BytesIO(make_png(720, 1280))) == MediaInfo('image/png', 'image', 720, 1280, None, None)
+    assert probe(io.BytesIO(make_jpeg(1280, 720))) == MediaInfo('image/jpeg', 'image', 1280, 720, None, None)
+    assert probe(io.BytesIO(make_mp4(1080, 1920, 15))) == MediaInfo('video/mp4', 'video', 1080, 1920, 15.0, 'avc1')
+
+
+def test_large_mp4_is_probed_in_constant_memory(tmp_path):
+    # 256 MB of sparse media data ahead of a moov box at the end of the file
+    path = tmp_path / 'moov_at_end.mp4'
+    media_size = 256 * 1024 * 1024
+    with open(path, 'wb') as f:
+        f.write(box(b'ftyp', b'isom\0\0\0\0isomavc1'))
+        f.write(struct.pack('>I4s', 8 + media_size, b'mdat'))
+        f.seek(media_size, 1)
+        f.write(make_moov(1920, 1080, 30))
+
+    tracemalloc.start()
+    try:
+        with open(path, 'rb') as f:
+            info = probe(f)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert (info.width, info.height, info.duration) == (1920, 1080, 30.0)
+    assert peak < 64 * 1024
+
+
+@pytest.mark.slow
+def test_sniffing_throughput(make_png, record_property):
+    samples = [make_png(720, 1280), make_jpeg(1280, 720), make_mp4(1080, 1920, 15)]
+    streams = [io.BytesIO(sample) for sample in samples] * 2000
+
+    started = time.perf_counter()
+    for stream in streams:
+        probe(stream)
+    files_per_second = len(streams) / (time.perf_counter() - started)
+
+    record_property('files_per_second', round(files_per_second))
+    assert files_per_second > MIN_FILES_PER_SECOND
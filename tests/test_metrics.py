@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+import metrics
+from metrics import Histogram, LATENCY_BUCKETS
+
+TOKEN = 'metrics-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+# Ceilings for the overhead benchmark. A laptop records an observation in
+# under a microsecond and renders a scrape in a few milliseconds, so only a
+# much costlier hot path trips them
+MAX_OBSERVATION_MICROSECONDS = 20
+MAX_SCRAPE_MILLISECONDS = 100
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', TOKEN)
+
+
+@pytest.fixture
+def scratch_registry(monkeypatch):
+    """Keep histograms a test creates out of the real /metrics output"""
+    monkeypatch.setattr(metrics, '_registry', list(metrics._registry))
+
+
+def test_hidden_without_a_configured_token(app, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+
+    assert app.test_client().get('/metrics', headers=AUTH).status_code == 404
+
+
+def test_requires_the_token(app, token):
+    client = app.test_client()
+
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+
+def test_requests_are_recorded(app, token):
+    client = app.test_client()
+    client.get('/metrics', headers=AUTH)
+
+    body = client.get('/metrics', headers=AUTH).get_data(as_text=True)
+
+    assert 'http_request_duration_seconds_count{endpoint="metrics",method="GET",status="200"}' in body
+    assert 'http_response_size_bytes_bucket{endpoint="metrics",le="+Inf"}' in body
+
+
+def test_histogram_buckets_are_cumulative(scratch_registry):
+    histogram = Histogram('test_seconds', 'Test histogram', (0.1, 1.0), ('kind',))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        histogram.observe(('a',), value)
+
+    lines = histogram.render()
+
+    assert 'test_seconds_bucket{kind="a",le="0.1"} 1' in lines
+    assert 'test_seconds_bucket{kind="a",le="1.0"} 3' in lines
+    assert 'test_seconds_bucket{kind="a",le="+Inf"} 4' in lines
+    assert 'test_seconds_sum{kind="a"} 6.05' in lines
+    assert 'test_seconds_count{kind="a"} 4' in lines
+
+
+@pytest.mark.slow
+def test_metrics_overhead(app, token, scratch_registry, record_property):
+    histogram = Histogram('benchmark_seconds', 'Benchmark histogram', LATENCY_BUCKETS,
+                          ('endpoint', 'method', 'status'))
+    # A series for every endpoint, each with a few methods and statuses, as a busy worker would have
+    series = [(rule.endpoint, method, status) for rule in app.url_map.iter_rules()
+              for method in ('GET', 'POST') for status in (200, 302, 404)]
+    observations = 200000
+
+    started = time.perf_counter()
+    for i in range(observations):
+        histogram.observe(series[i % len(series)], (i % 1000) / 100)
+    observation_us = (time.perf_counter() - started) / observations * 1e6
+
+    client = app.test_client()
+    client.get('/metrics', headers=AUTH)
+    started = time.perf_counter()
+    response = client.get('/metrics', headers=AUTH)
+    scrape_ms = (time.perf_counter() - started) * 1000
+
+    record_property('observation_us', round(observation_us, 2))
+    record_property('series', len(series))
+    record_property('scrape_ms', round(scrape_ms, 2))
+    record_property('scrape_bytes', len(response.data))
+    assert response.status_code == 200
+    assert observation_us < MAX_OBSERVATION_MICROSECONDS
+    assert scrape_ms < MAX_SCRAPE_MILLISECONDS
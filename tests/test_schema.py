@@ -0,0 +1,53 @@
+import logging
+
+from sqlalchemy import inspect
+
+import schema
+from app import db
+
+
+class StaleInspector:
+    """Inspector answering as if the schema was read before another process upgraded it"""
+
+    def __init__(self, inspector, missing_columns=(), missing_indexes=()):
+        self._inspector = inspector
+        self.missing_columns = set(missing_columns)
+        self.missing_indexes = set(missing_indexes)
+
+    def get_table_names(self):
+        return self._inspector.get_table_names()
+
+    def get_columns(self, table_name):
+        return [c for c in self._inspector.get_columns(table_name)
+                if (table_name, c['name']) not in self.missing_columns]
+
+    def get_indexes(self, table_name):
+        return [i for i in self._inspector.get_indexes(table_name) if i['name'] not in self.missing_indexes]
+
+
+def upgrade_after_race(monkeypatch, **missing):
+    """Run upgrade_schema as the process that read the schema just before another upgraded it"""
+    inspectors = iter([StaleInspector(inspect(db.engine), **missing)])
+    monkeypatch.setattr(schema, 'inspect', lambda engine: next(inspectors, None) or inspect(engine))
+    schema.upgrade_schema(db)
+
+
+def test_upgrade_is_a_no_op_on_a_current_schema(app, caplog):
+    with caplog.at_level(logging.INFO, logger='schema'):
+        schema.upgrade_schema(db)
+
+    assert not caplog.records
+
+
+def test_column_added_by_another_process_is_skipped(app, monkeypatch):
+    upgrade_after_race(monkeypatch, missing_columns=[('job', 'worker'), ('endcard', 'portrait_blob_key')])
+
+    columns = {c['name'] for c in inspect(db.engine).get_columns('job')}
+    assert 'worker' in columns
+
+
+def test_index_created_by_another_process_is_skipped(app, monkeypatch):
+    upgrade_after_race(monkeypatch, missing_indexes=['ix_endcard_user_id_created_at_id', 'ix_job_status_created_at'])
+
+    indexes = {i['name'] for i in inspect(db.engine).get_indexes('endcard')}
+    assert 'ix_endcard_user_id_created_at_id' in indexes
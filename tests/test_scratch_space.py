@@ -0,0 +1,154 @@
+import os
+import random
+import time
+
+import pytest
+
+from app import db
+from models import Job
+from scratch_space import ScratchSpace, ScratchQuotaExceeded, active_job_dirs
+
+QUOTA = 64 * 1024
+MAX_UPLOAD = 8 * 1024
+
+
+def disk_usage(root):
+    return sum(os.path.getsize(os.path.join(dirpath, name))
+               for dirpath, _, names in os.walk(root) for name in names)
+
+
+def spool(scratch, size, age=0):
+    """Create a scratch directory holding one file of `size` bytes, `age` seconds old"""
+    path = scratch.create_dir()
+    with open(os.path.join(path, 'upload.bin'), 'wb') as upload:
+        upload.write(os.urandom(size))
+    scratch.add_usage(size)
+    if age:
+        then = time.time() - age
+        os.utime(path, (then, then))
+    return path
+
+
+@pytest.fixture
+def protected():
+    return set()
+
+
+@pytest.fixture
+def scratch(tmp_path, protected):
+    return ScratchSpace(str(tmp_path), QUOTA, max_age=3600, grace_period=60,
+                        protected_paths=lambda: protected)
+
+
+def test_heavy_churn_keeps_disk_usage_bounded(scratch, tmp_path, protected):
+    rng = random.Random(16)
+    handed_off = []
+    rejected = 0
+
+    for i in range(2000):
+        size = rng.randint(1, MAX_UPLOAD)
+        try:
+            scratch.check_quota(size)
+        except ScratchQuotaExceeded:
+            rejected += 1
+            scratch.sweep()
+            continue
+
+        path = spool(scratch, size, age=rng.choice((0, 120, 7200)))
+        outcome = rng.random()
+        if outcome < 0.7:
+            # The request ended normally
+            scratch.release(path)
+        elif outcome < 0.9:
+            # Handed to a job that is still waiting to run
+            protected.add(path)
+            handed_off.append(path)
+        # Otherwise abandoned, for the sweeper to find
+
+        if len(handed_off) > 4:
+            # The oldest job ran and released its inputs
+            done = handed_off.pop(0)
+            protected.discard(done)
+            scratch.release(done)
+
+        assert disk_usage(tmp_path) <= QUOTA + MAX_UPLOAD
+        assert scratch.bytes_in_use() == disk_usage(tmp_path)
+
+        if i % 50 == 0:
+            scratch.sweep()
+
+    assert rejected
+    assert all(os.path.exists(path) for path in handed_off)
+
+
+def test_running_total_avoids_walking_the_folder(scratch, monkeypatch):
+    spool(scratch, 1000)
+
+    def no_walk():
+        raise AssertionError('walked the folder')
+
+    monkeypatch.setattr(scratch, '_entries', no_walk)
+    path = spool(scratch, 2000)
+    scratch.check_quota(100)
+    scratch.release(path)
+
+    assert scratch.bytes_in_use() == 1000
+
+
+def test_sweep_picks_up_other_processes_files(scratch, tmp_path):
+    assert scratch.bytes_in_use() == 0
+    # Written by another worker process, so not in this process's running total
+    (tmp_path / 'elsewhere.bin').write_bytes(b'x' * 500)
+
+    assert scratch.sweep() == 500
+    assert scratch.bytes_in_use() == 500
+
+
+def test_quota_rejects_uploads_that_do_not_fit(scratch):
+    spool(scratch, QUOTA - 100)
+
+    scratch.check_quota(100)
+    with pytest.raises(ScratchQuotaExceeded):
+        scratch.check_quota(101)
+    assert scratch.stats()['rejections'] == 1
+
+
+def test_expired_entries_are_swept_unless_protected(scratch, protected):
+    expired = spool(scratch, 100, age=7200)
+    queued = spool(scratch, 100, age=7200)
+    recent = spool(scratch, 100)
+    protected.add(queued)
+
+    scratch.sweep()
+
+    assert not os.path.exists(expired)
+    assert os.path.exists(queued)
+    assert os.path.exists(recent)
+
+
+def test_over_quota_sweep_spares_job_inputs_and_recent_uploads(scratch, protected):
+    queued = spool(scratch, QUOTA // 2, age=600)
+    oldest = spool(scratch, QUOTA // 2, age=300)
+    recent = spool(scratch, QUOTA // 2, age=10)
+    protected.add(queued)
+
+    in_use = scratch.sweep()
+
+    assert os.path.exists(queued)
+    assert not os.path.exists(oldest)
+    assert os.path.exists(recent)
+    assert in_use == QUOTA
+
+
+def test_active_job_dirs_are_those_of_pending_jobs(make_user):
+    user_id = make_user()
+    for status in ('queued', 'running', 'done', 'failed'):
+        db.session.add(Job(id=os.urandom(16).hex(), user_id=user_id, kind='convert_upload', status=status,
+                           payload={'scratch_dir': f'/scratch/{status}'}))
+    db.session.add(Job(id=os.urandom(16).hex(), user_id=user_id, kind='convert_upload', payload={}))
+    db.session.commit()
+
+    dirs = active_job_dirs()
+
+    assert {'/scratch/queued', '/scratch/running'} <= dirs
+    assert not {'/scratch/done', '/scratch/failed'} & dirs
@@ -0,0 +1,78 @@
+import logging
+
+import pytest
+
+import metrics
+from app import db
+from models import User
+from sql_profiler import profiler, fingerprint
+
+TOKEN = 'profiler-token'
+AUTH = {'Authorization': f'Bearer {TOKEN}'}
+
+
+@pytest.fixture(autouse=True)
+def restore_profiler():
+    enabled, threshold_ms = profiler.enabled, profiler.threshold_ms
+    yield
+    profiler.configure(enabled=enabled, threshold_ms=threshold_ms)
+    profiler.reset()
+
+
+@pytest.fixture
+def token(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', TOKEN)
+
+
+def test_disabled_without_a_configured_token(app, monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_TOKEN', None)
+    client = app.test_client()
+
+    assert client.get('/api/sql_profile').status_code == 404
+    assert client.post('/api/sql_profile', json={'enabled': True, 'threshold_ms': 0}).status_code == 404
+    assert not profiler.enabled or profiler.threshold_ms != 0
+
+
+def test_requires_the_token(app, token):
+    client = app.test_client()
+
+    assert client.post('/api/sql_profile', json={'enabled': True}).status_code == 401
+    assert client.get('/api/sql_profile', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+
+@pytest.mark.parametrize('options', [
+    {'threshold_ms': 'fast'},
+    {'threshold_ms': -1},
+    {'threshold_ms': True},
+    {'enabled': 'false'},
+    ['enabled'],
+])
+def test_invalid_options_are_rejected(app, token, options):
+    response = app.test_client().post('/api/sql_profile', json=options, headers=AUTH)
+
+    assert response.status_code == 400
+    assert not response.json['success']
+
+
+def test_switched_at_runtime(app, token):
+    client = app.test_client()
+
+    response = client.post('/api/sql_profile', json={'enabled': True, 'threshold_ms': 500}, headers=AUTH)
+
+    assert response.status_code == 200
+    assert response.json['enabled'] is True
+    assert response.json['threshold_ms'] == 500
+
+
+def test_slow_log_shows_the_fingerprint_not_the_values(app, caplog):
+    profiler.configure(enabled=True, threshold_ms=0)
+
+    with caplog.at_level(logging.WARNING, logger='sql_profiler'):
+        db.session.execute(db.select(User).where(User.email == 'secret@example.com')).all()
+        db.session.execute(db.text("SELECT 'another-secret', 42")).all()
+
+    logged = '\n'.join(record.getMessage() for record in caplog.records)
+    assert 'Slow query' in logged
+    assert 'secret' not in logged
+    assert '42' not in logged
+    assert fingerprint("SELECT 'another-secret', 42") in logged
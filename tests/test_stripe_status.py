@@ -0,0 +1,97 @@
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import stripe
+
+import stripe_handler
+from stripe_handler import StripeStatus, get_stripe_status
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# How long the stub takes to answer an account check, as a slow Stripe would
+ACCOUNT_DELAY = 2
+
+# Imports main the way a worker boots, then reports how long that took
+BOOT_SCRIPT = '''
+import sys, time
+import stripe
+stripe.api_base = sys.argv[1]
+started = time.perf_counter()
+import main
+print(time.perf_counter() - started)
+'''
+
+
+class StubStripe:
+    """Local stand-in for the Stripe API that answers account checks slowly"""
+
+    def __init__(self):
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stub.requests.append(self.path)
+                time.sleep(ACCOUNT_DELAY)
+                data = json.dumps({'id': 'acct_stub', 'object': 'account'}).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def slow_stripe(monkeypatch):
+    stub = StubStripe()
+    monkeypatch.setattr(stripe_handler, 'STRIPE_SECRET_KEY', 'sk_test_stub')
+    monkeypatch.setattr(stripe_handler, 'stripe_status', StripeStatus())
+    monkeypatch.setattr(stripe, 'api_base', stub.url)
+    monkeypatch.setattr(stripe, 'api_key', None)
+    monkeypatch.setattr(stripe, 'default_http_client', None)
+    yield stub
+    stub.close()
+
+
+def test_status_check_does_not_wait_for_stripe(slow_stripe):
+    started = time.monotonic()
+    status = get_stripe_status()
+    assert time.monotonic() - started < 0.5
+    assert status['checked'] is False
+
+    deadline = time.monotonic() + ACCOUNT_DELAY + 5
+    while not get_stripe_status()['checked'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert get_stripe_status()['enabled'] is True
+    assert slow_stripe.requests == ['/v1/account']
+
+
+@pytest.mark.slow
+def test_worker_boot_makes_no_stripe_calls(slow_stripe, tmp_path, record_property):
+    env = dict(os.environ, STRIPE_SECRET_KEY='sk_test_stub', PYTHONPATH=REPO_ROOT)
+    # The app creates its log and folders in the working directory
+    result = subprocess.run([sys.executable, '-c', BOOT_SCRIPT, slow_stripe.url], cwd=tmp_path, env=env,
+                            capture_output=True, text=True, timeout=60, check=True)
+    boot_seconds = float(result.stdout.split()[-1])
+
+    record_property('boot_ms', round(boot_seconds * 1000))
+    assert slow_stripe.requests == []
+    assert boot_seconds < ACCOUNT_DELAY
@@ -0,0 +1,153 @@
+import hashlib
+import os
+import threading
+import tracemalloc
+
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.test import EnvironBuilder
+
+from conversion import MAX_FILE_SIZE
+from upload_stream import HashingSpool, UploadRequest
+from utils import format_size
+
+
+@pytest.fixture
+def threshold(app, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    monkeypatch.setitem(app.config, 'UPLOAD_SPOOL_THRESHOLD', 1024)
+    return 1024
+
+
+def test_small_parts_stay_in_memory(threshold):
+    spool = HashingSpool('a.png')
+    spool.write(b'x' * threshold)
+
+    assert not spool.spooled_to_disk
+    assert spool.size == threshold
+
+
+def test_large_parts_roll_over_intact(threshold):
+    data = os.urandom(threshold * 3)
+    spool = HashingSpool('a.png')
+    for start in range(0, len(data), 700):
+        spool.write(data[start:start + 700])
+
+    assert spool.spooled_to_disk
+    assert spool.size == len(data)
+    assert spool.sha256 == hashlib.sha256(data).hexdigest()
+    spool.seek(0)
+    assert spool.read() == data
+
+
+def test_oversized_part_is_rejected_with_the_limit(threshold):
+    spool = HashingSpool('a.png', max_size=MAX_FILE_SIZE)
+    spool.write(b'x' * int(MAX_FILE_SIZE))
+
+    with pytest.raises(RequestEntityTooLarge, match='Maximum size: 4.5MB'):
+        spool.write(b'x')
+
+
+@pytest.mark.parametrize('size, expected', [
+    (512, '512B'),
+    (1536, '1.5KB'),
+    (4.5 * 1024 * 1024, '4.5MB'),
+    (10 * 1024 * 1024, '10MB'),
+    (3 * 1024 ** 3, '3GB'),
+])
+def test_format_size(size, expected):
+    assert format_size(size) == expected
+
+
+class GeneratedUpload:
+    """Multipart body with portrait and landscape file parts, generated as it is read.
+
+    Nothing is held in memory up front, so the measurement only sees what
+    the parser keeps. Reading stops at `pause` once, partway into the first
+    part, until every other upload has got there too.
+    """
+
+    BOUNDARY = 'generated-upload'
+
+    def __init__(self, part_size, pause=None):
+        self.segments = []
+        for field in ('portrait_file', 'landscape_file'):
+            self.segments.append((f'--{self.BOUNDARY}\r\nContent-Disposition: form-data; name="{field}"; '
+                                  f'filename="{field}.png"\r\nContent-Type: image/png\r\n\r\n').encode())
+            self.segments.append(part_size)
+            self.segments.append(b'\r\n')
+        self.segments.append(f'--{self.BOUNDARY}--\r\n'.encode())
+        self.length = sum(s if isinstance(s, int) else len(s) for s in self.segments)
+        self.pause = pause
+        self.position = 0
+
+    @property
+    def content_type(self):
+        return f'multipart/form-data; boundary={self.BOUNDARY}'
+
+    def read(self, size=-1):
+        if self.pause and self.position > self.length // 4:
+            pause, self.pause = self.pause, None
+            pause.wait()
+        while self.segments:
+            segment = self.segments[0]
+            if isinstance(segment, int):
+                count = min(segment, size if size > 0 else segment, 64 * 1024)
+                if segment > count:
+                    self.segments[0] -= count
+                else:
+                    self.segments.pop(0)
+                self.position += count
+                return b'\xab' * count
+            if size > 0 and len(segment) > size:
+                self.segments[0] = segment[size:]
+                segment = segment[:size]
+            else:
+                self.segments.pop(0)
+            self.position += len(segment)
+            return segment
+        return b''
+
+
+@pytest.mark.slow
+def test_concurrent_upload_memory(app, tmp_path, monkeypatch, record_property):
+    uploads = 50
+    part_size = 2 * 1024 * 1024
+    monkeypatch.setitem(app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    pause = threading.Barrier(uploads)
+    errors = []
+
+    def upload():
+        body = GeneratedUpload(part_size, pause)
+        # Handed over directly, as EnvironBuilder would seek the stream to measure it
+        environ = EnvironBuilder(method='POST').get_environ()
+        environ.update({'wsgi.input': body, 'CONTENT_TYPE': body.content_type, 'CONTENT_LENGTH': str(body.length)})
+        request = UploadRequest(environ)
+        request.max_file_size = MAX_FILE_SIZE
+        try:
+            with app.app_context():
+                files = request.files
+            assert [files[field].stream.size for field in files] == [part_size, part_size]
+            assert all(files[field].stream.spooled_to_disk for field in files)
+            for field in files:
+                files[field].close()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=upload) for _ in range(uploads)]
+    tracemalloc.start()
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    record_property('peak_bytes', peak)
+    record_property('peak_bytes_per_upload', peak // uploads)
+    assert not errors
+    # Each upload keeps at most the spool threshold plus parser buffers in
+    # memory, where holding its parts would take 2 * part_size
+    assert peak < uploads * app.config['UPLOAD_SPOOL_THRESHOLD'] * 2
@@ -0,0 +1,109 @@
+import hashlib
+import hmac
+import json
+import random
+import statistics
+import time
+
+import pytest
+
+import stripe_handler
+from app import db
+from models import CreditLedger, UserCredit, WebhookEvent
+from webhook_inbox import process_pending_events
+
+SECRET = 'whsec_test'
+UNIQUE_EVENTS = 700
+DUPLICATES = 300
+
+
+@pytest.fixture(autouse=True)
+def webhook_secret(monkeypatch):
+    monkeypatch.setattr(stripe_handler, 'STRIPE_WEBHOOK_SECRET', SECRET)
+
+
+def payment_event(event_id, user_id, credits=1):
+    return {
+        'id': event_id,
+        'type': 'payment_intent.succeeded',
+        'data': {'object': {'id': f'pi_{event_id}', 'metadata': {'user_id': str(user_id), 'credits': str(credits)}}},
+    }
+
+
+def deliver(client, event):
+    """POST an event the way Stripe does, signed with the webhook secret"""
+    payload = json.dumps(event)
+    timestamp = int(time.time())
+    signature = hmac.new(SECRET.encode(), f'{timestamp}.{payload}'.encode(), hashlib.sha256).hexdigest()
+    return client.post('/webhook', data=payload, content_type='application/json',
+                       headers={'Stripe-Signature': f't={timestamp},v1={signature}'})
+
+
+def drain():
+    while process_pending_events():
+        pass
+
+
+def test_replay_with_duplicates_grants_each_payment_once(app, make_user):
+    user_id = make_user(credits=0)
+    events = [payment_event(f'evt_replay_{i}', user_id) for i in range(UNIQUE_EVENTS)]
+    rng = random.Random(22)
+    deliveries = events + [rng.choice(events) for _ in range(DUPLICATES)]
+    rng.shuffle(deliveries)
+
+    client = app.test_client()
+    latencies = []
+    for event in deliveries:
+        started = time.perf_counter()
+        response = deliver(client, event)
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200
+
+    drain()
+
+    db.session.expire_all()
+    assert UserCredit.query.filter_by(user_id=user_id).one().credits == UNIQUE_EVENTS
+    assert CreditLedger.query.filter_by(user_id=user_id, reason='payment_intent').count() == UNIQUE_EVENTS
+    statuses = db.session.scalars(
+        db.select(WebhookEvent.status).where(WebhookEvent.id.like('evt_replay_%'))
+    ).all()
+    assert statuses == ['processed'] * UNIQUE_EVENTS
+    # Acknowledging is one insert, so it stays fast however slow processing is
+    assert statistics.median(latencies) < 0.05
+
+
+def test_redelivery_after_processing_is_ignored(app, make_user):
+    user_id = make_user(credits=0)
+    event = payment_event('evt_redelivered', user_id, credits=5)
+    client = app.test_client()
+
+    assert deliver(client, event).status_code == 200
+    drain()
+    assert deliver(client, event).status_code == 200
+    drain()
+
+    db.session.expire_all()
+    assert UserCredit.query.filter_by(user_id=user_id).one().credits == 5
+
+
+def test_events_left_pending_are_applied_by_the_next_pass(app, make_user):
+    # As if the process restarted between storing these and applying them
+    user_id = make_user(credits=0)
+    for i in range(3):
+        db.session.add(WebhookEvent(id=f'evt_stranded_{i}', type='payment_intent.succeeded',
+                                    payload=payment_event(f'evt_stranded_{i}', user_id, credits=2)))
+    db.session.commit()
+
+    drain()
+
+    db.session.expire_all()
+    assert UserCredit.query.filter_by(user_id=user_id).one().credits == 6
+
+
+def test_bad_signature_is_rejected(app, make_user):
+    event = payment_event('evt_forged', make_user(credits=0))
+    response = app.test_client().post('/webhook', data=json.dumps(event), content_type='application/json',
+                                      headers={'Stripe-Signature': 't=1,v1=forged'})
+
+    assert response.status_code == 400
+    assert db.session.get(WebhookEvent, 'evt_forged') is None
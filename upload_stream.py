@@ -0,0 +1,84 @@
+import hashlib
+import tempfile
+from io import BytesIO
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge
+from app import app
+from utils import format_size
+
+
+def _too_large(filename, max_size):
+    return RequestEntityTooLarge(f'{filename} is too large. Maximum size: {format_size(max_size)}')
+
+
+class HashingSpool:
+    """Destination for one uploaded file part while the form is parsed.
+
+    Parts stay in memory up to UPLOAD_SPOOL_THRESHOLD and roll over to an
+    anonymous temp file in the upload folder past it. The part is hashed and
+    measured as it arrives, and rejected as soon as it outgrows max_size
+    instead of after the whole body has been received.
+    """
+
+    def __init__(self, filename, max_size=None):
+        self.filename = filename
+        self.max_size = max_size
+        self.size = 0
+        self.spooled_to_disk = False
+        self._threshold = app.config['UPLOAD_SPOOL_THRESHOLD']
+        self._digest = hashlib.sha256()
+        self._file = BytesIO()
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise _too_large(self.filename, self.max_size)
+        self._digest.update(data)
+        if not self.spooled_to_disk and self._file.tell() + len(data) > self._threshold:
+            self._roll_over()
+        return self._file.write(data)
+
+    def _roll_over(self):
+        """Move what has been received so far from memory to a temp file"""
+        disk_file = tempfile.TemporaryFile(dir=app.config['UPLOAD_FOLDER'])
+        disk_file.write(self._file.getbuffer())
+        disk_file.seek(self._file.tell())
+        self._file.close()
+        self._file = disk_file
+        self.spooled_to_disk = True
+
+    @property
+    def sha256(self):
+        """Hex SHA-256 of everything written so far"""
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        # read, seek, tell, close and friends go straight to the spool
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+class UploadRequest(Request):
+    """Request that parses file parts into HashingSpool objects.
+
+    Views that take uploads set max_file_size before touching request.files
+    to cap the size of each file part.
+    """
+
+    max_file_size = None
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if self.max_file_size is not None and content_length is not None and content_length > self.max_file_size:
+            raise _too_large(filename, self.max_file_size)
+        return HashingSpool(filename, self.max_file_size)
+
+
+app.request_class = UploadRequest
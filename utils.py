@@ -2,15 +2,26 @@ import os
 import base64
 import mimetypes
 from werkzeug.utils import secure_filename
-from app import app
+from scratch_space import get_scratch_space, request_scratch_dir
 
 def save_file_temporarily(file, filename):
-    """Save uploaded file to temporary location and return the path"""
+    """Save uploaded file to the request's scratch directory and return the path"""
     filename = secure_filename(filename)
-    filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+    filepath = os.path.join(request_scratch_dir(), filename)
     file.save(filepath)
+    get_scratch_space().add_usage(os.path.getsize(filepath))
     return filepath
 
+def format_size(size):
+    """Format a byte count for messages, e.g. 4.5MB"""
+    for unit in ('B', 'KB', 'MB'):
+        if size < 1024:
+            break
+        size /= 1024
+    else:
+        unit = 'GB'
+    return f"{size:.1f}".rstrip('0').rstrip('.') + unit
+
 def get_file_extension(filename):
     """Get file extension from filename"""
     return filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
@@ -26,17 +37,55 @@ def is_video_file(filename):
     return ext in {'mp4', 'webm'}
 
 def file_to_data_url(file_path):
-    """Convert file to data URL format"""
+    """Convert file to data URL format.
+
+    The file is encoded chunk by chunk into a buffer sized up front, so the
+    raw bytes are never held whole and the encoding is copied only once,
+    into the returned string.
+    """
     mime_type, _ = mimetypes.guess_type(file_path)
     if not mime_type:
         mime_type = 'application/octet-stream'
-    
+
+    prefix_length = len(f"data:{mime_type};base64,")
+    buffer = bytearray(prefix_length + base64_length(os.path.getsize(file_path)))
+    view = memoryview(buffer)
+    offset = 0
     with open(file_path, 'rb') as file:
-        encoded = base64.b64encode(file.read()).decode('utf-8')
-        
-    return f"data:{mime_type};base64,{encoded}"
+        for chunk in iter_data_url_chunks(file, mime_type):
+            view[offset:offset + len(chunk)] = chunk
+            offset += len(chunk)
+    view.release()
+    return buffer.decode('ascii')
+
+# Raw bytes encoded per chunk when streaming base64; a multiple of 3 so
+# chunks can be concatenated without padding in between
+BASE64_CHUNK_SIZE = 48 * 1024
+
+def iter_base64_chunks(stream, chunk_size=BASE64_CHUNK_SIZE):
+    """Base64-encode a binary stream, yielding encoded bytes chunk by chunk"""
+    remainder = b''
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        chunk = remainder + chunk
+        aligned = len(chunk) - len(chunk) % 3
+        remainder = chunk[aligned:]
+        if aligned:
+            yield base64.b64encode(chunk[:aligned])
+    if remainder:
+        yield base64.b64encode(remainder)
+
+def base64_length(size):
+    """Length of the base64 encoding of `size` raw bytes"""
+    return 4 * ((size + 2) // 3)
+
+def iter_data_url_chunks(stream, mime_type):
+    """Yield a data URL for a binary stream as bytes chunks"""
+    yield f"data:{mime_type};base64,".encode('utf-8')
+    yield from iter_base64_chunks(stream)
 
 def cleanup_temporary_files():
-    """Clean up temporary uploaded files"""
-    # This could be expanded to delete old files from the uploads folder
-    pass
\ No newline at end of file
+    """Clean up expired temporary uploaded files, returning the bytes still in use"""
+    return get_scratch_space().sweep()
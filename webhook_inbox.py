@@ -0,0 +1,141 @@
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from app import app, db
+from models import WebhookEvent
+
+logger = logging.getLogger(__name__)
+
+# Handlers for each Stripe event type, registered with @event_handler
+EVENT_HANDLERS = {}
+
+_wakeup = threading.Event()
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def event_handler(event_type):
+    """Register a function as the handler for a Stripe event type.
+
+    Handlers receive the event's data.object as a dict and run inside the
+    transaction that marks the event processed, so they must not commit.
+    Anything they write is applied exactly once.
+    """
+    def decorator(func):
+        EVENT_HANDLERS[event_type] = func
+        return func
+    return decorator
+
+
+def record_event(event):
+    """Store a verified event in the inbox, returning False if it was already there"""
+    db.session.add(WebhookEvent(id=event['id'], type=event['type'], payload=event))
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Stripe retried an event we already have
+        db.session.rollback()
+        return False
+
+    start_processor()
+    _wakeup.set()
+    return True
+
+
+def start_processor():
+    """Start this process's inbox processor thread if it is not running yet.
+
+    Called when the app boots, and the processor's first pass drains
+    whatever was left pending before a restart.
+    """
+    global _processor
+    with _processor_lock:
+        if _processor is not None:
+            return
+        _processor = threading.Thread(target=_processor_loop, name='webhook-processor', daemon=True)
+        _processor.start()
+
+
+def _apply_event(event_id):
+    """Apply one pending event, returning False if another processor got to it first.
+
+    Marking the event processed and running its handler share a transaction,
+    and the mark is conditional on the event still being pending, so the
+    handler's writes are committed exactly once.
+    """
+    claimed = db.session.execute(
+        db.update(WebhookEvent)
+        .where(WebhookEvent.id == event_id, WebhookEvent.status == 'pending')
+        .values(status='processed', processed_at=datetime.utcnow(), attempts=WebhookEvent.attempts + 1)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        db.session.rollback()
+        return False
+
+    event = db.session.get(WebhookEvent, event_id)
+    handler = EVENT_HANDLERS.get(event.type)
+    if handler:
+        handler(event.payload['data']['object'])
+    db.session.commit()
+    return True
+
+
+def _record_failure(event_id, error):
+    event = db.session.get(WebhookEvent, event_id)
+    event.attempts = (event.attempts or 0) + 1
+    event.error = error
+    if event.attempts >= app.config['WEBHOOK_MAX_ATTEMPTS']:
+        event.status = 'failed'
+        logger.error(f"Giving up on webhook event {event_id} after {event.attempts} attempts")
+    db.session.commit()
+
+
+def process_pending_events(batch_size=None):
+    """Apply the oldest pending events in the inbox, returning how many were applied"""
+    event_ids = db.session.scalars(
+        db.select(WebhookEvent.id)
+        .where(WebhookEvent.status == 'pending')
+        .order_by(WebhookEvent.received_at)
+        .limit(batch_size or app.config['WEBHOOK_BATCH_SIZE'])
+    ).all()
+    db.session.commit()
+
+    applied = 0
+    for event_id in event_ids:
+        try:
+            if _apply_event(event_id):
+                applied += 1
+        except Exception as e:
+            logger.error(f"Error applying webhook event {event_id}: {str(e)}", exc_info=True)
+            db.session.rollback()
+            _record_failure(event_id, str(e))
+    return applied
+
+
+def _processor_loop():
+    while True:
+        try:
+            with app.app_context():
+                if process_pending_events() >= app.config['WEBHOOK_BATCH_SIZE']:
+                    # A full batch means there is probably more waiting
+                    continue
+        except Exception as e:
+            logger.error(f"Webhook processor error: {str(e)}")
+
+        # Poll as well as waiting to be woken, to pick up events received by other processes
+        _wakeup.wait(app.config['WEBHOOK_POLL_INTERVAL'])
+        _wakeup.clear()
+
+
+@app.cli.command('process-webhooks')
+def process_webhooks_command():
+    """Apply every pending webhook event in the inbox"""
+    total = 0
+    while True:
+        applied = process_pending_events()
+        total += applied
+        if not applied:
+            break
+    print(f"Applied {total} webhook events")
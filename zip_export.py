@@ -0,0 +1,58 @@
+import zipfile
+from models import Endcard
+from render_cache import render_endcard
+
+# Most files a single export may contain
+EXPORT_MAX_FILES = 500
+
+
+class _StreamBuffer:
+    """Write-only sink that zipfile writes into and the response drains.
+
+    It has no tell() or seek(), so zipfile treats it as an unseekable stream
+    and writes sizes in data descriptors instead of going back to patch
+    headers. Only the bytes written since the last drain are held in memory.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def write(self, data):
+        self._buffer.extend(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            yield data
+
+
+def iter_endcard_zip(user_id, endcard_ids, template_types):
+    """Yield a zip archive of rendered endcards, written incrementally.
+
+    Each endcard is rendered (through the render cache) only when its entry
+    is reached, so the archive is never built in memory. The endcards are
+    loaded here rather than passed in, since the response is streamed after
+    the view's database session has been torn down.
+    """
+    endcards = (Endcard.owned_by(user_id)
+                .filter(Endcard.id.in_(endcard_ids))
+                .order_by(Endcard.created_at.desc(), Endcard.id)
+                .all())
+
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for endcard in endcards:
+            for template_type in template_types:
+                chunks, _, _ = render_endcard(endcard, template_type)
+                with archive.open(f"endcard_{template_type}_{endcard.id}.html", 'w') as entry:
+                    for chunk in chunks:
+                        entry.write(chunk)
+                        yield from buffer.drain()
+                yield from buffer.drain()
+    # Closing the archive writes the central directory
+    yield from buffer.drain()